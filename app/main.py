@@ -26,6 +26,7 @@ from app.routes.whatsapp_routes import whatsapp_router
 from app.routes.admin_routes import admin_router
 from app.routes.test_routes import test_router
 from app.routes.pdf_routes import pdf_router
+from app.utils.service_utils import close_services
 from app.models import (
     HealthStatus,
     DetailedHealthStatus,
@@ -60,6 +61,7 @@ async def lifespan(app: FastAPI):
 
     # Shutdown
     logger.info("Shutting down BGR Export WhatsApp Bot")
+    await close_services()
 
 app = FastAPI(
     title="BGR Export WhatsApp Bot API",
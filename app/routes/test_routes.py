@@ -145,7 +145,7 @@ async def test_pdf_send(
         pricing_service, interactive_service, pdf_generator, whatsapp_sender, openai_service = get_services()
 
         # Generar PDF de prueba
-        pdf_path = pdf_generator.generate_quote_pdf(test_quote, f"whatsapp:{phone_number}")
+        pdf_path = await pdf_generator.generate_quote_pdf_async(test_quote, f"whatsapp:{phone_number}")
 
         if pdf_path:
             # Intentar enviar por WhatsApp
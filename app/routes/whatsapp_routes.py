@@ -1,3 +1,4 @@
+import asyncio
 import logging
 import os
 import re
@@ -164,17 +165,18 @@ async def whatsapp_webhook(request: Request,
             logger.info("🎤 Procesando mensaje de audio...")
             audio_handler = AudioHandler()
 
-            # Descargar audio de forma segura
+            # Descargar audio de forma segura; el archivo temporal vive hasta
+            # terminar la transcripción. La descarga usa requests (bloqueante),
+            # así que se ejecuta en un hilo para no frenar el event loop
             with SecureTempFile(suffix=".ogg") as temp_path:
-                audio_path = audio_handler.download_audio_from_twilio(MediaUrl0, temp_path)
-
-            if audio_path:
+                audio_path = await asyncio.to_thread(
+                    audio_handler.download_audio_from_twilio, MediaUrl0, temp_path
+                )
                 # Transcribir audio
-                transcription = openai_service.transcribe_audio(audio_path)
-
-                # Limpiar archivo temporal
-                audio_handler.cleanup_temp_file(audio_path)
+                transcription = await openai_service.transcribe_audio_async(audio_path) if audio_path else None
 
+            # SecureTempFile ya borró el audio al salir del bloque
+            if audio_path:
                 if transcription:
                     # Usar la transcripción como el mensaje de texto
                     Body = transcription
@@ -329,7 +331,7 @@ async def whatsapp_webhook(request: Request,
 
                         # Generar PDF automáticamente
                         logger.info(f"📄 Generando PDF automáticamente en idioma {user_lang} para usuario {user_id}")
-                        pdf_path = pdf_generator.generate_quote_pdf(price_info, From, user_lang)
+                        pdf_path = await pdf_generator.generate_quote_pdf_async(price_info, From, user_lang)
 
                         if pdf_path:
                             pdf_sent = whatsapp_sender.send_pdf_document(
@@ -474,7 +476,7 @@ async def whatsapp_webhook(request: Request,
                         session_manager.set_user_language(user_id, user_lang)
 
                         logger.info(f"📄 Generando PDF consolidado con flete ${flete_value:.2f}")
-                        pdf_path = pdf_generator.generate_consolidated_quote_pdf(
+                        pdf_path = await pdf_generator.generate_consolidated_quote_pdf_async(
                             products_info,
                             From,
                             user_lang,
@@ -635,7 +637,7 @@ Ejemplo: "flete 0.22\""""
                             session_manager.set_user_language(user_id, user_lang)
 
                             logger.info(f"📄 Generando PDF consolidado con flete ${flete_value:.2f}")
-                            pdf_path = pdf_generator.generate_consolidated_quote_pdf(
+                            pdf_path = await pdf_generator.generate_consolidated_quote_pdf_async(
                                 products_info,
                                 From,
                                 user_lang,
@@ -787,7 +789,7 @@ Ejemplo: "flete 0.22\""""
                         session_manager.set_user_language(user_id, user_lang)
 
                         logger.info(f"📄 Generando PDF consolidado con flete ${flete_value:.2f}")
-                        pdf_path = pdf_generator.generate_consolidated_quote_pdf(
+                        pdf_path = await pdf_generator.generate_consolidated_quote_pdf_async(
                             products_info,
                             From,
                             user_lang,
@@ -899,7 +901,7 @@ Ejemplo: "flete 0.22\""""
                             destination = price_info.get('destination', '')
 
                             logger.info(f"📄 Generando PDF automáticamente con flete ${flete_value:.2f} para usuario {user_id}")
-                            pdf_path = pdf_generator.generate_quote_pdf(price_info, From, user_lang)
+                            pdf_path = await pdf_generator.generate_quote_pdf_async(price_info, From, user_lang)
 
                             if pdf_path:
                                 pdf_sent = whatsapp_sender.send_pdf_document(
@@ -956,9 +958,10 @@ Ejemplo: "flete 0.22\""""
 
         # Detectar si el mensaje tiene indicadores de cotización (tallas, términos específicos)
         # Soporta formatos: 16/20, 16-20, 21/25, 21-25, etc.
-        has_size = bool(re.search(r'\b\d+[/-]\d+\b', Body.lower()))
+        body_lower = Body.lower()
+        has_size = bool(re.search(r'\b\d+[/-]\d+\b', body_lower))
         quote_keywords = ['proforma', 'cotizacion', 'cotizar', 'precio', 'necesito', 'contenedor', 'cfr', 'cif', 'cocedero', 'lagostino', 'inteiro', 'colas']
-        has_quote_keywords = any(keyword in Body.lower() for keyword in quote_keywords)
+        has_quote_keywords = any(keyword in body_lower for keyword in quote_keywords)
         is_complex_quote = has_size or has_quote_keywords
 
         # Usar OpenAI para:
@@ -971,9 +974,15 @@ Ejemplo: "flete 0.22\""""
             openai_service.is_available()
         )
 
+        # Respuesta al cliente redactada en la misma llamada que el análisis;
+        # se usa más abajo si ningún flujo específico atiende el mensaje
+        prepared_reply = None
+
         if should_use_openai:
             logger.info(f"🤖 Usando OpenAI para análisis (complex_quote={is_complex_quote}, confidence={ai_analysis.get('confidence', 0)})")
-            openai_analysis = openai_service.analyze_user_intent(Body, session)
+            combined = await openai_service.analyze_and_respond_async(Body, session)
+            openai_analysis = combined['intent']
+            prepared_reply = combined['reply']
             logger.debug(f"🤖 Análisis OpenAI complementario para {user_id}: {openai_analysis}")
 
             # Combinar resultados: usar OpenAI si es más confiable O tiene información adicional
@@ -1062,7 +1071,7 @@ Ejemplo: "flete 0.22\""""
 
                             user_language = session_manager.get_user_language(user_id)
                             logger.info(f"📄 Regenerando PDF consolidado con nuevo flete ${new_flete:.2f}")
-                            pdf_path = pdf_generator.generate_consolidated_quote_pdf(
+                            pdf_path = await pdf_generator.generate_consolidated_quote_pdf_async(
                                 recalculated,
                                 From,
                                 user_language,
@@ -1094,7 +1103,7 @@ Ejemplo: "flete 0.22\""""
                         session_manager.set_last_quote(user_id, new_price_info)
                         user_language = session_manager.get_user_language(user_id)
                         logger.info(f"📄 Regenerando PDF con nuevo flete ${new_flete:.2f}")
-                        pdf_path = pdf_generator.generate_quote_pdf(new_price_info, From, user_language)
+                        pdf_path = await pdf_generator.generate_quote_pdf_async(new_price_info, From, user_language)
 
                         if pdf_path:
                             old_flete = last_quote.get('flete', 0)
@@ -1290,7 +1299,7 @@ Ejemplo: "flete 0.22\""""
                                 session_manager.set_user_language(user_id, user_lang)
                                 
                                 logger.info(f"📄 Generando PDF consolidado con flete ${flete_custom:.2f}")
-                                pdf_path = pdf_generator.generate_consolidated_quote_pdf(
+                                pdf_path = await pdf_generator.generate_consolidated_quote_pdf_async(
                                     products_info,
                                     From,
                                     user_lang,
@@ -1602,7 +1611,7 @@ Ejemplo: "flete 0.22\""""
                                 session_manager.set_user_language(user_id, user_lang)
                                 
                                 logger.info(f"📄 Generando PDF consolidado con flete ${flete_custom:.2f}")
-                                pdf_path = pdf_generator.generate_consolidated_quote_pdf(
+                                pdf_path = await pdf_generator.generate_consolidated_quote_pdf_async(
                                     products_info,
                                     From,
                                     user_lang,
@@ -2059,7 +2068,7 @@ U15, 16/20, 20/30, 21/25, 26/30, 30/40, 31/35, 36/40, 40/50, 41/50, 50/60, 51/60
                     size = price_info.get('talla', '')
 
                     logger.info(f"📄 Generando PDF automáticamente en idioma {user_lang} para usuario {user_id}")
-                    pdf_path = pdf_generator.generate_quote_pdf(price_info, From, user_lang)
+                    pdf_path = await pdf_generator.generate_quote_pdf_async(price_info, From, user_lang)
 
                     if pdf_path:
                         pdf_sent = whatsapp_sender.send_pdf_document(
@@ -2280,7 +2289,7 @@ U15, 16/20, 20/30, 21/25, 26/30, 30/40, 31/35, 36/40, 40/50, 41/50, 50/60, 51/60
 
                             # Generar PDF consolidado
                             logger.info(f"📄 Regenerando PDF consolidado con nuevo flete ${new_flete:.2f}")
-                            pdf_path = pdf_generator.generate_consolidated_quote_pdf(
+                            pdf_path = await pdf_generator.generate_consolidated_quote_pdf_async(
                                 recalculated,
                                 From,
                                 user_language,
@@ -2318,7 +2327,7 @@ U15, 16/20, 20/30, 21/25, 26/30, 30/40, 31/35, 36/40, 40/50, 41/50, 50/60, 51/60
 
                         # Generar nuevo PDF automáticamente
                         logger.info(f"📄 Regenerando PDF con nuevo flete ${new_flete:.2f}")
-                        pdf_path = pdf_generator.generate_quote_pdf(new_price_info, From, user_language)
+                        pdf_path = await pdf_generator.generate_quote_pdf_async(new_price_info, From, user_language)
 
                         if pdf_path:
                             # Enviar mensaje de confirmación
@@ -2416,7 +2425,7 @@ Responde con el número o escribe:
             if selected_language and quote_data:
                 # Generar PDF en el idioma seleccionado
                 logger.info(f"Generando PDF en idioma {selected_language} para usuario {user_id}")
-                pdf_path = pdf_generator.generate_quote_pdf(quote_data, From, selected_language)
+                pdf_path = await pdf_generator.generate_quote_pdf_async(quote_data, From, selected_language)
 
                 if pdf_path:
                     # Crear URL pública del PDF para envío
@@ -2595,7 +2604,7 @@ Responde con el número o escribe:
                         net_weight = session['data'].get('net_weight')
                         cantidad = session['data'].get('cantidad')
                         
-                        pdf_path = pdf_generator.generate_consolidated_quote_pdf(
+                        pdf_path = await pdf_generator.generate_consolidated_quote_pdf_async(
                             products_info,
                             From,
                             user_lang,
@@ -2672,7 +2681,7 @@ Responde con el número o escribe:
 
                     # Generar PDF consolidado
                     logger.info(f"📄 Generando PDF consolidado con {len(products_info)} productos")
-                    pdf_path = pdf_generator.generate_consolidated_quote_pdf(
+                    pdf_path = await pdf_generator.generate_consolidated_quote_pdf_async(
                         products_info,
                         From,
                         selected_language,
@@ -2784,7 +2793,7 @@ Responde con el número o escribe:
 
                     # Generar PDF en el idioma seleccionado
                     logger.info(f"📄 Generando PDF para usuario {user_id} en idioma {selected_language}")
-                    pdf_path = pdf_generator.generate_quote_pdf(price_info, From, selected_language)
+                    pdf_path = await pdf_generator.generate_quote_pdf_async(price_info, From, selected_language)
 
                     if pdf_path:
                         logger.info(f"✅ PDF generado exitosamente: {pdf_path}")
@@ -3032,7 +3041,7 @@ Responde con el número o escribe:
         # Solo usar OpenAI para casos complejos
         elif openai_service.is_available() and ai_analysis and ai_analysis.get('confidence', 0) > 0.7:
             logger.debug(f"🤖 Intentando respuesta OpenAI para confianza: {ai_analysis.get('confidence', 0)}")
-            smart_response = openai_service.generate_smart_response(Body, session)
+            smart_response = prepared_reply or await openai_service.generate_smart_response_async(Body, session)
             logger.debug(f"🤖 Respuesta OpenAI obtenida: {smart_response}")
 
         # Fallback para otros casos
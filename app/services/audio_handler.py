@@ -11,9 +11,12 @@ class AudioHandler:
         self.twilio_account_sid = os.getenv("TWILIO_ACCOUNT_SID")
         self.twilio_auth_token = os.getenv("TWILIO_AUTH_TOKEN")
 
-    def download_audio_from_twilio(self, media_url: str) -> str | None:
+    def download_audio_from_twilio(self, media_url: str, dest_path: str = None) -> str | None:
         """
         Descarga un archivo de audio desde Twilio y lo guarda temporalmente
+
+        Si se indica dest_path (p. ej. un SecureTempFile del llamador) el audio
+        se escribe ahí; si no, en un archivo temporal nuevo.
         """
         try:
             logger.info(f"🎤 Descargando audio desde: {media_url}")
@@ -26,10 +29,15 @@ class AudioHandler:
             )
 
             if response.status_code == 200:
-                # Crear archivo temporal
-                with tempfile.NamedTemporaryFile(delete=False, suffix='.ogg') as temp_file:
-                    temp_file.write(response.content)
-                    temp_path = temp_file.name
+                if dest_path:
+                    with open(dest_path, 'wb') as dest_file:
+                        dest_file.write(response.content)
+                    temp_path = dest_path
+                else:
+                    # Crear archivo temporal
+                    with tempfile.NamedTemporaryFile(delete=False, suffix='.ogg') as temp_file:
+                        temp_file.write(response.content)
+                        temp_path = temp_file.name
 
                 logger.debug(f"✅ Audio descargado en: {temp_path}")
                 return temp_path
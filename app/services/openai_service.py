@@ -1,15 +1,657 @@
-import json
+import asyncio
+import io
 import logging
+import mimetypes
 import os
+import random
 import re
+import secrets
+import tempfile
+import threading
 import time
 import hashlib
+import unicodedata
+import importlib.util
+from collections import OrderedDict
+from collections.abc import AsyncIterator, Iterator
+from functools import lru_cache
 from typing import Optional, Dict, Any, List, Tuple
 
+import httpx
+import numpy as np
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from app.utils.language_utils import glaseo_percentage_to_factor
 
 logger = logging.getLogger(__name__)
 
+
+# Motor RE2 opcional (google-re2): tiempo lineal garantizado. Los patrones con
+# captura perezosa ([...]+?) seguida de alternativas de cierre son O(n²) en `re`
+# cuando el mensaje repite el prefijo y la búsqueda falla ("para para ... !")
+_re2 = importlib.import_module("re2") if importlib.util.find_spec("re2") else None
+
+# En RE2 \w y \s son solo ASCII: se traducen a clases Unicode equivalentes a las de `re`
+_RE2_WORD = r'\pL\pN_'
+_RE2_SPACE = ''.join(f'\\x{{{ord(char):x}}}' for char in map(chr, range(0x3001)) if char.isspace())
+_CHAR_CLASS_RE = re.compile(r'(\[[^\]]*\])')
+
+# Autómata Aho-Corasick opcional (pyahocorasick) para la pasada de palabras clave
+_ahocorasick = importlib.import_module("ahocorasick") if importlib.util.find_spec("ahocorasick") else None
+
+# Hash no criptográfico opcional (xxhash) para las claves de caché: estable entre
+# procesos y ~20x más rápido que MD5 sobre un prompt de varios KB
+_xxhash = importlib.import_module("xxhash") if importlib.util.find_spec("xxhash") else None
+
+
+def _to_re2_syntax(pattern: str) -> str:
+    """Traduce un patrón de `re` a RE2 conservando la semántica Unicode de \\w, \\s y $."""
+    parts = _CHAR_CLASS_RE.split(pattern)
+    for index, part in enumerate(parts):
+        if index % 2:
+            # Dentro de una clase [...] se insertan los rangos sin corchetes
+            parts[index] = part.replace(r'\w', _RE2_WORD).replace(r'\s', _RE2_SPACE)
+        else:
+            # En `re`, $ también coincide antes de un salto de línea final
+            parts[index] = re.sub(r'(?<!\\)\$', r'\\n?$', part).replace(
+                r'\w', f'[{_RE2_WORD}]'
+            ).replace(r'\s', f'[{_RE2_SPACE}]')
+    return ''.join(parts)
+
+
+class _LinearPattern:
+    """
+    Regex ejecutado con RE2 (tiempo lineal) y con `re` como respaldo.
+
+    RE2 trabaja sobre UTF-8 y rechaza surrogates sueltos; en ese caso se usa `re`.
+    """
+
+    def __init__(self, pattern: str):
+        self._re = re.compile(pattern)
+        self._re2 = _re2.compile(_to_re2_syntax(pattern))
+
+    def search(self, text: str, pos: int = 0):
+        try:
+            return self._re2.search(text, pos)
+        except UnicodeEncodeError:
+            return self._re.search(text, pos)
+
+    def match(self, text: str, pos: int = 0):
+        try:
+            return self._re2.match(text, pos)
+        except UnicodeEncodeError:
+            return self._re.match(text, pos)
+
+
+def _compile_linear(pattern: str):
+    """Compila con RE2 si google-re2 está instalado; si no, con `re`."""
+    return _LinearPattern(pattern) if _re2 is not None else re.compile(pattern)
+
+
+_WHITESPACE_RE = re.compile(r'\s+')
+
+
+def _fold_text(text: str) -> str:
+    """
+    Forma canónica para la detección por palabras clave: minúsculas, sin
+    tildes (ñ → n) y con los espacios colapsados.
+
+    Así "Cotización", "cotizacion" y "COTIZACIÓN" se detectan igual. Solo se
+    usa para detectar; la extracción de datos (cliente, destino) trabaja sobre
+    el texto original para conservar las tildes.
+    """
+    text = text.lower()
+    if not text.isascii():
+        text = unicodedata.normalize('NFKD', text).encode('ascii', 'ignore').decode('ascii')
+    return _WHITESPACE_RE.sub(' ', text)
+
+
+def _keyword_scanner(keywords: frozenset):
+    """
+    Devuelve una función texto → frozenset de las palabras clave que contiene.
+
+    Las palabras clave se comparan en su forma plegada (_fold_text), así que el
+    texto debe pasarse ya plegado; cada coincidencia devuelve todas las
+    palabras originales con esa forma ('envio' y 'envío').
+
+    Con pyahocorasick es un autómata Aho-Corasick: una sola pasada en C sobre
+    el texto, con coincidencias solapadas, sin importar cuántas palabras haya.
+    Sin él, una búsqueda de subcadena por palabra clave.
+    """
+    folded: dict[str, set] = {}
+    for keyword in keywords:
+        folded.setdefault(_fold_text(keyword), set()).add(keyword)
+    folded = {form: frozenset(originals) for form, originals in folded.items()}
+
+    if _ahocorasick is None:
+        return lambda text: frozenset().union(*(
+            originals for form, originals in folded.items() if form in text
+        ))
+
+    automaton = _ahocorasick.Automaton()
+    for form, originals in folded.items():
+        automaton.add_word(form, originals)
+    automaton.make_automaton()
+    return lambda text: frozenset().union(*(originals for _, originals in automaton.iter(text)))
+
+
+class _OrderedPatterns:
+    """
+    Lista ordenada de regex fusionada en una sola alternancia.
+
+    Mantiene la semántica de probar los patrones uno a uno en orden, pero en el
+    caso común hace un solo escaneo del texto: la alternancia encuentra el match
+    más a la izquierda y solo se re-verifican los patrones de mayor prioridad
+    que el que coincidió (ninguno si coincidió el primero).
+    """
+
+    def __init__(self, patterns: tuple[str, ...], compiler=re.compile):
+        self.patterns = tuple(compiler(pattern) for pattern in patterns)
+        self._fused = compiler('|'.join(f'(?P<p{index}>{pattern})' for index, pattern in enumerate(patterns)))
+
+    def iter_matches(self, text: str) -> Iterator[re.Match]:
+        """Emite el primer match de cada patrón que aparece en el texto, en orden."""
+        fused_match = self._fused.search(text)
+        if fused_match is None:
+            return
+
+        # Índice de la alternativa que coincidió más a la izquierda
+        matched = next(
+            index for index in range(len(self.patterns))
+            if fused_match.group(f'p{index}') is not None
+        )
+        for index, pattern in enumerate(self.patterns):
+            if index == matched:
+                # Su primer match es el de la alternancia: ningún patrón coincide antes
+                match = pattern.match(text, fused_match.start())
+            else:
+                match = pattern.search(text)
+            if match:
+                yield match
+
+    def first_match(self, text: str) -> re.Match | None:
+        """Match del primer patrón (en orden) que aparece en el texto."""
+        return next(self.iter_matches(text), None)
+
+
+# ==================== PATRONES DE _basic_intent_analysis ====================
+# Compilados una sola vez al importar el módulo en lugar de en cada mensaje.
+# Los *_ANCHORS son subcadenas que todo patrón de su lista necesita: si ninguna
+# aparece en el mensaje, la lista de regex ni se ejecuta. Forman parte de
+# INTENT_KEYWORDS, así que se detectan en la misma pasada única del mensaje.
+
+# Tallas con "/" o "-" (indicador fuerte de cotización) y solo con "/"
+_SIZE_ANY_RE = re.compile(r'\b\d+[/-]\d+\b')
+_SIZE_SLASH_RE = re.compile(r'\b\d+/\d+\b')
+# Tallas sin límites de palabra; la variante con espacios ("20 / 30") cuenta tallas en _is_obvious_intent
+_SIZE_TOKEN_RE = re.compile(r'\d+/\d+')
+_SIZE_SPACED_RE = re.compile(r'\d+\s*[/-]\s*\d+')
+
+# Saludos del fallback sin GPT (fusionados en una sola alternancia)
+_FALLBACK_GREETING_RE = re.compile(r'\b(?:hola|hello|hi|buenos|buenas|hey|qué tal|cómo estás)\b')
+
+# Saludos (con límites de palabra para evitar falsos positivos)
+_GREETING_RES = tuple(re.compile(pattern) for pattern in (
+    r'\bhola\b', r'\bhello\b', r'\bhi\b', r'\bbuenos\b', r'\bbuenas\b',
+    r'\bcomo estas\b', r'\bque tal\b', r'\bq haces\b',
+))
+
+# Verbos explícitos de modificación de flete
+_MODIFY_FLETE_RES = tuple(re.compile(pattern) for pattern in (
+    r'\bmodifica.*flete', r'\bcambiar.*flete', r'\bactualizar.*flete',
+    r'\bnuevo.*flete', r'\botro.*flete', r'\bflete.*diferente',
+    r'\bmodify.*freight', r'\bchange.*freight', r'\bupdate.*freight',
+))
+
+# Nuevo valor de flete en una solicitud de modificación
+_MODIFY_FLETE_VALUE_RES = _OrderedPatterns((
+    r'flete\s+a\s+(?:\$\s*)?(\d+\.?\d*)',  # "flete a 0.30"
+    r'flete\s*(?:de\s*)?(?:\$\s*)?(\d+\.?\d*)',
+    r'(\d+\.?\d*)\s*(?:centavos?\s*)?(?:de\s*)?flete',
+    r'con\s*(\d+\.?\d*)\s*(?:de\s*)?flete',
+    r'freight\s*(?:of\s*)?(?:\$\s*)?(\d+\.?\d*)',
+    r'(\d+\.?\d*)\s*freight',
+))
+
+# Tallas: 21/25, 21 sobre 25, 21-25, 21 25
+_SIZE_RES = tuple(re.compile(pattern) for pattern in (
+    r'(\d+/\d+)',  # 21/25
+    r'(\d+)\s*sobre\s*(\d+)',  # 21 sobre 25
+    r'(\d+)\s*-\s*(\d+)',  # 21-25
+    r'(\d+)\s+(\d+)',  # 21 25
+
+))
+
+# Glaseo en español e inglés (incluye 0% = sin glaseo)
+_GLASEO_RES = _OrderedPatterns((
+    # Patrones en español
+    r'(\d+)\s*(?:de\s*)?glaseo',
+    r'glaseo\s*(?:de\s*)?(\d+)',
+    r'(\d+)\s*%\s*glaseo',
+    r'glaseo\s*(\d+)\s*%',
+    r'con\s*(\d+)\s*glaseo',
+    r'(\d+)\s*porciento\s*glaseo',
+    # Patrones adicionales para "al X%" y "al X"
+    r'al\s*(\d+)\s*%',  # "al 20%"
+    r'al\s*(\d+)(?:\s|$)',  # "al 20" (sin %)
+    r'(\d+)\s*%\s*de\s*glaseo',
+    r'(\d+)\s*%\s*glaseo',
+    # Patrón para "Inteiro 0%" o "0%" solo
+    r'(?:inteiro|entero|colas?|tails?)\s+(\d+)\s*%',  # "Inteiro 0%"
+    r'^\s*(\d+)\s*%',  # "0%" al inicio
+    # Patrones en inglés
+    r'(\d+)g?\s*(?:of\s*)?glaze',
+    r'glaze\s*(?:of\s*)?(\d+)g?',
+    r'(\d+)\s*%\s*glaze',
+    r'glaze\s*(\d+)\s*%',
+    r'with\s*(\d+)g?\s*glaze',
+    r'(\d+)\s*percent\s*glaze',
+    r'at\s*(\d+)\s*%',  # "at 20%"
+    r'at\s*(\d+)(?:\s|$)',  # "at 20" (sin %)
+
+))
+
+# DDP (precio que ya incluye flete)
+_DDP_RES = tuple(re.compile(pattern) for pattern in (
+    r'\bddp\b',  # DDP con límites de palabra
+    r'ddp\s',    # DDP seguido de espacio
+    r'\sddp',    # DDP precedido de espacio
+    r'precio\s+ddp',
+    r'ddp\s+price',
+    r'delivered\s+duty\s+paid',
+))
+_DDP_ANCHORS = frozenset({'ddp', 'delivered'})
+
+# Valor de flete en una solicitud de cotización
+_FLETE_RES = _OrderedPatterns((
+    r'flete\s*(?:de\s*)?(?:\$\s*)?(\d+\.?\d*)',  # "flete de 0.20", "flete $0.20"
+    r'(\d+\.?\d*)\s*(?:centavos?\s*)?(?:de\s*)?flete',  # "0.20 centavos de flete"
+    r'con\s*(\d+\.?\d*)\s*(?:de\s*)?flete',  # "con 0.20 de flete"
+    r'freight\s*(?:of\s*)?(?:\$\s*)?(\d+\.?\d*)',  # "freight 0.20", "freight $0.20"
+    r'(\d+\.?\d*)\s*freight',  # "0.20 freight"
+
+))
+_FLETE_ANCHORS = frozenset({'flete', 'freight'})
+
+# Destino tras CFR/CIF/C&F, flete a, envío a, hacia, shipping to
+_ENVIO_SPECIFIC_RES = tuple(_compile_linear(pattern) for pattern in (
+    r'cfr\s+([a-záéíóúñ\w\s]+?)(?:\s+para|\s+con|\s+de|$)',        # "CFR Lisboa"
+    r'cif\s+([a-záéíóúñ\w\s]+?)(?:\s+para|\s+con|\s+de|$)',        # "CIF Lisboa"
+    r'c&f\s+([a-záéíóúñ\w\s]+?)(?:\s+para|\s+con|\s+de|$)',        # "C&F Lisboa"
+    r'flete\s+a\s+([a-záéíóúñ\w\s]+?)(?:\s+para|\s+con|\s+de|$)',  # "flete a japón"
+    r'envio\s+a\s+([a-záéíóúñ\w\s]+?)(?:\s+para|\s+con|\s+de|$)',  # "envío a china"
+    r'hacia\s+([a-záéíóúñ\w\s]+?)(?:\s+para|\s+con|\s+de|$)',      # "hacia europa"
+    r'shipping\s+to\s+([a-zA-Z\s]+?)(?:\s+for|\s+with|$)',         # "shipping to japan"
+
+))
+_ENVIO_SPECIFIC_ANCHORS = frozenset({'cfr', 'cif', 'c&f', 'flete', 'envio', 'hacia', 'shipping'})
+
+# Destino tras flete a / envío a / shipping to
+_ENVIO_RES = tuple(re.compile(pattern) for pattern in (
+    r'flete a ([a-zA-Z\s]+)', r'envio a ([a-zA-Z\s]+)', r'enviar a ([a-zA-Z\s]+)',
+    r'shipping to ([a-zA-Z\s]+)', r'con flete a ([a-zA-Z\s]+)',
+))
+_ENVIO_ANCHORS = frozenset({'flete a ', 'envio a ', 'enviar a ', 'shipping to '})
+
+# Destinos conocidos y sus alias, en orden de prioridad de detección
+_DESTINATION_PATTERNS = {
+    # Ciudades USA
+    'Houston': ['houston', 'houton', 'huston'],
+    'Miami': ['miami', 'maiami', 'florida'],
+    'New York': ['new york', 'nueva york', 'ny', 'newyork'],
+    'Los Angeles': ['los angeles', 'california'],  # Removido 'la' genérico
+    'Chicago': ['chicago', 'chicaco'],
+    'Dallas': ['dallas', 'dalas'],
+
+    # Ciudades Europa
+    'Lisboa': ['lisboa', 'lisbon', 'portugal'],
+    'Madrid': ['madrid', 'españa', 'spain'],
+    'Barcelona': ['barcelona'],
+    'Paris': ['paris', 'france', 'francia'],
+    'Londres': ['londres', 'london', 'uk', 'reino unido'],
+    'Roma': ['roma', 'rome', 'italy', 'italia'],
+    'Berlin': ['berlin', 'germany', 'alemania'],
+    'Amsterdam': ['amsterdam', 'netherlands', 'holanda'],
+
+    # Países y regiones
+    'China': ['china', 'beijing', 'shanghai'],
+    'Japón': ['japon', 'japón', 'japan', 'tokyo', 'nippon'],
+    'Europa': ['europa', 'europe'],
+    'Brasil': ['brasil', 'brazil', 'sao paulo', 'rio'],
+    'México': ['mexico', 'méxico', 'guadalajara', 'monterrey'],
+    'Canadá': ['canada', 'toronto', 'vancouver'],
+    'Australia': ['australia', 'sydney', 'melbourne'],
+    'Corea': ['corea', 'korea', 'seoul'],
+    'India': ['india', 'mumbai', 'delhi'],
+    'Tailandia': ['tailandia', 'thailand', 'bangkok'],
+    'Vietnam': ['vietnam', 'ho chi minh'],
+    'Singapur': ['singapur', 'singapore'],
+    'Filipinas': ['filipinas', 'philippines', 'manila'],
+    'Indonesia': ['indonesia', 'jakarta'],
+    'Malasia': ['malasia', 'malaysia', 'kuala lumpur'],
+}
+
+# Ciudades USA: cotizan en libras, salvo Houston que usa kilos
+_USA_DESTINATIONS = frozenset({'Houston', 'Miami', 'New York', 'Los Angeles', 'Chicago', 'Dallas'})
+
+# Índice inverso alias → (destino, usar_libras), en el mismo orden de prioridad:
+# una sola pasada sobre los alias en lugar del bucle anidado destino/alias
+_ALIAS_TO_DEST = {
+    alias: (dest_name, dest_name in _USA_DESTINATIONS and dest_name != 'Houston')
+    for dest_name, aliases in _DESTINATION_PATTERNS.items()
+    for alias in aliases
+}
+
+# Nombre del cliente (español e inglés)
+_CLIENTE_RES = _OrderedPatterns((
+    # Patrones en español
+    r'cliente\s+([a-záéíóúñ\w\s]+?)(?:\s+con|\s+de|\s+para|\s+precio|$)',
+    r'para\s+(?:el\s+cliente\s+)?([a-záéíóúñ\w\s]+?)(?:\s+con|\s+de|\s+precio|$)',
+    r'proforma\s+para\s+(?:el\s+cliente\s+)?([a-záéíóúñ\w\s]+?)(?:\s+con|\s+de|\s+precio|$)',
+    r'cotizacion\s+para\s+([a-záéíóúñ\w\s]+?)(?:\s+con|\s+de|\s+precio|$)',
+    r'señor\s+([a-záéíóúñ\w\s]+?)(?:\s+con|\s+de|\s+precio|$)',
+    r'sr\s+([a-záéíóúñ\w\s]+?)(?:\s+con|\s+de|\s+precio|$)',
+    # Patrones en inglés
+    r'client\s+([a-záéíóúñ\w\s]+?)(?:\s+with|\s+for|\s+price|$)',
+    r'for\s+(?:the\s+client\s+)?([a-záéíóúñ\w\s]+?)(?:\s+with|\s+for|\s+price|$)',
+    r'proforma\s+for\s+(?:the\s+client\s+)?([a-záéíóúñ\w\s]+?)(?:\s+with|\s+for|\s+price|$)',
+    r'quote\s+for\s+([a-záéíóúñ\w\s]+?)(?:\s+with|\s+for|\s+price|$)',
+    r'mr\s+([a-záéíóúñ\w\s]+?)(?:\s+with|\s+for|\s+price|$)',
+    r'mrs\s+([a-záéíóúñ\w\s]+?)(?:\s+with|\s+for|\s+price|$)',
+), compiler=_compile_linear)
+# Palabras comunes que no forman parte del nombre del cliente (español e inglés)
+_CLIENTE_STOP_WORDS = frozenset({
+    'el', 'la', 'con', 'de', 'para', 'precio', 'tipo', 'glaseo',
+    'flete', 'producto', 'talla', 'envio', 'destino', 'kilo', 'kilos',
+    'the', 'with', 'for', 'price', 'type', 'glaze', 'freight',
+    'product', 'size', 'shipping', 'destination',
+})
+# "proforma"/"quote for" contienen "for", "cotizacion para" contiene "para", "mrs" contiene "mr"
+_CLIENTE_ANCHORS = frozenset({'client', 'para', 'señor', 'sr', 'for', 'mr'})
+
+# Porcentaje de peso neto (NET)
+_NET_RES = tuple(re.compile(pattern) for pattern in (
+    r'(\d+)\s*%\s*net',  # "100% NET"
+    r'net\s*(\d+)\s*%',  # "NET 100%"
+    r'(\d+)\s*%\s*neto',  # "100% neto"
+    r'neto\s*(\d+)\s*%',  # "neto 100%"
+
+))
+_NET_ANCHORS = frozenset({'net'})
+
+# Cantidad con formatos variados: un solo regex que captura número y unidad
+_QUANTITY_RE = re.compile(
+    r'(\d+(?:,\d{3})*)\s*(libras?|lbs?|kilos?|kgs?|toneladas?|tons?|pounds?)'  # "500 kg", "1,000 lbs"
+    r'|(\d+(?:\.\d+)?)\s*(mil|thousand)'  # "1.5 mil"
+    r'|(\d+)(k)/caja'  # "20k/caja" ("20kg/caja" ya lo captura la unidad kg)
+)
+# Prioridad por unidad (menor = gana) cuando el mensaje menciona varias cantidades
+_QUANTITY_UNIT_RANK = {
+    'libra': 0, 'libras': 0, 'lb': 0, 'lbs': 0,
+    'kilo': 1, 'kilos': 1, 'kg': 1, 'kgs': 1,
+    'tonelada': 2, 'toneladas': 2, 'ton': 2, 'tons': 2,
+    'mil': 3, 'thousand': 3,
+    'pound': 4, 'pounds': 4,
+    'k': 5,
+}
+
+# Aporte a la confianza de cada dato extraído de una proforma, en orden de bit:
+# talla, producto, destino, glaseo, tallas por producto
+_PROFORMA_CONFIDENCE_WEIGHTS = (0.2, 0.1, 0.1, 0.1, 0.1)
+
+
+def _proforma_confidence(mask: int) -> float:
+    """Confianza base 0.6 más el aporte de cada bit presente (máximo 0.95)."""
+    # Se suma en el mismo orden para obtener exactamente los mismos valores en coma flotante
+    confidence = 0.6
+    for bit, weight in enumerate(_PROFORMA_CONFIDENCE_WEIGHTS):
+        if mask >> bit & 1:
+            confidence += weight
+    return min(confidence, 0.95)
+
+
+# Tabla precalculada: la confianza de una proforma es un solo acceso por índice
+_PROFORMA_CONFIDENCE = tuple(_proforma_confidence(mask) for mask in range(1 << len(_PROFORMA_CONFIDENCE_WEIGHTS)))
+_QUANTITY_ANCHORS = frozenset({'libra', 'lb', 'kilo', 'kg', 'ton', 'mil', 'thousand', 'pound', 'k/caja'})
+
+# Números del mensaje (tallas, glaseo, cantidades) para la firma de la caché semántica
+_NUMBER_RE = re.compile(r'\d+')
+
+
+# Prompts del sistema: se construyen una sola vez al importar el módulo. Van
+# siempre como primer mensaje y sin datos dinámicos (esos viajan en el rol
+# user), así el prefijo es idéntico entre peticiones y la caché de prompts
+# de OpenAI puede reutilizarlo.
+_PRODUCT_CATALOG = (
+    "PRODUCTOS: HOSO, HLSO, P&D IQF, P&D BLOQUE, EZ PEEL, PuD-EUROPA, PuD-EEUU, COOKED, PRE-COCIDO, COCIDO SIN TRATAR\n"
+    "TALLAS: U15, 16/20, 20/30, 21/25, 26/30, 30/40, 31/35, 36/40, 40/50, 41/50, 50/60, 51/60, 60/70, 61/70, 70/80, 71/90"
+)
+
+_BASE_CONTEXT = f"""Eres ShrimpBot, el asistente comercial de BGR Export.
+{_PRODUCT_CATALOG}
+TONO: profesional, directo y conciso, trato de tú, máximo un emoji por mensaje."""
+
+# Reglas de extracción de intención, compartidas por el prompt de intención
+# y el combinado de analyze_and_respond
+_INTENT_RULES = """TÉRMINOS: Colas → HLSO; Colas Cocedero → COOKED; Inteiro/Entero → HOSO; Inteiro Cocedero o solo Cocedero → needs_product_type; CFR/CIF [ciudad] → destination + flete_solicitado; "con flete Y" → flete_custom: Y; BRINE → processing_type; "100% NET" → net_weight_percentage.
+REGLAS: con tallas el intent es "proforma"; extrae TODAS las tallas como X/X ("16-20" → "16/20"); Inteiro + Colas → sizes_inteiro y sizes_colas; glaseo X% → glaseo_factor (100-X)/100, 0% → null; extrae solo lo explícito.
+
+Ejemplo: "Cocedero CFR Lisboa: Inteiro 20/30. Colas 21/25" → {"intent":"proforma","needs_product_type":true,"product_category":"cocido","sizes_inteiro":["20/30"],"sizes_colas":["21/25"],"sizes":["20/30","21/25"],"destination":"Lisboa","flete_solicitado":true,"multiple_sizes":true,"confidence":0.95}
+
+Omite campos null/false. Campos: intent (proforma|pricing|product_info|greeting|help|other), product, size, sizes, sizes_by_product, sizes_inteiro, sizes_colas, multiple_sizes, multiple_products, multiple_presentations, needs_product_type, product_category, clarification_needed, glaseo_factor, glaseo_percentage, destination, flete_custom, flete_solicitado, is_ddp, cantidad, processing_type, net_weight_percentage, cliente_nombre, wants_proforma, language, confidence."""
+
+_SYSTEM_PROMPT_INTENT = f"""Extrae en JSON la solicitud de camarón/langostino.
+{_PRODUCT_CATALOG}
+
+{_INTENT_RULES}"""
+
+_SYSTEM_PROMPT_CONVERSATION = f"""{_BASE_CONTEXT}
+
+TÉRMINOS: Cocedero/Cocido → preguntar COOKED, PRE-COCIDO o COCIDO SIN TRATAR; Inteiro/Entero → HOSO o HLSO; Colas → HLSO; Colas Cocedero → COOKED; CFR/CIF + ciudad → destino con flete.
+FLUJO: detectar productos y tallas, preguntar glaseo si falta (0/10/20/30%), confirmar destino CFR/CIF, confirmar antes de generar proforma. Lista todas las tallas detectadas y no pidas datos que ya tienes.
+
+Responde en JSON: {{"response": "...", "action": "detect_products|ask_glaseo|ask_product_type|ask_language|generate_proforma|none", "data": {{"products": [...], "glaseo": 20, "destination": "..."}}}}
+Ejemplo: "Necesito HLSO 16/20" → {{"response": "HLSO 16/20. ¿Qué glaseo necesitas? (10%, 20% o 30%)", "action": "ask_glaseo", "data": {{"products": [{{"product": "HLSO", "size": "16/20"}}]}}}}"""
+
+# Reglas de la respuesta al cliente (generate_smart_response y analyze_and_respond)
+_REPLY_RULES = """Con producto + talla responde "Generando proforma de [producto] [talla]..." sin pedir más datos. Máximo: saludos 100, preguntas 150, confirmaciones y listados 200 caracteres."""
+
+_SYSTEM_PROMPT_SMART = f"""{_BASE_CONTEXT}
+
+{_REPLY_RULES}"""
+
+# Intención + respuesta en una sola llamada: el catálogo y el tono se envían
+# una vez en lugar de en dos prompts
+_SYSTEM_PROMPT_ANALYZE_AND_RESPOND = f"""{_BASE_CONTEXT}
+
+Responde en JSON: {{"intent": {{...}}, "reply": "..."}}. "intent" es la extracción de la solicitud de camarón/langostino; "reply" es la respuesta al cliente.
+
+INTENT:
+{_INTENT_RULES}
+
+REPLY: {_REPLY_RULES}"""
+
+_SYSTEM_PROMPT_PRICE = """Explica precios de camarón de forma clara y profesional.
+
+Incluye: producto, talla, desglose de precio (base, FOB, glaseo, final).
+Máximo 150 caracteres. Tono directo. Texto plano, sin JSON."""
+
+
+class _MultipartFileStream:
+    """
+    Cuerpo multipart/form-data que se lee por bloques desde disco.
+
+    requests envía cualquier objeto con read() por bloques, así que el archivo
+    de audio nunca se carga completo en memoria. Expone __len__ para que se
+    envíe Content-Length (sin chunked encoding) y tell()/seek() para que
+    urllib3 pueda rebobinar el cuerpo si reintenta la petición. __aiter__
+    permite enviarlo igual con httpx.AsyncClient.
+    """
+
+    CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, fields: dict[str, str], file_field: str, file_path: str):
+        self.boundary = secrets.token_hex(16)
+        filename = os.path.basename(file_path)
+        file_content_type = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+
+        head = io.BytesIO()
+        for name, value in fields.items():
+            head.write(
+                f'--{self.boundary}\r\n'
+                f'Content-Disposition: form-data; name="{name}"\r\n\r\n'
+                f'{value}\r\n'.encode()
+            )
+        head.write(
+            f'--{self.boundary}\r\n'
+            f'Content-Disposition: form-data; name="{file_field}"; filename="{filename}"\r\n'
+            f'Content-Type: {file_content_type}\r\n\r\n'.encode()
+        )
+        head.seek(0)
+        tail = io.BytesIO(f'\r\n--{self.boundary}--\r\n'.encode())
+
+        self._file = open(file_path, 'rb')
+        self._parts = [head, self._file, tail]
+        self._sizes = [len(head.getvalue()), os.path.getsize(file_path), len(tail.getvalue())]
+        self._index = 0
+        self._position = 0
+
+    @property
+    def content_type(self) -> str:
+        return f"multipart/form-data; boundary={self.boundary}"
+
+    def __len__(self) -> int:
+        return sum(self._sizes)
+
+    def read(self, size: int = -1) -> bytes:
+        if size is None or size < 0:
+            size = len(self) - self._position
+
+        chunks = []
+        while size > 0 and self._index < len(self._parts):
+            chunk = self._parts[self._index].read(size)
+            if not chunk:
+                self._index += 1
+                continue
+            chunks.append(chunk)
+            size -= len(chunk)
+
+        data = b"".join(chunks)
+        self._position += len(data)
+        return data
+
+    def tell(self) -> int:
+        return self._position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += len(self)
+
+        self._position = max(0, min(offset, len(self)))
+
+        # Ubicar la parte que contiene la nueva posición; las anteriores quedan
+        # consumidas y las posteriores rebobinadas
+        remaining = self._position
+        self._index = len(self._parts)
+        for index, (part, part_size) in enumerate(zip(self._parts, self._sizes, strict=True)):
+            if self._index < len(self._parts):
+                part.seek(0)
+            elif remaining < part_size:
+                part.seek(remaining)
+                self._index = index
+            else:
+                part.seek(part_size)
+                remaining -= part_size
+        return self._position
+
+    def close(self) -> None:
+        self._file.close()
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        while chunk := self.read(self.CHUNK_SIZE):
+            yield chunk
+
+    def __enter__(self) -> "_MultipartFileStream":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+class _CappedRetry(Retry):
+    """
+    Retry de urllib3 con tope en la espera de Retry-After.
+
+    urllib3 respeta Retry-After sin límite y bloquearía el hilo el tiempo que
+    pida el servidor; se limita a RETRY_AFTER_MAX como _retry_delay en async.
+    """
+
+    RETRY_AFTER_MAX = 60  # Igual que OpenAIService.RATE_LIMIT_DELAY
+
+    def get_retry_after(self, response) -> float | None:
+        retry_after = super().get_retry_after(response)
+        if retry_after is None:
+            return None
+        return min(retry_after, self.RETRY_AFTER_MAX)
+
+
+class _SemanticIntentCache:
+    """
+    Caché semántica de analyze_user_intent: reutiliza la respuesta de GPT de un
+    mensaje parafraseado ("cotiza HLSO 20/30 Houston" ~ "proforma HLSO 20/30
+    Houston") por similitud coseno de embeddings normalizados.
+
+    El acierto solo vale si además coincide la firma determinista del mensaje:
+    para el embedding "HLSO 20/30" y "HLSO 30/40" son casi idénticos, pero no
+    son la misma proforma. Buffer circular de tamaño fijo.
+    """
+
+    def __init__(self, size: int, threshold: float):
+        self.size = size
+        self.threshold = threshold
+        self.hits = 0
+        self._vectors: np.ndarray | None = None
+        self._entries: list[tuple[tuple, str]] = []  # (firma, JSON de la respuesta)
+        self._next = 0
+
+    def lookup(self, embedding: np.ndarray, signature: tuple) -> str | None:
+        if not self._entries:
+            return None
+
+        scores = self._vectors[:len(self._entries)] @ embedding
+        candidates = np.flatnonzero(scores >= self.threshold)
+        for index in candidates[np.argsort(-scores[candidates])]:
+            cached_signature, response = self._entries[index]
+            if cached_signature == signature:
+                self.hits += 1
+                return response
+        return None
+
+    def add(self, embedding: np.ndarray, signature: tuple, response: str) -> None:
+        if self._vectors is None:
+            self._vectors = np.zeros((self.size, embedding.shape[0]), dtype=np.float32)
+
+        self._vectors[self._next] = embedding
+        if len(self._entries) < self.size:
+            self._entries.append((signature, response))
+        else:
+            self._entries[self._next] = (signature, response)
+        self._next = (self._next + 1) % self.size
+
+    def clear(self) -> None:
+        self._vectors = None
+        self._entries.clear()
+        self._next = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
 class OpenAIService:
     """
     Servicio optimizado para interactuar con OpenAI GPT y Whisper.
@@ -32,38 +674,260 @@ class OpenAIService:
         'greeting': 100,            # Saludos breves: "¡Hola! 🦐 ¿Qué producto necesitas?"
         'quick_question': 150,      # Preguntas rápidas: "¿Qué glaseo necesitas? (10%, 20%, 30%)"
         'confirmation': 200,        # Confirmaciones: "Perfecto! Generando proforma de HLSO 16/20..."
-        'detailed_list': 300,       # Listados: Cuando se listan múltiples productos
+        'detailed_list': 200,       # Listados: Cuando se listan múltiples productos
         'price_explanation': 150,   # Explicaciones de precios
     }
 
+    # Historial enviado a GPT en cada turno
+    HISTORY_MAX_MESSAGES = 10       # Últimos N mensajes de la conversación
+    HISTORY_MAX_CHARS = 200         # Máximo de caracteres por mensaje del historial
+
     # Configuración de caché
     CACHE_TTL = 3600  # 1 hora en segundos
     CACHE_MAX_SIZE = 100  # Máximo 100 entradas en caché
+    INTENT_CACHE_SIZE = 4096  # Mensajes distintos recordados por _basic_intent_analysis
+    INTENT_RESPONSE_CACHE_SIZE = 4096  # Intenciones de GPT recordadas por analyze_user_intent y analyze_and_respond
+    # Caché semántica opcional (OPENAI_SEMANTIC_CACHE=true): cuesta un embedding por mensaje no cacheado
+    SEMANTIC_CACHE_SIZE = 1024
+    SEMANTIC_CACHE_THRESHOLD = 0.92
+
+    # Modelo base: chat sin fine-tuning, análisis JSON y extracción de intención
+    BASE_MODEL = "gpt-4o-mini"
 
     # Configuración de rate limiting
     MAX_RETRIES = 3
     RETRY_DELAY_BASE = 1  # Segundos
     RATE_LIMIT_DELAY = 60  # Esperar 60 segundos si hay rate limit
 
+    # Batch API: procesamiento diferido (hasta 24h) con ~50% menos costo
+    BATCH_ENDPOINT = "/v1/chat/completions"
+    BATCH_COMPLETION_WINDOW = "24h"
+
+    # Pool de conexiones HTTP (keep-alive con api.openai.com)
+    HTTP_POOL_CONNECTIONS = 20
+    HTTP_POOL_MAXSIZE = 50
+
+    # Cliente asíncrono (httpx): HTTP/2 multiplexa peticiones concurrentes en una conexión
+    HTTP_ASYNC_MAX_CONNECTIONS = 64
+    HTTP_ASYNC_MAX_KEEPALIVE = 32
+    HTTP_ASYNC_KEEPALIVE_EXPIRY = 30  # Segundos que una conexión ociosa sigue abierta
+
+    # Reintentos a nivel de transporte (urllib3) ante errores transitorios
+    HTTP_RETRY_TOTAL = 5
+    HTTP_RETRY_BACKOFF_FACTOR = 0.5  # 0s, 1s, 2s, 4s, 8s
+    HTTP_RETRY_BACKOFF_JITTER = 0.5  # Segundos aleatorios extra por reintento
+    HTTP_RETRY_STATUS_CODES = (408, 409, 429, 500, 502, 503, 504)
+    HTTP_TIMEOUT = 30  # Segundos por intento de chat/completions
+
+    # Espera máxima de una petición duplicada por la original: el peor caso de
+    # la original con todos sus reintentos (timeout por intento y Retry-After
+    # máximo entre intentos), para no abandonarla justo cuando la API va lenta
+    INFLIGHT_WAIT_TIMEOUT = HTTP_TIMEOUT * (HTTP_RETRY_TOTAL + 1) + RATE_LIMIT_DELAY * HTTP_RETRY_TOTAL
+
+    # Modo JSON de OpenAI: garantiza que la respuesta sea un objeto JSON válido
+    JSON_RESPONSE_FORMAT = {"type": "json_object"}
+
+    # Confianza mínima del análisis básico para no llamar a GPT en analyze_user_intent
+    INTENT_SKIP_LLM_CONFIDENCE = 0.8
+
+    # Extracción determinista: con temperatura 0 la respuesta cacheada es la misma que daría GPT
+    INTENT_TEMPERATURE = 0
+    INTENT_MAX_TOKENS = 400
+
+    # analyze_and_respond: JSON de intención + respuesta corta al cliente
+    ANALYZE_AND_RESPOND_MAX_TOKENS = 500
+
+    # Análisis de intención simultáneos en analyze_many (respeta el rate limit de OpenAI)
+    INTENT_CONCURRENCY = 20
+
+    # Palabras clave de _basic_intent_analysis (subcadenas del mensaje en minúsculas)
+    QUOTE_KEYWORDS = frozenset({
+        'proforma', 'cotizacion', 'cotizar', 'quote', 'precio', 'precios',
+        'necesito', 'quiero', 'contenedor', 'cfr', 'cif', 'fob',
+        'cocedero', 'cocido', 'lagostino', 'vannamei', 'inteiro', 'colas'
+    })
+    NEW_QUOTE_KEYWORDS = frozenset({'cotizar', 'cotizacion', 'proforma', 'quote', 'quotation', 'contenedor'})
+    PRICE_QUERY_KEYWORDS = frozenset({
+        # Palabras clave directas
+        'proforma', 'cotizacion', 'cotizar', 'quote', 'precio', 'precios',
+        # Verbos de acción
+        'creame', 'crear', 'generar', 'hazme', 'dame', 'quiero', 'necesito',
+        # Consultas de precio
+        'precio de', 'precio del', 'precio por', 'cuanto cuesta', 'cuanto vale',
+        'cuanto es', 'cual es el precio', 'saber el precio', 'conocer el precio',
+        # Variaciones comunes
+        'cost', 'value', 'rate', 'tarifa', 'valor', 'costo',
+        # Frases específicas
+        'envio a', 'con envio', 'para enviar', 'destino', 'shipping'
+    })
+    COCEDERO_TERMS = frozenset({'cocedero', 'cocido', 'cooked', 'cozido'})
+    INTEIRO_TERMS = frozenset({'inteiro', 'entero', 'whole'})
+    COLAS_TERMS = frozenset({'colas', 'tails', 'tail', 'cola'})
+    PRODUCT_INFO_KEYWORDS = frozenset({'producto', 'productos', 'camaron', 'camarones', 'hlso', 'hoso', 'p&d'})
+    HELP_KEYWORDS = frozenset({'ayuda', 'help', 'como', 'que puedes', 'opciones', '?'})
+    # Menciones de flete/DDP/CFR/CIF: habilitan la detección de destino
+    FLETE_MENTION_KEYWORDS = frozenset({
+        'flete', 'freight', 'envio', 'envío', 'shipping', 'transporte', 'ddp', 'cfr', 'cif', 'c&f'
+    })
+
+    # Detección de idioma: se cuenta cuántas palabras de cada conjunto aparecen
+    ENGLISH_KEYWORDS = frozenset({'quote', 'price', 'cost', 'freight', 'shipping', 'quotation', 'shrimp', 'product'})
+    SPANISH_KEYWORDS = frozenset({'proforma', 'cotizacion', 'precio', 'flete', 'envio', 'camaron', 'producto', 'glaseo'})
+
+    # Tipos de procesamiento y sus términos, en orden de prioridad
+    PROCESSING_TYPE_TERMS = {
+        'BRINE': frozenset({'brine', 'salmuera', 'salmoura'}),
+        'IQF': frozenset({'iqf', 'individual', 'individually'}),
+        'BLOCK': frozenset({'bloque', 'block', 'bloques'}),
+    }
+
+    # Tallas que solo existen en HOSO según la tabla de precios
+    HOSO_EXCLUSIVE_SIZES = frozenset({'20/30', '30/40', '40/50', '50/60', '60/70', '70/80'})
+
+    # Alias de productos en orden de prioridad (P&D IQF antes que COOKED, etc.)
+    # IMPORTANTE: "cola" sin "cocedero" = HLSO; solo "cola cocedero" = COOKED
+    PRODUCT_ALIASES = {
+        'COCIDO SIN TRATAR': frozenset({'cocido sin tratar', 'sin tratar', 'untreated', 'natural cocido'}),
+        'PRE-COCIDO': frozenset({'pre-cocido', 'pre cocido', 'precocido', 'pre-cooked', 'pre cooked'}),
+        'P&D IQF': frozenset({
+            'p&d iqf', 'pd iqf', 'p&d', 'pelado', 'peeled', 'deveined',
+            'limpio', 'procesado', 'pd', 'p d', 'pelado y desvenado'
+        }),
+        'P&D BLOQUE': frozenset({'p&d bloque', 'pd bloque', 'bloque', 'block', 'p&d block', 'pd block', 'pelado bloque'}),
+        'PuD-EUROPA': frozenset({'pud europa', 'pud-europa', 'europa', 'european', 'europeo'}),
+        'PuD-EEUU': frozenset({'pud eeuu', 'pud-eeuu', 'eeuu', 'usa', 'estados unidos'}),
+        'EZ PEEL': frozenset({'ez peel', 'ez', 'easy peel', 'facil pelado', 'fácil pelado'}),
+        'HLSO': frozenset({
+            'sin cabeza', 'hlso', 'head less', 'headless', 'descabezado',
+            'sin cabezas', 'tipo sin cabeza', 'cola', 'colas', 'tail', 'tails'
+        }),
+        'HOSO': frozenset({
+            'con cabeza', 'hoso', 'head on', 'entero', 'completo',
+            'con cabezas', 'tipo con cabeza', 'inteiro', 'whole'
+        }),
+        'COOKED': frozenset({'cooked', 'cocinado', 'preparado'}),
+    }
+
+    # Unión de todas las palabras clave: se recorren una sola vez por mensaje
+    INTENT_KEYWORDS = frozenset().union(
+        QUOTE_KEYWORDS, NEW_QUOTE_KEYWORDS, PRICE_QUERY_KEYWORDS,
+        COCEDERO_TERMS, INTEIRO_TERMS, COLAS_TERMS,
+        PRODUCT_INFO_KEYWORDS, HELP_KEYWORDS, FLETE_MENTION_KEYWORDS, ENGLISH_KEYWORDS, SPANISH_KEYWORDS,
+        *PRODUCT_ALIASES.values(), *PROCESSING_TYPE_TERMS.values(),
+        _DDP_ANCHORS, _FLETE_ANCHORS, _ENVIO_SPECIFIC_ANCHORS, _ENVIO_ANCHORS,
+        _CLIENTE_ANCHORS, _NET_ANCHORS, _QUANTITY_ANCHORS
+    )
+    _INTENT_KEYWORD_SCAN = staticmethod(_keyword_scanner(INTENT_KEYWORDS))
+
+    # Términos que cambian el producto o su proceso: forman parte de la firma de la caché semántica
+    SEMANTIC_SIGNATURE_KEYWORDS = frozenset().union(
+        COCEDERO_TERMS, INTEIRO_TERMS, COLAS_TERMS,
+        *PRODUCT_ALIASES.values(), *PROCESSING_TYPE_TERMS.values(),
+        _DDP_ANCHORS, _NET_ANCHORS
+    )
+
+    # Respuestas de get_smart_fallback_response por intención
+    FALLBACK_RESPONSES = {
+        # Respuesta rápida y directa para saludos
+        'greeting': "¡Hola! 🦐 ¿Qué producto de camarón necesitas? Te genero la cotización al instante 💰",
+        'pricing': "💰 ¡Perfecto! ¿Qué producto necesitas? HLSO es muy popular. Escribe 'precios' para ver tallas y crear tu proforma 📋",
+        'product_info': "🦐 Tenemos HLSO, P&D IQF, HOSO y más. ¿Cuál te interesa? Te genero la cotización con precios FOB actualizados 💰",
+        'help': "🤖 Te ayudo a crear proformas de camarón:\n• Precios FOB actualizados\n• Todas las tallas disponibles\n• PDF profesional\n\n¿Qué producto necesitas? 🦐",
+    }
+    DEFAULT_FALLBACK_RESPONSE = "🦐 ¡Hola! Soy ShrimpBot de BGR Export. ¿Qué camarón necesitas? Te genero la proforma al instante 📋💰"
+
+    # Palabras clave de _intelligent_fallback (subcadenas; se omiten las que
+    # contienen a otra de la lista, p. ej. 'nota de voz' ya cubierta por 'voz')
+    FALLBACK_AUDIO_KEYWORDS = frozenset({'audio', 'voz', 'voice', 'grabación'})
+    FALLBACK_PRODUCT_KEYWORDS = frozenset({'producto', 'qué tienen', 'qué venden', 'catálogo', 'opciones'})
+    FALLBACK_PRICE_KEYWORDS = frozenset({'precio', 'cuánto', 'cuanto', 'cost', 'value'})
+    FALLBACK_HELP_KEYWORDS = frozenset({'ayuda', 'help', 'cómo', 'como funciona', 'qué puedes', 'opciones'})
+    FALLBACK_THANKS_KEYWORDS = frozenset({'gracias', 'thanks', 'thank you', 'te agradezco'})
+    FALLBACK_GOODBYE_KEYWORDS = frozenset({'adiós', 'adios', 'bye', 'chao', 'hasta luego', 'nos vemos'})
+
+    # Emojis que pueden causar problemas de codificación en WhatsApp y sus reemplazos
+    # (tabla de str.translate: una sola pasada sobre el texto)
+    PROBLEMATIC_EMOJIS = str.maketrans({
+        '🤑': '💰',  # Reemplazar cara con dinero por bolsa de dinero
+        '🤖': '🦐',  # Reemplazar robot por camarón
+        '💸': '💰',  # Reemplazar dinero volando por bolsa de dinero
+        '🤔': '🤝',  # Reemplazar cara pensando por apretón de manos
+    })
+
+    # Patrones de detect_multiple_products (IGNORECASE: sin copiar el mensaje con upper())
+    MULTI_LINE_RX = re.compile(r'[^\n]+')
+    MULTI_INTEIRO_RX = re.compile(r'INTEIRO|ENTERO', re.IGNORECASE)
+    MULTI_COLAS_RX = re.compile(r'COLAS?|TAILS?', re.IGNORECASE)
+    MULTI_SIZE_RX = re.compile(r'(\d+)[/-](\d+)')
+    MULTI_SIZE_SLASH_RX = re.compile(r'(\d+)/(\d+)')
+    MULTI_PRODUCT_PATTERNS = {
+        'HOSO': re.compile(r'\bHOSO\b', re.IGNORECASE),
+        'HLSO': re.compile(r'\bHLSO\b', re.IGNORECASE),
+        'P&D IQF': re.compile(r'\b(?:P&D|PYD|P\s*&\s*D)\s*(?:IQF|TAIL\s*OFF)?\b', re.IGNORECASE),
+        'P&D BLOQUE': re.compile(r'\b(?:P&D|PYD)\s*(?:BLOQUE|BLOCK)\b', re.IGNORECASE),
+        'EZ PEEL': re.compile(r'\b(?:EZ\s*PEEL|EZPEEL)\b', re.IGNORECASE),
+        'COOKED': re.compile(r'\b(?:COOKED|COCIDO|COCEDERO)\b', re.IGNORECASE),
+    }
+    MULTI_BLOQUE_RX = re.compile(r'BLOCK|BLOQUE', re.IGNORECASE)
+    MULTI_IQF_RX = re.compile(r'IQF', re.IGNORECASE)
+
+    # Catálogo compacto compartido por todos los prompts del sistema
+    PRODUCT_CATALOG = _PRODUCT_CATALOG
+
     def __init__(self):
         """Inicializa el servicio OpenAI con configuración optimizada."""
         self.api_key = os.getenv("OPENAI_API_KEY")
         
         # 🆕 Modelo fine-tuned (configurable desde .env)
         # Si OPENAI_FINETUNED_MODEL está configurado, úsalo; si no, usa el modelo base
-        self.model = os.getenv("OPENAI_FINETUNED_MODEL", "gpt-3.5-turbo")
+        self.model = os.getenv("OPENAI_FINETUNED_MODEL", self.BASE_MODEL)
+
+        # Modelo pequeño y rápido para extracción estructurada de intenciones (JSON)
+        self.intent_model = os.getenv("OPENAI_INTENT_MODEL", self.BASE_MODEL)
         
         self.whisper_model = "whisper-1"
         self.base_url = "https://api.openai.com/v1"
 
+        # URLs y cabeceras precalculadas: son las mismas en todas las peticiones
+        # (los dicts de cabeceras son compartidos: no modificarlos)
+        self._chat_url = f"{self.base_url}/chat/completions"
+        self._audio_url = f"{self.base_url}/audio/transcriptions"
+        self._auth_headers = {"Authorization": f"Bearer {self.api_key}"}
+        self._json_headers = {**self._auth_headers, "Content-Type": "application/json"}
+
         # Sistema de caché en memoria
         self._cache: Dict[str, Tuple[Any, float]] = {}  # {cache_key: (response, timestamp)}
         self._cache_hits = 0
         self._cache_misses = 0
 
+        # Single-flight: peticiones idénticas en curso {cache_key: Event}
+        self._inflight: dict[str, threading.Event] = {}
+        self._inflight_lock = threading.Lock()
+        self._inflight_shared = 0
+        # Equivalente para las peticiones async (un solo event loop: no requiere lock)
+        self._ainflight: dict[str, asyncio.Event] = {}
+
+        # Caché LRU del análisis por patrones: los mensajes del bot se repiten mucho
+        self._intent_cache = lru_cache(maxsize=self.INTENT_CACHE_SIZE)(self._analyze_intent_patterns)
+        # Caché LRU de respuestas JSON de GPT para analyze_user_intent {cache_key: json}
+        self._intent_responses: OrderedDict[str, str] = OrderedDict()
+        self._intent_response_hits = 0
+        # Análisis con GPT disponible y cuántos se resolvieron sin llamarlo
+        self._intent_analyses = 0
+        self._intent_llm_skips = 0
+        # Caché semántica de intención (opcional: requiere un embedding por mensaje)
+        self._semantic_intent_cache: _SemanticIntentCache | None = None
+        if os.getenv("OPENAI_SEMANTIC_CACHE", "false").lower() == "true":
+            self._semantic_intent_cache = _SemanticIntentCache(self.SEMANTIC_CACHE_SIZE, self.SEMANTIC_CACHE_THRESHOLD)
+        
         # Métricas de rate limiting
         self._rate_limit_hits = 0
         self._last_request_time = 0
+
+        # Sesión HTTP persistente: reutiliza conexiones TCP/TLS entre peticiones
+        self._session = self._build_http_session()
+        # Cliente asíncrono para las rutas async; se crea al primer uso dentro del event loop
+        self._async_client: httpx.AsyncClient | None = None
         
         # 🆕 Log del modelo en uso
         if "ft:" in self.model:
@@ -72,6 +936,79 @@ class OpenAIService:
             logger.info(f"🤖 Usando modelo BASE: {self.model}")
 
 
+    def _build_http_session(self) -> requests.Session:
+        """
+        Crea una sesión HTTP con keep-alive y pool de conexiones.
+
+        Solo chat/completions y audio/transcriptions reintentan POST ante
+        HTTP_RETRY_STATUS_CODES: repetirlos no tiene efectos secundarios. El
+        resto de POST (subida de archivos, creación de batches) no se reenvía
+        tras un error de estado, porque OpenAI pudo haberlos procesado; los GET
+        sí se reintentan.
+
+        Returns:
+            requests.Session configurada para api.openai.com
+        """
+        session = requests.Session()
+        session.mount("https://", self._build_http_adapter(frozenset({"GET"})))
+        # Backoff exponencial con jitter, respetando Retry-After (con tope) en 429/503
+        retrying_adapter = self._build_http_adapter(frozenset({"POST"}))
+        session.mount(self._chat_url, retrying_adapter)
+        session.mount(self._audio_url, retrying_adapter)
+        return session
+
+    def _build_http_adapter(self, retry_methods: frozenset) -> HTTPAdapter:
+        """
+        Adaptador con pool de conexiones que reintenta errores transitorios.
+
+        Los errores de conexión se reintentan siempre (la petición no llegó a
+        enviarse); los de lectura y HTTP_RETRY_STATUS_CODES, solo en retry_methods.
+        """
+        retry = _CappedRetry(
+            total=self.HTTP_RETRY_TOTAL,
+            backoff_factor=self.HTTP_RETRY_BACKOFF_FACTOR,
+            backoff_jitter=self.HTTP_RETRY_BACKOFF_JITTER,
+            status_forcelist=self.HTTP_RETRY_STATUS_CODES,
+            allowed_methods=retry_methods,
+            respect_retry_after_header=True,
+            raise_on_status=False
+        )
+        return HTTPAdapter(
+            pool_connections=self.HTTP_POOL_CONNECTIONS,
+            pool_maxsize=self.HTTP_POOL_MAXSIZE,
+            max_retries=retry
+        )
+
+    def _get_async_client(self) -> httpx.AsyncClient:
+        """
+        Devuelve el cliente httpx asíncrono compartido, creándolo si hace falta.
+
+        Usa HTTP/2 cuando el paquete h2 está instalado (httpx[http2]); si no,
+        mantiene HTTP/1.1 con keep-alive. HTTP/2 y los límites del pool se
+        configuran en el transporte: con un transporte explícito, httpx ignora
+        los argumentos http2/limits del cliente.
+        """
+        if self._async_client is None or self._async_client.is_closed:
+            self._async_client = httpx.AsyncClient(
+                timeout=self.HTTP_TIMEOUT,
+                transport=httpx.AsyncHTTPTransport(
+                    http2=importlib.util.find_spec("h2") is not None,
+                    limits=httpx.Limits(
+                        max_connections=self.HTTP_ASYNC_MAX_CONNECTIONS,
+                        max_keepalive_connections=self.HTTP_ASYNC_MAX_KEEPALIVE,
+                        keepalive_expiry=self.HTTP_ASYNC_KEEPALIVE_EXPIRY
+                    ),
+                    retries=self.MAX_RETRIES
+                )
+            )
+        return self._async_client
+
+    async def aclose(self) -> None:
+        """Cierra el cliente asíncrono y sus conexiones."""
+        if self._async_client is not None:
+            await self._async_client.aclose()
+            self._async_client = None
+
     def is_available(self) -> bool:
         """
         Verifica si OpenAI está disponible.
@@ -92,13 +1029,15 @@ class OpenAIService:
             params: Parámetros adicionales (temperatura, max_tokens, etc.)
 
         Returns:
-            str: Hash MD5 como clave de caché
+            str: Hash XXH3 de 64 bits (MD5 si xxhash no está instalado) como clave de caché
         """
         cache_string = prompt
         if params:
             # Ordenar params para consistencia
             cache_string += str(sorted(params.items()))
 
+        if _xxhash is not None:
+            return _xxhash.xxh3_64_hexdigest(cache_string.encode('utf-8'))
         return hashlib.md5(cache_string.encode('utf-8')).hexdigest()
 
     def _get_from_cache(self, cache_key: str) -> Optional[str]:
@@ -117,15 +1056,15 @@ class OpenAIService:
             # Verificar si no ha expirado
             if time.time() - timestamp < self.CACHE_TTL:
                 self._cache_hits += 1
-                logger.info(f"💾 Cache HIT (hits={self._cache_hits}, misses={self._cache_misses})")
+                logger.info("💾 Cache HIT (hits=%s, misses=%s)", self._cache_hits, self._cache_misses)
                 return response
             else:
                 # Expirado, eliminar
                 del self._cache[cache_key]
-                logger.debug(f"🗑️ Cache entry expirada, eliminada")
+                logger.debug("🗑️ Cache entry expirada, eliminada")
 
         self._cache_misses += 1
-        logger.debug(f"❌ Cache MISS (hits={self._cache_hits}, misses={self._cache_misses})")
+        logger.debug("❌ Cache MISS (hits=%s, misses=%s)", self._cache_hits, self._cache_misses)
         return None
 
     def _save_to_cache(self, cache_key: str, response: str) -> None:
@@ -141,20 +1080,46 @@ class OpenAIService:
             # Eliminar la entrada más antigua
             oldest_key = min(self._cache.items(), key=lambda x: x[1][1])[0]
             del self._cache[oldest_key]
-            logger.debug(f"🗑️ Cache lleno, eliminada entrada más antigua")
+            logger.debug("🗑️ Cache lleno, eliminada entrada más antigua")
 
         self._cache[cache_key] = (response, time.time())
-        logger.debug(f"💾 Respuesta guardada en caché (total={len(self._cache)})")
+        logger.debug("💾 Respuesta guardada en caché (total=%s)", len(self._cache))
+
+    def _get_intent_response(self, cache_key: str) -> dict | None:
+        """
+        Busca un análisis de intención ya resuelto por GPT.
+
+        Se guarda el JSON y no el dict: cada acierto devuelve un objeto nuevo,
+        así los llamadores pueden modificarlo sin alterar la caché.
+        """
+        cached = self._intent_responses.get(cache_key)
+        if cached is None:
+            return None
+
+        self._intent_responses.move_to_end(cache_key)
+        self._intent_response_hits += 1
+        logger.info("💾 Intención desde caché (hits=%s)", self._intent_response_hits)
+        return orjson.loads(cached)
+
+    def _save_intent_response(self, cache_key: str, response: str) -> None:
+        """Guarda una intención JSON válida de analyze_user_intent o analyze_and_respond (LRU acotado)."""
+        self._intent_responses[cache_key] = response
+        self._intent_responses.move_to_end(cache_key)
+        if len(self._intent_responses) > self.INTENT_RESPONSE_CACHE_SIZE:
+            self._intent_responses.popitem(last=False)
 
     def get_cache_stats(self) -> Dict[str, Any]:
         """
         Obtiene estadísticas del caché.
 
         Returns:
-            Dict con estadísticas: hits, misses, size, hit_rate
+            Dict con estadísticas: hits, misses, size, hit_rate, inflight_shared,
+            intent_hits, intent_response_hits, intent_response_size,
+            intent_llm_skips, intent_llm_skip_rate, semantic_hits, semantic_size
         """
         total_requests = self._cache_hits + self._cache_misses
         hit_rate = (self._cache_hits / total_requests * 100) if total_requests > 0 else 0
+        skip_rate = (self._intent_llm_skips / self._intent_analyses * 100) if self._intent_analyses else 0
 
         return {
             'hits': self._cache_hits,
@@ -162,12 +1127,24 @@ class OpenAIService:
             'size': len(self._cache),
             'max_size': self.CACHE_MAX_SIZE,
             'hit_rate': f"{hit_rate:.1f}%",
-            'total_requests': total_requests
+            'total_requests': total_requests,
+            'inflight_shared': self._inflight_shared,
+            'intent_hits': self._intent_cache.cache_info().hits,
+            'intent_response_hits': self._intent_response_hits,
+            'intent_response_size': len(self._intent_responses),
+            'intent_llm_skips': self._intent_llm_skips,
+            'intent_llm_skip_rate': f"{skip_rate:.1f}%",
+            'semantic_hits': self._semantic_intent_cache.hits if self._semantic_intent_cache else 0,
+            'semantic_size': len(self._semantic_intent_cache) if self._semantic_intent_cache else 0
         }
 
     def clear_cache(self) -> None:
         """Limpia todo el caché."""
         self._cache.clear()
+        self._intent_cache.cache_clear()
+        self._intent_responses.clear()
+        if self._semantic_intent_cache:
+            self._semantic_intent_cache.clear()
         logger.info("🗑️ Caché limpiado completamente")
 
     # ==================== MANEJO DE RATE LIMITING ====================
@@ -224,34 +1201,13 @@ class OpenAIService:
             return self._intelligent_fallback(user_message, session_data)
 
         try:
-            # Construir historial de conversación
-            messages = [
-                {"role": "system", "content": self._get_conversation_system_prompt()}
-            ]
-
-            # 🆕 RAG: Agregar contexto relevante recuperado
-            if use_rag:
-                rag_context = self._get_rag_context(user_message)
-                if rag_context:
-                    messages.append({
-                        "role": "system",
-                        "content": f"INFORMACIÓN RELEVANTE DE LA BASE DE CONOCIMIENTOS:\n{rag_context}\n\nUsa esta información para responder al usuario si es relevante."
-                    })
+            messages = self._build_chat_messages(user_message, conversation_history, session_data, use_rag)
 
-            # Agregar contexto de sesión si existe
-            if session_data:
-                context_message = self._build_context_message(session_data)
-                messages.append({"role": "system", "content": context_message})
-
-            # Agregar historial de conversación
-            if conversation_history:
-                messages.extend(conversation_history[-10:])  # Últimos 10 mensajes
-
-            # Agregar mensaje actual
-            messages.append({"role": "user", "content": user_message})
-
-            # Hacer petición a GPT con reintentos (temperature baja para JSON consistente)
-            result = self._make_request_with_retry(messages, max_tokens=500, temperature=0.3)
+            # Petición a GPT (temperature baja para JSON consistente); la sesión HTTP
+            # ya reintenta 429/5xx y errores de conexión, el resto falla sin esperar
+            result = self._make_request(
+                messages, max_tokens=120, temperature=0.3, response_format=self.JSON_RESPONSE_FORMAT
+            )
 
             if result:
                 # Parsear respuesta para extraer acciones
@@ -266,75 +1222,96 @@ class OpenAIService:
             # Siempre retornar algo coherente
             return self._intelligent_fallback(user_message, session_data)
 
+    async def chat_stream(self, user_message: str, conversation_history: list[dict] = None, session_data: dict = None, use_rag: bool = True) -> AsyncIterator[str]:
+        """
+        Variante en streaming de chat_with_context: emite los tokens a medida que llegan.
+
+        El primer fragmento llega en cuanto GPT genera el primer token, sin esperar
+        la respuesta completa. El consumidor es responsable de agrupar los fragmentos
+        (p. ej. por oraciones) y de parsear el JSON final con _parse_gpt_response.
+
+        Args:
+            user_message: Mensaje actual del usuario
+            conversation_history: Historial de mensajes previos
+            session_data: Datos de la sesión actual
+            use_rag: Si usar el sistema RAG para enriquecer contexto
+
+        Yields:
+            Fragmentos de texto (deltas) de la respuesta
+        """
+        if not self.is_available():
+            return
+
+        messages = self._build_chat_messages(user_message, conversation_history, session_data, use_rag)
+        async for chunk in self._astream(messages, max_tokens=120, temperature=0.3, response_format=self.JSON_RESPONSE_FORMAT):
+            yield chunk
+
+    def _build_chat_messages(self, user_message: str, conversation_history: list[dict] = None, session_data: dict = None, use_rag: bool = True) -> list[dict]:
+        """
+        Construye la lista de mensajes para la conversación con GPT
+        (prompt del sistema, contexto RAG, contexto de sesión, historial y mensaje actual)
+        """
+        messages = [
+            {"role": "system", "content": self._get_conversation_system_prompt()}
+        ]
+
+        # 🆕 RAG: Agregar contexto relevante recuperado
+        if use_rag:
+            rag_context = self._get_rag_context(user_message)
+            if rag_context:
+                messages.append({
+                    "role": "system",
+                    "content": f"INFORMACIÓN RELEVANTE DE LA BASE DE CONOCIMIENTOS:\n{rag_context}\n\nUsa esta información para responder al usuario si es relevante."
+                })
+
+        # Agregar contexto de sesión si existe
+        if session_data:
+            context_message = self._build_context_message(session_data)
+            messages.append({"role": "system", "content": context_message})
+
+        # Agregar historial de conversación (recortado para ahorrar tokens)
+        if conversation_history:
+            messages.extend(self._trim_history(conversation_history))
+
+        # Agregar mensaje actual
+        messages.append({"role": "user", "content": user_message})
+
+        return messages
+
+    def _trim_history(self, conversation_history: list[dict]) -> list[dict]:
+        """
+        Recorta el historial de conversación para reducir tokens de entrada.
+
+        - Conserva solo los últimos HISTORY_MAX_MESSAGES mensajes
+        - De las respuestas previas del asistente en JSON conserva solo 'response'
+          (el bloque 'data' ya está reflejado en el contexto de sesión)
+        - Trunca cada mensaje a HISTORY_MAX_CHARS caracteres
+        """
+        trimmed = []
+        for message in conversation_history[-self.HISTORY_MAX_MESSAGES:]:
+            content = message.get('content') or ''
+
+            if message.get('role') == 'assistant' and content.lstrip().startswith('{'):
+                try:
+                    parsed = orjson.loads(content)
+                    if isinstance(parsed, dict) and 'response' in parsed:
+                        content = str(parsed['response'])
+                except orjson.JSONDecodeError:
+                    pass
+
+            if len(content) > self.HISTORY_MAX_CHARS:
+                content = content[:self.HISTORY_MAX_CHARS]
+
+            trimmed.append({"role": message.get('role', 'user'), "content": content})
+
+        return trimmed
+
     def _get_conversation_system_prompt(self) -> str:
         """
         Prompt del sistema para conversación natural.
         Usa _get_base_context() como fuente de verdad para productos/tallas.
         """
-        base = self._get_base_context()
-        return f"""{base}
-
-RECONOCIMIENTO DE TÉRMINOS:
-- "Cocedero"/"Cocido" → Preguntar: COOKED, PRE-COCIDO o COCIDO SIN TRATAR
-- "Inteiro"/"Entero" → HOSO o HLSO
-- "Colas" (sin cocedero) → HLSO
-- "Colas Cocedero"/"Colas Cocidas" → COOKED
-- "CFR"/"CIF" + ciudad → Detectar destino, marcar flete
-- "Cola X/X con flete" → HLSO con flete (FOB + Flete)
-
-OBJETIVO: Ayudar al cliente a generar cotizaciones de camarón.
-
-FLUJO:
-1. Detectar productos y tallas
-2. Preguntar glaseo si falta (0%, 10%, 20%, 30%)
-3. Confirmar destino si menciona CFR/CIF
-4. Confirmar datos antes de generar proforma
-
-REGLAS:
-- Respuestas concisas y directas
-- Si detectas múltiples tallas, lista todas
-- Si falta info crítica, pregunta de forma natural
-- Si menciona "Cocedero", ofrece opciones específicas
-- No pidas datos que ya tienes
-
-FORMATO DE RESPUESTA (JSON):
-{{
-    "response": "Tu respuesta al usuario",
-    "action": "detect_products|ask_glaseo|ask_product_type|ask_language|generate_proforma|none",
-    "data": {{
-        "products": [...],
-        "glaseo": 20,
-        "destination": "Lisboa",
-        ...
-    }}
-}}
-
-EJEMPLOS:
-Usuario: "Hola"
-{{
-    "response": "Hola, soy el asistente de BGR Export. ¿Qué producto necesitas cotizar?",
-    "action": "none",
-    "data": {{}}
-}}
-
-Usuario: "Necesito precios de HLSO 16/20"
-{{
-    "response": "HLSO 16/20. ¿Qué glaseo necesitas? (10%, 20% o 30%)",
-    "action": "ask_glaseo",
-    "data": {{"products": [{{"product": "HLSO", "size": "16/20"}}]}}
-}}
-
-Usuario: "Lagostino Cocedero CFR Lisboa: Inteiro 20/30, 30/40. Colas 21/25, 31/35"
-{{
-    "response": "Cotización CFR Lisboa detectada.\\nInteiro: 20/30, 30/40\\nColas: 21/25, 31/35\\n\\n¿Qué glaseo necesitas? (10%, 20%, 30%)\\n¿Qué producto cocido prefieres? COOKED, PRE-COCIDO o COCIDO SIN TRATAR",
-    "action": "ask_product_type",
-    "data": {{
-        "sizes_inteiro": ["20/30", "30/40"],
-        "sizes_colas": ["21/25", "31/35"],
-        "destination": "Lisboa",
-        "product_category": "cocido"
-    }}
-}}"""
+        return _SYSTEM_PROMPT_CONVERSATION
 
     def _get_rag_context(self, query: str, max_tokens: int = 1500) -> str:
         """
@@ -364,7 +1341,7 @@ Usuario: "Lagostino Cocedero CFR Lisboa: Inteiro 20/30, 30/40. Colas 21/25, 31/3
             )
 
             if context:
-                logger.debug(f"🔍 RAG: Contexto recuperado ({len(context)} chars)")
+                logger.debug("🔍 RAG: Contexto recuperado (%s chars)", len(context))
 
             return context
 
@@ -398,16 +1375,12 @@ Usuario: "Lagostino Cocedero CFR Lisboa: Inteiro 20/30, 30/40. Colas 21/25, 31/3
 
     def _parse_gpt_response(self, response: str) -> dict:
         """
-        Parsea la respuesta de GPT para extraer JSON con validación de schema
+        Parsea la respuesta de GPT (modo JSON) con validación de schema
         """
         try:
-            # Intentar parsear como JSON
-            # Buscar JSON en la respuesta
-            json_match = re.search(r'\{.*\}', response, re.DOTALL)
-            if json_match:
-                json_str = json_match.group(0)
-                parsed = json.loads(json_str)
-
+            # Con response_format=json_object la respuesta completa es JSON
+            parsed = orjson.loads(response)
+            if isinstance(parsed, dict):
                 # Validar schema: campos requeridos
                 required_fields = ['response', 'action', 'data']
                 if not all(field in parsed for field in required_fields):
@@ -443,11 +1416,11 @@ Usuario: "Lagostino Cocedero CFR Lisboa: Inteiro 20/30, 30/40. Colas 21/25, 31/3
 
                 return parsed
             else:
-                # Si no hay JSON, retornar respuesta como texto
-                logger.warning("⚠️ No se encontró JSON en la respuesta de GPT")
+                # Si el JSON no es un objeto, retornar respuesta como texto
+                logger.warning("⚠️ La respuesta JSON de GPT no es un objeto")
                 return self._get_default_response(text=response)
 
-        except json.JSONDecodeError as e:
+        except orjson.JSONDecodeError as e:
             # Si falla el parseo, retornar respuesta como texto
             logger.error(f"❌ Error parseando JSON de GPT: {str(e)}")
             return self._get_default_response(text=response)
@@ -465,7 +1438,7 @@ Usuario: "Lagostino Cocedero CFR Lisboa: Inteiro 20/30, 30/40. Colas 21/25, 31/3
             "data": data if data is not None else {}
         }
 
-    def _make_request(self, messages: list[dict], max_tokens: int = 300, temperature: float = 0.3, use_cache: bool = True, force_base_model: bool = False) -> str | None:
+    def _make_request(self, messages: list[dict], max_tokens: int = 300, temperature: float = 0.3, use_cache: bool = True, force_base_model: bool = False, model: str = None, response_format: dict = None) -> str | None:
         """
         Hace una petición directa a la API de OpenAI con caché y rate limiting.
 
@@ -474,7 +1447,9 @@ Usuario: "Lagostino Cocedero CFR Lisboa: Inteiro 20/30, 30/40. Colas 21/25, 31/3
             max_tokens: Número máximo de tokens en la respuesta
             temperature: Temperatura para generación (0.0-1.0)
             use_cache: Si debe usar el sistema de caché (default: True)
-            force_base_model: Si True, usa gpt-3.5-turbo en lugar del modelo fine-tuned (para análisis JSON)
+            force_base_model: Si True, usa BASE_MODEL en lugar del modelo fine-tuned (para análisis JSON)
+            model: Modelo a usar explícitamente (tiene prioridad sobre force_base_model)
+            response_format: Formato de respuesta de OpenAI, p. ej. {"type": "json_object"}
 
         Returns:
             Respuesta de la API o None si falla
@@ -483,270 +1458,1093 @@ Usuario: "Lagostino Cocedero CFR Lisboa: Inteiro 20/30, 30/40. Colas 21/25, 31/3
             logger.warning("⚠️ OpenAI API key no configurada")
             return None
 
+        model_to_use = self._resolve_model(model, force_base_model)
+
+        cache_key = None
+        is_leader = False
+        if use_cache:
+            cache_key = self._request_cache_key(messages, model_to_use, max_tokens, temperature, response_format)
+
+            # Intentar obtener del caché
+            cached_response = self._get_from_cache(cache_key)
+            if cached_response:
+                return cached_response
+
+            # Si ya hay una petición idéntica en curso, esperar su resultado
+            while True:
+                event, is_leader = self._join_inflight(cache_key)
+                if is_leader:
+                    break
+                finished = event.wait(self.INFLIGHT_WAIT_TIMEOUT)
+                cached_response = self._get_from_cache(cache_key)
+                if cached_response:
+                    self._inflight_shared += 1
+                    logger.info("🔁 Respuesta compartida con una petición idéntica en curso")
+                    return cached_response
+                if not finished:
+                    logger.warning("⚠️ Timeout esperando petición idéntica en curso; se hace petición propia")
+                    break
+                # La original falló: una de las que esperan pasa a ser la nueva original
+
+        try:
+            response_text = self._post_chat_completion(messages, model_to_use, max_tokens, temperature, response_format)
+
+            # Guardar en caché si está habilitado (antes de liberar a los que esperan)
+            if response_text and use_cache:
+                self._save_to_cache(cache_key, response_text)
+
+            return response_text
+        finally:
+            if is_leader:
+                self._release_inflight(cache_key)
+
+    def _resolve_model(self, model: str = None, force_base_model: bool = False) -> str:
+        """
+        Elige el modelo de la petición: el explícito, el base si se fuerza
+        (para análisis JSON) o el configurado (posiblemente fine-tuned).
+        """
+        if model:
+            return model
+        if force_base_model:
+            return self.BASE_MODEL
+        return self.model
+
+    def _request_cache_key(self, messages: list[dict], model: str, max_tokens: int, temperature: float, response_format: dict = None) -> str:
+        """Clave de caché de una petición chat/completions (mensajes + parámetros)."""
+        prompt_text = orjson.dumps(messages, option=orjson.OPT_SORT_KEYS).decode()
+        params = {'max_tokens': max_tokens, 'temperature': temperature, 'model': model}
+        if response_format:
+            params['response_format'] = orjson.dumps(response_format, option=orjson.OPT_SORT_KEYS).decode()
+        return self._generate_cache_key(prompt_text, params)
+
+    def _join_inflight(self, cache_key: str) -> tuple[threading.Event, bool]:
+        """
+        Registra una petición en el mapa single-flight.
+
+        Returns:
+            (event, is_leader): is_leader es True si esta petición debe llamar a
+            la API; si es False, otra idéntica está en curso y basta esperar event
+        """
+        with self._inflight_lock:
+            event = self._inflight.get(cache_key)
+            if event is not None:
+                return event, False
+            event = threading.Event()
+            self._inflight[cache_key] = event
+            return event, True
+
+    def _release_inflight(self, cache_key: str) -> None:
+        """Retira la petición del mapa single-flight y despierta a las que esperan."""
+        with self._inflight_lock:
+            event = self._inflight.pop(cache_key, None)
+        if event is not None:
+            event.set()
+
+    def _post_chat_completion(self, messages: list[dict], model: str, max_tokens: int, temperature: float, response_format: dict = None) -> str | None:
+        """
+        Envía la petición chat/completions y devuelve el texto de la respuesta.
+
+        Returns:
+            Contenido de la respuesta o None si falla
+        """
+        try:
+            headers, data = self._build_chat_payload(messages, model, max_tokens, temperature, response_format)
+
+            # Hacer petición con timeout (cuerpo serializado con orjson)
+            response = self._session.post(
+                self._chat_url,
+                headers=headers,
+                data=orjson.dumps(data),
+                timeout=self.HTTP_TIMEOUT
+            )
+
+            return self._read_chat_completion(response.status_code, response.content, response.headers)
+
+        except requests.exceptions.Timeout:
+            logger.error("❌ Timeout en petición a OpenAI (30s)")
+            return None
+        except requests.exceptions.ConnectionError as e:
+            logger.error(f"❌ Error de conexión con OpenAI: {str(e)}")
+            return None
+        except requests.exceptions.RequestException as e:
+            logger.error(f"❌ Error de red en petición OpenAI: {str(e)}")
+            return None
+        except Exception as e:
+            logger.error(f"❌ Error inesperado en petición OpenAI: {str(e)}")
+            return None
+
+    def _build_chat_payload(self, messages: list[dict], model: str, max_tokens: int, temperature: float, response_format: dict = None) -> tuple[dict, dict]:
+        """
+        Construye headers y cuerpo de una petición chat/completions.
+        """
+        headers = self._json_headers
+        data = {
+            "model": model,
+            "messages": messages,
+            "max_tokens": max_tokens,
+            "temperature": temperature
+        }
+        if response_format:
+            data["response_format"] = response_format
+        return headers, data
+
+    def _read_chat_completion(self, status_code: int, content: bytes, headers) -> str | None:
+        """
+        Extrae el texto de una respuesta chat/completions (cliente síncrono o async).
+
+        Returns:
+            Contenido de la respuesta o None si la API devolvió un error
+        """
+        # Manejar respuesta exitosa
+        if status_code == 200:
+            choice = orjson.loads(content)["choices"][0]
+            # Cortada por max_tokens: texto a medias o JSON inválido, nunca para el cliente
+            if choice.get("finish_reason") == "length":
+                logger.warning("⚠️ Respuesta de OpenAI truncada por max_tokens; se descarta")
+                return None
+            return choice["message"]["content"].strip()
+
+        # Manejar rate limiting
+        if status_code == 429:
+            # Llega aquí cuando ya se agotaron los reintentos de la sesión HTTP
+            logger.warning(f"⚠️ Rate limit alcanzado. Headers: {headers}")
+            return None
+
+        # Otros errores
+        try:
+            error_detail = orjson.loads(content).get('error', {}).get('message', '')
+        except (orjson.JSONDecodeError, AttributeError):
+            error_detail = content[:200].decode('utf-8', errors='replace')
+
+        logger.error(
+            f"❌ Error API OpenAI: {status_code} | "
+            f"Detalle: {error_detail}"
+        )
+        return None
+
+    def _make_request_stream(self, messages: list[dict], max_tokens: int = 300, temperature: float = 0.3, response_format: dict = None) -> Iterator[str]:
+        """
+        Hace una petición en streaming (stream=True) a la API de OpenAI.
+
+        Parsea los eventos SSE (líneas `data: {...}`) y emite el contenido
+        incremental de cada delta. No usa caché: el objetivo es reducir el
+        tiempo hasta el primer token.
+
+        Args:
+            messages: Lista de mensajes para la conversación
+            max_tokens: Número máximo de tokens en la respuesta
+            temperature: Temperatura para generación (0.0-1.0)
+            response_format: Formato de respuesta de OpenAI, p. ej. {"type": "json_object"}
+
+        Yields:
+            Fragmentos de texto de la respuesta
+        """
+        if not self.is_available():
+            logger.warning("⚠️ OpenAI API key no configurada")
+            return
+
+        headers, data = self._build_stream_payload(messages, max_tokens, temperature, response_format)
+
+        try:
+            with self._session.post(
+                self._chat_url,
+                headers=headers,
+                data=orjson.dumps(data),
+                timeout=30,
+                stream=True
+            ) as response:
+                if response.status_code != 200:
+                    logger.error(f"❌ Error API OpenAI (stream): {response.status_code} | Detalle: {response.text[:200]}")
+                    return
+
+                for line in response.iter_lines(decode_unicode=True):
+                    done, delta = self._parse_sse_line(line)
+                    if done:
+                        break
+                    if delta:
+                        yield delta
+
+        except requests.exceptions.Timeout:
+            logger.error("❌ Timeout en petición streaming a OpenAI (30s)")
+        except requests.exceptions.RequestException as e:
+            logger.error(f"❌ Error de red en petición streaming OpenAI: {str(e)}")
+
+    def _build_stream_payload(self, messages: list[dict], max_tokens: int, temperature: float, response_format: dict = None) -> tuple[dict, dict]:
+        """
+        Construye headers y cuerpo de una petición chat/completions en streaming.
+        """
+        headers, data = self._build_chat_payload(messages, self.model, max_tokens, temperature, response_format)
+        data["stream"] = True
+        return headers, data
+
+    def _parse_sse_line(self, line: str) -> tuple[bool, str | None]:
+        """
+        Parsea una línea SSE de OpenAI.
+
+        Returns:
+            (done, delta): done es True al recibir [DONE]; delta es el texto
+            incremental o None si la línea no aporta contenido
+        """
+        if not line or not line.startswith("data:"):
+            return False, None
+
+        payload = line[len("data:"):].strip()
+        if payload == "[DONE]":
+            return True, None
+
+        try:
+            event = orjson.loads(payload)
+        except orjson.JSONDecodeError:
+            logger.debug("⚠️ Evento SSE no parseable: %s", payload[:100])
+            return False, None
+
+        choices = event.get("choices") or []
+        if not choices:
+            return False, None
+        return False, choices[0].get("delta", {}).get("content")
+
+    async def _astream(self, messages: list[dict], max_tokens: int = 300, temperature: float = 0.3, response_format: dict = None) -> AsyncIterator[str]:
+        """
+        Versión asíncrona de _make_request_stream sobre el cliente httpx compartido.
+
+        Lee el stream SSE sin bloquear el event loop del webhook y, con HTTP/2,
+        comparte una sola conexión TLS entre conversaciones concurrentes.
+        """
+        if not self.is_available():
+            logger.warning("⚠️ OpenAI API key no configurada")
+            return
+
+        headers, data = self._build_stream_payload(messages, max_tokens, temperature, response_format)
+        client = self._get_async_client()
+
+        try:
+            async with client.stream(
+                "POST",
+                self._chat_url,
+                headers=headers,
+                content=orjson.dumps(data)
+            ) as response:
+                if response.status_code != 200:
+                    await response.aread()
+                    logger.error(f"❌ Error API OpenAI (stream): {response.status_code} | Detalle: {response.text[:200]}")
+                    return
+
+                async for line in response.aiter_lines():
+                    done, delta = self._parse_sse_line(line)
+                    if done:
+                        break
+                    if delta:
+                        yield delta
+
+        except httpx.TimeoutException:
+            logger.error("❌ Timeout en petición streaming a OpenAI (30s)")
+        except httpx.HTTPError as e:
+            logger.error(f"❌ Error de red en petición streaming OpenAI: {str(e)}")
+
+    def analyze_user_intent(self, message: str, context: dict = None) -> dict:
+        """
+        Analiza la intención del usuario usando GPT-4o mini
+        """
+        try:
+            basic_analysis, resolved = self._resolve_intent_locally(message)
+            if resolved:
+                return basic_analysis
+
+            messages = self._build_intent_messages(message)
+            cache_key = self._intent_cache_key(messages)
+            cached = self._get_intent_response(cache_key)
+            if cached is not None:
+                return cached
+
+            cached, semantic_key = self._semantic_intent_lookup(message, basic_analysis)
+            if cached is not None:
+                return cached
+
+            # Modelo de intención con modo JSON (el fine-tuned responde en texto)
+            result = self._make_request(
+                messages,
+                max_tokens=self.INTENT_MAX_TOKENS,
+                temperature=self.INTENT_TEMPERATURE,
+                model=self.intent_model,
+                response_format=self.JSON_RESPONSE_FORMAT
+            )
+            return self._parse_intent_result(result, basic_analysis, cache_key, semantic_key)
+
+        except Exception as e:
+            logger.error(f"❌ Error en análisis OpenAI: {str(e)}")
+            return {"intent": "unknown", "confidence": 0}
+
+    def analyze_and_respond(self, message: str, context: dict = None) -> dict:
+        """
+        Analiza la intención y redacta la respuesta al cliente en una sola llamada.
+
+        Returns:
+            {"intent": análisis, "reply": respuesta o None}. Si la intención se
+            resuelve sin GPT (casos obvios o caché) no hay llamada y "reply" es
+            None: el llamador recurre a generate_smart_response solo si la necesita.
+        """
+        try:
+            basic_analysis, resolved = self._resolve_intent_locally(message)
+            if resolved:
+                return {"intent": basic_analysis, "reply": None}
+
+            # Mismas cachés de intención que analyze_user_intent (la respuesta
+            # depende de la sesión y no se cachea)
+            cache_key = self._intent_cache_key(self._build_intent_messages(message))
+            cached = self._get_intent_response(cache_key)
+            if cached is not None:
+                return {"intent": cached, "reply": None}
+
+            cached, semantic_key = self._semantic_intent_lookup(message, basic_analysis)
+            if cached is not None:
+                return {"intent": cached, "reply": None}
+
+            result = self._make_request(
+                self._build_analyze_and_respond_messages(message, context),
+                max_tokens=self.ANALYZE_AND_RESPOND_MAX_TOKENS,
+                temperature=self.INTENT_TEMPERATURE,
+                model=self.intent_model,
+                response_format=self.JSON_RESPONSE_FORMAT
+            )
+            return self._parse_analyze_and_respond(result, basic_analysis, cache_key, semantic_key)
+
+        except Exception as e:
+            logger.error(f"❌ Error en análisis OpenAI: {str(e)}")
+            return {"intent": {"intent": "unknown", "confidence": 0}, "reply": None}
+
+    def _build_analyze_and_respond_messages(self, message: str, context: dict = None) -> list[dict]:
+        """
+        Construye los mensajes de analyze_and_respond: mensaje del cliente y estado de la sesión.
+        """
+        user_content = f"Mensaje: '{message}'"
+        if context:
+            user_content += (
+                f"\nEstado actual: {context.get('state', 'unknown')}"
+                f"\nDatos de sesión: {context.get('data', {})}"
+            )
+
+        return [
+            {"role": "system", "content": _SYSTEM_PROMPT_ANALYZE_AND_RESPOND},
+            {"role": "user", "content": user_content}
+        ]
+
+    def _parse_analyze_and_respond(self, result: str | None, basic_analysis: dict, cache_key: str = None, semantic_key: tuple = None) -> dict:
+        """
+        Separa la respuesta combinada en intención y respuesta (sync y async).
+        La intención válida se guarda en las cachés de analyze_user_intent.
+        """
+        if not result:
+            return {"intent": {"intent": "unknown", "confidence": 0}, "reply": None}
+
+        try:
+            parsed_result = orjson.loads(result)
+        except orjson.JSONDecodeError:
+            parsed_result = None
+
+        intent = parsed_result.get("intent") if isinstance(parsed_result, dict) else None
+        if not isinstance(intent, dict):
+            logger.warning(f"⚠️ Respuesta combinada sin objeto de intención: {result[:100]}...")
+            logger.info("🔄 Usando análisis básico como fallback")
+            return {"intent": basic_analysis, "reply": None}
+
+        logger.info("🤖 Análisis OpenAI: %s", intent)
+        if cache_key or semantic_key:
+            intent_json = orjson.dumps(intent).decode()
+            if cache_key:
+                self._save_intent_response(cache_key, intent_json)
+            if semantic_key:
+                self._semantic_intent_cache.add(*semantic_key, intent_json)
+
+        reply = parsed_result.get("reply")
+        if not isinstance(reply, str) or not reply.strip():
+            reply = None
+
+        return {"intent": intent, "reply": self._finish_smart_response(reply)}
+
+    def _resolve_intent_locally(self, message: str) -> tuple[dict, bool]:
+        """
+        Análisis determinista previo a GPT (compartido por la versión síncrona y async).
+
+        Returns:
+            (análisis básico, True si ya es la respuesta final y se omite GPT)
+        """
+        # Análisis determinista primero: evita la llamada a GPT en los casos obvios
+        basic_analysis = self._basic_intent_analysis(message)
+
+        if not self.is_available():
+            # Fallback con análisis básico de patrones
+            return basic_analysis, True
+
+        self._intent_analyses += 1
+        if self._is_obvious_intent(message, basic_analysis):
+            self._intent_llm_skips += 1
+            logger.info(
+                "⚡ Intención resuelta sin GPT: %s (confidence=%s)",
+                basic_analysis.get('intent'), basic_analysis.get('confidence')
+            )
+            return basic_analysis, True
+
+        return basic_analysis, False
+
+    def _intent_cache_key(self, messages: list[dict]) -> str:
+        """Clave de la caché de intención: prompt del sistema + mensaje + modelo + temperatura."""
+        return self._request_cache_key(
+            messages, self.intent_model, self.INTENT_MAX_TOKENS, self.INTENT_TEMPERATURE, self.JSON_RESPONSE_FORMAT
+        )
+
+    def _semantic_intent_lookup(self, message: str, basic_analysis: dict) -> tuple[dict | None, tuple | None]:
+        """
+        Busca un mensaje equivalente en la caché semántica (si está activada).
+
+        Returns:
+            (análisis cacheado o None, clave (embedding, firma) para guardar la
+            respuesta de GPT si no hubo acierto)
+        """
+        if self._semantic_intent_cache is None:
+            return None, None
+
+        embedding = self._intent_embedding(message)
+        if embedding is None:
+            return None, None
+
+        signature = self._intent_signature(message, basic_analysis)
+        cached = self._semantic_intent_cache.lookup(embedding, signature)
+        if cached is None:
+            return None, (embedding, signature)
+
+        logger.info("💾 Intención desde caché semántica (hits=%s)", self._semantic_intent_cache.hits)
+        return orjson.loads(cached), None
+
+    def _intent_embedding(self, message: str) -> np.ndarray | None:
+        """Embedding normalizado del mensaje (RAGService, con su propia caché)."""
+        try:
+            from app.services.rag_service import get_rag_service
+
+            embedding = get_rag_service()._generate_embedding(message.strip().lower())
+            if not embedding:
+                return None
+
+            vector = np.asarray(embedding, dtype=np.float32)
+            norm = np.linalg.norm(vector)
+            return vector / norm if norm else None
+
+        except Exception as e:
+            logger.warning(f"⚠️ Error generando embedding para caché semántica: {str(e)}")
+            return None
+
+    def _intent_signature(self, message: str, basic_analysis: dict) -> tuple:
+        """
+        Datos que deben coincidir exactamente para reutilizar una respuesta:
+        números en orden (tallas, glaseo, cantidades), términos de producto y
+        proceso, y producto/destino/cliente detectados por patrones.
+        """
+        return (
+            tuple(_NUMBER_RE.findall(message)),
+            self._scan_keywords(_fold_text(message)) & self.SEMANTIC_SIGNATURE_KEYWORDS,
+            basic_analysis.get('product'),
+            basic_analysis.get('destination'),
+            basic_analysis.get('cliente_nombre'),
+        )
+
+    def _parse_intent_result(self, result: str | None, basic_analysis: dict, cache_key: str = None, semantic_key: tuple = None) -> dict:
+        """
+        Interpreta la respuesta JSON del modelo de intención y la guarda en caché si es válida.
+        """
+        if not result:
+            return {"intent": "unknown", "confidence": 0}
+
+        # Intentar parsear como JSON
+        try:
+            parsed_result = orjson.loads(result)
+        except orjson.JSONDecodeError:
+            parsed_result = None
+
+        # Con response_format=json_object la API garantiza un objeto; un valor
+        # suelto ("proforma", null) solo llega de un modelo sin modo JSON
+        if not isinstance(parsed_result, dict):
+            logger.warning(f"⚠️ Respuesta no es un objeto JSON (modelo fine-tuned?): {result[:100]}...")
+            # 🆕 Fallback: Si el modelo fine-tuned responde en texto, usar análisis básico
+            logger.info("🔄 Usando análisis básico como fallback")
+            return basic_analysis
+
+        logger.info("🤖 Análisis OpenAI: %s", parsed_result)
+        if cache_key:
+            self._save_intent_response(cache_key, result)
+        if semantic_key:
+            self._semantic_intent_cache.add(*semantic_key, result)
+        return parsed_result
+
+    def _build_intent_messages(self, message: str) -> list[dict]:
+        """
+        Construye los mensajes para la extracción de intención en JSON.
+        Compartido por analyze_user_intent y los lotes de queue_intent_batch.
+        """
+        return [
+            {"role": "system", "content": _SYSTEM_PROMPT_INTENT},
+            {"role": "user", "content": f"Mensaje: '{message}'"}
+        ]
+
+    def _is_obvious_intent(self, message: str, basic_analysis: dict) -> bool:
+        """
+        Determina si el análisis básico es suficiente y se puede omitir la llamada a GPT.
+
+        Casos deterministas:
+        - Saludos sin indicadores de cotización
+        - Modificación de flete (el valor se extrae con patrones)
+        - Proforma de un solo producto y una sola talla con confianza alta
+        """
+        intent = basic_analysis.get('intent')
+
+        if intent in ('greeting', 'modify_flete'):
+            return True
+
+        if intent == 'proforma':
+            if basic_analysis.get('confidence', 0) < self.INTENT_SKIP_LLM_CONFIDENCE:
+                return False
+            if not (basic_analysis.get('product') and basic_analysis.get('size')):
+                return False
+            if basic_analysis.get('multiple_products'):
+                return False
+            # Varias tallas (p. ej. Inteiro/Colas) requieren la extracción completa de GPT
+            sizes = _SIZE_SPACED_RE.finditer(message)
+            next(sizes, None)
+            return next(sizes, None) is None
+
+        return False
+
+    def generate_smart_response(self, user_message: str, context: dict, price_data: dict = None) -> str | None:
+        """
+        Genera una respuesta inteligente y personalizada
+        """
+        if not self.is_available():
+            return None
+
+        try:
+            messages = self._build_smart_response_messages(user_message, context, price_data)
+
+            result = self._make_request(messages, max_tokens=80, temperature=0.5)
+            return self._finish_smart_response(result)
+
+        except Exception as e:
+            logger.error(f"❌ Error generando respuesta OpenAI: {str(e)}")
+            return None
+
+    def _finish_smart_response(self, result: str | None) -> str | None:
+        """
+        Limpia y registra la respuesta de generate_smart_response (sync y async).
+        """
+        if not result:
+            return None
+
+        # Limpiar emojis problemáticos que pueden causar errores de codificación
+        cleaned_result = self._clean_problematic_emojis(result)
+        logger.info("🤖 Respuesta generada por OpenAI: %s", cleaned_result)
+        return cleaned_result
+
+    async def smart_response_stream(self, user_message: str, context: dict, price_data: dict = None) -> AsyncIterator[str]:
+        """
+        Variante en streaming de generate_smart_response.
+
+        Los fragmentos se emiten tal como llegan; los emojis problemáticos se
+        limpian por fragmento (cada emoji llega completo en un delta).
+        """
+        if not self.is_available():
+            return
+
+        messages = self._build_smart_response_messages(user_message, context, price_data)
+        async for chunk in self._astream(messages, max_tokens=80, temperature=0.5):
+            yield self._clean_problematic_emojis(chunk)
+
+    def _build_smart_response_messages(self, user_message: str, context: dict, price_data: dict = None) -> list[dict]:
+        """
+        Construye los mensajes (sistema + contexto del usuario) para generate_smart_response
+        """
+        # Construir contexto para GPT
+        context_info = f"""
+Usuario: {user_message}
+Estado actual: {context.get('state', 'unknown')}
+Datos de sesión: {context.get('data', {})}
+"""
+
+        if price_data:
+            context_info += f"\nDatos de precio disponibles: {price_data}"
+
+        return [
+            {"role": "system", "content": _SYSTEM_PROMPT_SMART},
+            {"role": "user", "content": context_info}
+        ]
+
+    def enhance_price_explanation(self, price_data: dict) -> str | None:
+        """
+        Mejora la explicación de precios usando IA
+        """
+        if not self.is_available() or not price_data:
+            return None
+
+        try:
+            messages = self._build_price_explanation_messages(price_data)
+
+            result = self._make_request(messages, max_tokens=60, temperature=0.5)
+
+            if result:
+                return result
+            else:
+                return None
+
+        except Exception as e:
+            logger.error(f"❌ Error mejorando explicación de precio: {str(e)}")
+            return None
+
+    def _build_price_explanation_messages(self, price_data: dict) -> list[dict]:
+        """
+        Construye los mensajes para enhance_price_explanation
+        """
+        return [
+            {"role": "system", "content": _SYSTEM_PROMPT_PRICE},
+            {"role": "user", "content": f"Datos de precio: {price_data}"}
+        ]
+
+    # ==================== VARIANTES ASÍNCRONAS (WEBHOOK) ====================
+
+    async def _make_request_async(self, messages: list[dict], max_tokens: int = 300, temperature: float = 0.3, use_cache: bool = True, force_base_model: bool = False, model: str = None, response_format: dict = None) -> str | None:
+        """
+        Versión asíncrona de _make_request sobre el cliente httpx compartido.
+
+        Comparte la caché de respuestas con la versión síncrona y deduplica las
+        peticiones idénticas concurrentes dentro del event loop.
+        """
+        if not self.is_available():
+            logger.warning("⚠️ OpenAI API key no configurada")
+            return None
+
+        model_to_use = self._resolve_model(model, force_base_model)
+
+        if not use_cache:
+            return await self._apost_chat_completion(messages, model_to_use, max_tokens, temperature, response_format)
+
+        cache_key = self._request_cache_key(messages, model_to_use, max_tokens, temperature, response_format)
+        cached_response = self._get_from_cache(cache_key)
+        if cached_response:
+            return cached_response
+
+        while (inflight := self._ainflight.get(cache_key)) is not None:
+            # Otra corrutina ya está pidiendo lo mismo: esperar su resultado
+            try:
+                await asyncio.wait_for(inflight.wait(), self.INFLIGHT_WAIT_TIMEOUT)
+            except TimeoutError:
+                logger.warning("⚠️ Timeout esperando petición idéntica en curso; se hace petición propia")
+                return await self._apost_chat_completion(messages, model_to_use, max_tokens, temperature, response_format)
+            cached_response = self._get_from_cache(cache_key)
+            if cached_response:
+                self._inflight_shared += 1
+                return cached_response
+            # La original falló: la primera corrutina en despertar pasa a ser la nueva original
+
+        event = asyncio.Event()
+        self._ainflight[cache_key] = event
+        try:
+            result = await self._apost_chat_completion(messages, model_to_use, max_tokens, temperature, response_format)
+            if result:
+                self._save_to_cache(cache_key, result)
+            return result
+        finally:
+            del self._ainflight[cache_key]
+            event.set()
+
+    async def _apost_chat_completion(self, messages: list[dict], model: str, max_tokens: int, temperature: float, response_format: dict = None) -> str | None:
+        """
+        Envía la petición chat/completions sin bloquear el event loop.
+
+        Reintenta los mismos códigos que la política urllib3 de la sesión
+        síncrona (HTTP_RETRY_STATUS_CODES), respetando Retry-After.
+        """
+        headers, data = self._build_chat_payload(messages, model, max_tokens, temperature, response_format)
+
+        try:
+            response = await self._apost_with_retries(self._chat_url, headers, orjson.dumps(data))
+            return self._read_chat_completion(response.status_code, response.content, response.headers)
+
+        except httpx.TimeoutException:
+            logger.error("❌ Timeout en petición a OpenAI (30s)")
+            return None
+        except httpx.HTTPError as e:
+            logger.error(f"❌ Error de red en petición OpenAI: {str(e)}")
+            return None
+        except Exception as e:
+            logger.error(f"❌ Error inesperado en petición OpenAI: {str(e)}")
+            return None
+
+    async def _apost_with_retries(self, url: str, headers: dict, content, timeout=httpx.USE_CLIENT_DEFAULT) -> httpx.Response:
+        """
+        POST con el cliente httpx compartido reintentando HTTP_RETRY_STATUS_CODES.
+
+        Un cuerpo en streaming (_MultipartFileStream) se rebobina antes de
+        cada reintento, como hace urllib3 en la sesión síncrona.
+        """
+        client = self._get_async_client()
+        for attempt in range(self.HTTP_RETRY_TOTAL + 1):
+            if attempt and hasattr(content, 'seek'):
+                content.seek(0)
+            response = await client.post(url, headers=headers, content=content, timeout=timeout)
+            if response.status_code not in self.HTTP_RETRY_STATUS_CODES or attempt == self.HTTP_RETRY_TOTAL:
+                return response
+            if response.status_code == 429:
+                self._rate_limit_hits += 1
+            await asyncio.sleep(self._retry_delay(attempt, response.headers.get('Retry-After')))
+
+    def _retry_delay(self, attempt: int, retry_after: str = None) -> float:
+        """
+        Espera antes del reintento `attempt` (0-based): Retry-After si el servidor
+        lo envía, si no backoff exponencial con jitter como la sesión síncrona.
+        """
+        if retry_after:
+            try:
+                return min(float(retry_after), self.RATE_LIMIT_DELAY)
+            except ValueError:
+                pass
+        backoff = self.HTTP_RETRY_BACKOFF_FACTOR * (2 ** attempt)
+        return backoff + random.uniform(0, self.HTTP_RETRY_BACKOFF_JITTER)
+
+    async def analyze_user_intent_async(self, message: str, context: dict = None) -> dict:
+        """
+        Versión asíncrona de analyze_user_intent para el webhook.
+        """
         try:
-            # Generar clave de caché
-            if use_cache:
-                prompt_text = json.dumps(messages, sort_keys=True)
-                params = {'max_tokens': max_tokens, 'temperature': temperature, 'model': self.model}
-                cache_key = self._generate_cache_key(prompt_text, params)
-
-                # Intentar obtener del caché
-                cached_response = self._get_from_cache(cache_key)
-                if cached_response:
-                    return cached_response
-
-            # Preparar petición
-            headers = {
-                "Authorization": f"Bearer {self.api_key}",
-                "Content-Type": "application/json"
-            }
+            basic_analysis, resolved = self._resolve_intent_locally(message)
+            if resolved:
+                return basic_analysis
+
+            messages = self._build_intent_messages(message)
+            cache_key = self._intent_cache_key(messages)
+            cached = self._get_intent_response(cache_key)
+            if cached is not None:
+                return cached
+
+            # El embedding usa la sesión síncrona de RAGService: se pide en un hilo
+            cached, semantic_key = await asyncio.to_thread(self._semantic_intent_lookup, message, basic_analysis)
+            if cached is not None:
+                return cached
+
+            result = await self._make_request_async(
+                messages,
+                max_tokens=self.INTENT_MAX_TOKENS,
+                temperature=self.INTENT_TEMPERATURE,
+                model=self.intent_model,
+                response_format=self.JSON_RESPONSE_FORMAT
+            )
+            return self._parse_intent_result(result, basic_analysis, cache_key, semantic_key)
 
-            # 🆕 Usar modelo base si se fuerza (para análisis JSON)
-            model_to_use = "gpt-3.5-turbo" if force_base_model else self.model
-            
-            data = {
-                "model": model_to_use,
-                "messages": messages,
-                "max_tokens": max_tokens,
-                "temperature": temperature
-            }
+        except Exception as e:
+            logger.error(f"❌ Error en análisis OpenAI: {str(e)}")
+            return {"intent": "unknown", "confidence": 0}
 
-            # Hacer petición con timeout
-            response = requests.post(
-                f"{self.base_url}/chat/completions",
-                headers=headers,
-                json=data,
-                timeout=30
+    async def analyze_and_respond_async(self, message: str, context: dict = None) -> dict:
+        """
+        Versión asíncrona de analyze_and_respond para el webhook.
+        """
+        try:
+            basic_analysis, resolved = self._resolve_intent_locally(message)
+            if resolved:
+                return {"intent": basic_analysis, "reply": None}
+
+            cache_key = self._intent_cache_key(self._build_intent_messages(message))
+            cached = self._get_intent_response(cache_key)
+            if cached is not None:
+                return {"intent": cached, "reply": None}
+
+            # El embedding usa la sesión síncrona de RAGService: se pide en un hilo
+            cached, semantic_key = await asyncio.to_thread(self._semantic_intent_lookup, message, basic_analysis)
+            if cached is not None:
+                return {"intent": cached, "reply": None}
+
+            result = await self._make_request_async(
+                self._build_analyze_and_respond_messages(message, context),
+                max_tokens=self.ANALYZE_AND_RESPOND_MAX_TOKENS,
+                temperature=self.INTENT_TEMPERATURE,
+                model=self.intent_model,
+                response_format=self.JSON_RESPONSE_FORMAT
             )
+            return self._parse_analyze_and_respond(result, basic_analysis, cache_key, semantic_key)
 
-            # Manejar respuesta exitosa
-            if response.status_code == 200:
-                result = response.json()
-                response_text = result["choices"][0]["message"]["content"].strip()
+        except Exception as e:
+            logger.error(f"❌ Error en análisis OpenAI: {str(e)}")
+            return {"intent": {"intent": "unknown", "confidence": 0}, "reply": None}
 
-                # Guardar en caché si está habilitado
-                if use_cache:
-                    self._save_to_cache(cache_key, response_text)
+    async def analyze_many(self, messages: list[str], concurrency: int = None) -> list[dict]:
+        """
+        Analiza varios mensajes a la vez (p. ej. mensajes acumulados del webhook).
 
-                return response_text
+        Las peticiones a GPT se lanzan en paralelo con un máximo de `concurrency`
+        simultáneas; los 429 se reintentan con backoff en _apost_chat_completion.
 
-            # Manejar rate limiting
-            elif response.status_code == 429:
-                logger.warning(f"⚠️ Rate limit alcanzado. Headers: {response.headers}")
-                # El método _make_request_with_retry se encarga de manejar esto
-                return None
+        Returns:
+            Un análisis por mensaje, en el mismo orden que `messages`
+        """
+        semaphore = asyncio.Semaphore(concurrency or self.INTENT_CONCURRENCY)
 
-            # Otros errores
-            else:
-                error_detail = ""
-                try:
-                    error_json = response.json()
-                    error_detail = error_json.get('error', {}).get('message', '')
-                except:
-                    error_detail = response.text[:200]
-
-                logger.error(
-                    f"❌ Error API OpenAI: {response.status_code} | "
-                    f"Detalle: {error_detail}"
-                )
-                return None
+        async def analyze_one(message: str) -> dict:
+            async with semaphore:
+                return await self.analyze_user_intent_async(message)
 
-        except requests.exceptions.Timeout:
-            logger.error("❌ Timeout en petición a OpenAI (30s)")
-            return None
-        except requests.exceptions.ConnectionError as e:
-            logger.error(f"❌ Error de conexión con OpenAI: {str(e)}")
-            return None
-        except requests.exceptions.RequestException as e:
-            logger.error(f"❌ Error de red en petición OpenAI: {str(e)}")
-            return None
-        except Exception as e:
-            logger.error(f"❌ Error inesperado en petición OpenAI: {str(e)}")
-            return None
+        results = await asyncio.gather(*(analyze_one(message) for message in messages), return_exceptions=True)
 
-    def analyze_user_intent(self, message: str, context: dict = None) -> dict:
+        for index, result in enumerate(results):
+            if isinstance(result, Exception):
+                logger.error(f"❌ Error en análisis OpenAI (lote, mensaje {index}): {str(result)}")
+                results[index] = {"intent": "unknown", "confidence": 0}
+        return results
+
+    async def generate_smart_response_async(self, user_message: str, context: dict, price_data: dict = None) -> str | None:
         """
-        Analiza la intención del usuario usando GPT-4o mini
+        Versión asíncrona de generate_smart_response para el webhook.
         """
         if not self.is_available():
-            # Fallback con análisis básico de patrones
-            return self._basic_intent_analysis(message)
+            return None
 
         try:
-            system_prompt = """Extrae información estructurada de solicitudes de camarón/langostino.
-
-PRODUCTOS: HOSO, HLSO, P&D IQF, P&D BLOQUE, EZ PEEL, PuD-EUROPA, PuD-EEUU, COOKED, PRE-COCIDO, COCIDO SIN TRATAR
-TALLAS: U15, 16/20, 20/30, 21/25, 26/30, 30/40, 31/35, 36/40, 40/50, 41/50, 50/60, 51/60, 60/70, 61/70, 70/80, 71/90
-
-MAPEO DE TÉRMINOS:
-- "Colas"/"Cola" (sin cocedero) → HLSO | "Colas Cocedero"/"Cocidas" → COOKED
-- "Inteiro"/"Entero" (sin cocedero) → HOSO | "Inteiro Cocedero" → needs_product_type: true
-- Solo "Cocedero" → needs_product_type: true (preguntar COOKED/PRE-COCIDO/COCIDO SIN TRATAR)
-- "CFR/CIF [ciudad]" → destination + flete_solicitado: true
-- "Cola X/X con flete Y" → product: HLSO, flete_custom: Y
-- Normalizar tallas: "16-20" → "16/20", "16 20" → "16/20"
-- "BRINE/Salmuera" → processing_type | "100% NET" → net_weight_percentage: 100
-
-REGLAS:
-1. Si menciona tallas → intent: "proforma" (incluso con saludo)
-2. Extraer TODAS las tallas, normalizar a formato X/X
-3. Si "Inteiro" + "Colas" → separar en sizes_inteiro y sizes_colas
-4. CFR sin glaseo → glaseo_factor: null | CFR con glaseo X% → glaseo_factor: (100-X)/100
-5. NO asumir valores por defecto, extraer solo lo explícito
-6. Glaseo: 0%=null, 10%=0.90, 20%=0.80, 30%=0.70
-
-EJEMPLOS:
-Input: "HLSO 16/20 con 20% glaseo"
-Output: {"intent":"proforma","product":"HLSO","size":"16/20","sizes":["16/20"],"glaseo_factor":0.80,"confidence":0.9}
-
-Input: "HLSO 16-20/21-25/26-30 HOSO 20-30/30-40 BRINE 100% NET 20k/caja"
-Output: {"intent":"proforma","multiple_products":true,"multiple_sizes":true,"sizes":["16/20","21/25","26/30","20/30","30/40"],"sizes_by_product":{"HLSO":["16/20","21/25","26/30"],"HOSO":["20/30","30/40"]},"processing_type":"BRINE","net_weight_percentage":100,"cantidad":"20000 kg/caja","confidence":0.95}
-
-Input: "Cocedero CFR Lisboa: Inteiro 20/30, 30/40. Colas 21/25, 31/35"
-Output: {"intent":"proforma","needs_product_type":true,"product_category":"cocido","sizes_inteiro":["20/30","30/40"],"sizes_colas":["21/25","31/35"],"sizes":["20/30","30/40","21/25","31/35"],"destination":"Lisboa","flete_solicitado":true,"glaseo_percentage":0,"multiple_sizes":true,"multiple_presentations":true,"confidence":0.95}
-
-Input: "Precio cfr de cola 20/30 con 0.25 de flete"
-Output: {"intent":"proforma","product":"HLSO","size":"20/30","sizes":["20/30"],"flete_custom":0.25,"flete_solicitado":true,"confidence":0.95}
-
-Input: "Hola, necesito cotización"
-Output: {"intent":"greeting","wants_proforma":true,"confidence":0.8}
-
-Responde SOLO JSON. Incluye solo campos con valor (omite null/false):
-{
-  "intent": "proforma|pricing|product_info|greeting|help|other",
-  "product": "HLSO",
-  "size": "16/20",
-  "sizes": ["16/20","21/25"],
-  "sizes_by_product": {"HLSO":["16/20"]},
-  "sizes_inteiro": ["20/30"],
-  "sizes_colas": ["21/25"],
-  "multiple_sizes": true,
-  "multiple_products": true,
-  "multiple_presentations": true,
-  "needs_product_type": true,
-  "product_category": "cocido",
-  "clarification_needed": "...",
-  "glaseo_factor": 0.80,
-  "glaseo_percentage": 20,
-  "destination": "Houston",
-  "flete_custom": 0.25,
-  "flete_solicitado": true,
-  "is_ddp": true,
-  "cantidad": "20000 kg/caja",
-  "processing_type": "BRINE",
-  "net_weight_percentage": 100,
-  "cliente_nombre": "...",
-  "wants_proforma": true,
-  "language": "es",
-  "confidence": 0.9
-}
-"""
+            messages = self._build_smart_response_messages(user_message, context, price_data)
+            result = await self._make_request_async(messages, max_tokens=80, temperature=0.5)
+            return self._finish_smart_response(result)
 
-            messages = [
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": f"Mensaje: '{message}'"}
-            ]
+        except Exception as e:
+            logger.error(f"❌ Error generando respuesta OpenAI: {str(e)}")
+            return None
 
-            # Forzar modelo base para análisis JSON (el fine-tuned responde en texto)
-            result = self._make_request(messages, max_tokens=400, temperature=0.3, force_base_model=True)
+    async def enhance_price_explanation_async(self, price_data: dict) -> str | None:
+        """
+        Versión asíncrona de enhance_price_explanation.
+        """
+        if not self.is_available() or not price_data:
+            return None
 
-            if result:
-                # Intentar parsear como JSON
-                try:
-                    parsed_result = json.loads(result)
-                    logger.info(f"🤖 Análisis OpenAI: {parsed_result}")
-                    return parsed_result
-                except json.JSONDecodeError:
-                    logger.warning(f"⚠️ Respuesta no es JSON (modelo fine-tuned?): {result[:100]}...")
-                    # 🆕 Fallback: Si el modelo fine-tuned responde en texto, usar análisis básico
-                    logger.info("🔄 Usando análisis básico como fallback")
-                    return self._basic_intent_analysis(message)
-            else:
-                return {"intent": "unknown", "confidence": 0}
+        try:
+            messages = self._build_price_explanation_messages(price_data)
+            return await self._make_request_async(messages, max_tokens=60, temperature=0.5) or None
 
         except Exception as e:
-            logger.error(f"❌ Error en análisis OpenAI: {str(e)}")
-            return {"intent": "unknown", "confidence": 0}
+            logger.error(f"❌ Error mejorando explicación de precio: {str(e)}")
+            return None
 
-    def generate_smart_response(self, user_message: str, context: dict, price_data: dict = None) -> str | None:
+    async def transcribe_audio_async(self, audio_file_path: str, language: str = 'es') -> str | None:
         """
-        Genera una respuesta inteligente y personalizada
+        Versión asíncrona de transcribe_audio.
+
+        El audio se sube por bloques desde disco con el cliente httpx
+        compartido: ni se carga completo en memoria ni bloquea el event loop
+        mientras Whisper responde.
         """
         if not self.is_available():
+            logger.warning("⚠️ OpenAI no disponible para transcripción de audio")
             return None
 
         try:
-            # Construir contexto para GPT
-            context_info = f"""
-Usuario: {user_message}
-Estado actual: {context.get('state', 'unknown')}
-Datos de sesión: {context.get('data', {})}
-"""
+            fields = self._transcription_fields(audio_file_path, language)
+            if fields is None:
+                return None
 
-            if price_data:
-                context_info += f"\nDatos de precio disponibles: {price_data}"
+            with _MultipartFileStream(fields, 'file', audio_file_path) as body:
+                headers = {
+                    **self._auth_headers,
+                    "Content-Type": body.content_type,
+                    "Content-Length": str(len(body))
+                }
+                response = await self._apost_with_retries(
+                    self._audio_url,
+                    headers,
+                    body,
+                    timeout=60  # Timeout más largo para archivos grandes
+                )
 
-            base = self._get_base_context()
-            system_prompt = f"""{base}
+            return self._read_transcription(response.status_code, response.text)
 
-INSTRUCCIONES:
-- Si tiene PRODUCTO + TALLA: confirma y genera proforma. No pidas más datos.
-- Saludos: máximo 100 caracteres
-- Preguntas: máximo 150 caracteres
-- Confirmaciones: máximo 200 caracteres
-- Listados múltiples: máximo 300 caracteres
-- Si tiene producto y talla: "Generando proforma de [producto] [talla]..."
+        except httpx.TimeoutException:
+            logger.error("❌ Timeout en transcripción de audio")
+            return None
+        except httpx.HTTPError as e:
+            logger.error(f"❌ Error de red en transcripción: {str(e)}")
+            return None
+        except Exception as e:
+            logger.error(f"❌ Error inesperado en transcripción de audio: {str(e)}")
+            return None
 
-REGLA: Si detectas producto + talla, genera la proforma directamente."""
+    # ==================== BATCH API (FLUJOS NO INTERACTIVOS) ====================
 
-            messages = [
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": context_info}
-            ]
+    def queue_batch(self, batch_requests: list[dict]) -> str | None:
+        """
+        Envía un lote de peticiones chat/completions a la Batch API de OpenAI.
 
-            result = self._make_request(messages, max_tokens=200, temperature=0.5)
+        Pensado para procesos en segundo plano (reprocesar históricos, ETL de
+        entrenamiento): el resultado llega en hasta 24h a mitad de costo.
 
-            if result:
-                # Limpiar emojis problemáticos que pueden causar errores de codificación
-                cleaned_result = self._clean_problematic_emojis(result)
-                logger.info(f"🤖 Respuesta generada por OpenAI: {cleaned_result}")
-                return cleaned_result
-            else:
+        Args:
+            batch_requests: Lista de dicts con 'custom_id' y 'body' (cuerpo de
+                chat/completions: model, messages, max_tokens, ...)
+
+        Returns:
+            ID del batch creado o None si falla
+        """
+        if not self.is_available() or not batch_requests:
+            return None
+
+        jsonl_path = None
+
+        try:
+            # Escribir el archivo JSONL de entrada
+            with tempfile.NamedTemporaryFile("wb", suffix=".jsonl", delete=False) as jsonl_file:
+                jsonl_path = jsonl_file.name
+                for item in batch_requests:
+                    jsonl_file.write(orjson.dumps({
+                        "custom_id": item["custom_id"],
+                        "method": "POST",
+                        "url": self.BATCH_ENDPOINT,
+                        "body": item["body"]
+                    }))
+                    jsonl_file.write(b"\n")
+
+            # Subir el archivo con propósito "batch"
+            with _MultipartFileStream({"purpose": "batch"}, "file", jsonl_path) as body:
+                upload = self._session.post(
+                    f"{self.base_url}/files",
+                    headers={**self._auth_headers, "Content-Type": body.content_type},
+                    data=body,
+                    timeout=60
+                )
+            if upload.status_code != 200:
+                logger.error(f"❌ Error subiendo archivo batch: {upload.status_code} - {upload.text[:200]}")
+                return None
+            input_file_id = orjson.loads(upload.content)["id"]
+
+            # Crear el batch. Ni la subida ni la creación se reenvían tras un
+            # error de estado (ver _build_http_session): un 5xx tardío con el batch
+            # ya creado duplicaría el trabajo y su costo
+            response = self._session.post(
+                f"{self.base_url}/batches",
+                headers=self._json_headers,
+                data=orjson.dumps({
+                    "input_file_id": input_file_id,
+                    "endpoint": self.BATCH_ENDPOINT,
+                    "completion_window": self.BATCH_COMPLETION_WINDOW
+                }),
+                timeout=30
+            )
+            if response.status_code != 200:
+                logger.error(f"❌ Error creando batch: {response.status_code} - {response.text[:200]}")
                 return None
 
+            batch_id = orjson.loads(response.content)["id"]
+            logger.info("📦 Batch creado: %s (%s peticiones)", batch_id, len(batch_requests))
+            return batch_id
+
+        except requests.exceptions.RequestException as e:
+            logger.error(f"❌ Error de red creando batch: {str(e)}")
+            return None
         except Exception as e:
-            logger.error(f"❌ Error generando respuesta OpenAI: {str(e)}")
+            logger.error(f"❌ Error inesperado creando batch: {str(e)}")
             return None
+        finally:
+            if jsonl_path and os.path.exists(jsonl_path):
+                os.remove(jsonl_path)
 
-    def enhance_price_explanation(self, price_data: dict) -> str | None:
+    def get_batch(self, batch_id: str) -> dict | None:
         """
-        Mejora la explicación de precios usando IA
+        Consulta el estado de un batch (validating, in_progress, completed, failed, ...).
         """
-        if not self.is_available() or not price_data:
+        if not self.is_available():
             return None
 
         try:
-            system_prompt = """Explica precios de camarón de forma clara y profesional.
+            response = self._session.get(
+                f"{self.base_url}/batches/{batch_id}",
+                headers=self._auth_headers,
+                timeout=30
+            )
+            if response.status_code != 200:
+                logger.error(f"❌ Error consultando batch {batch_id}: {response.status_code}")
+                return None
+            return orjson.loads(response.content)
 
-Incluye: producto, talla, desglose de precio (base, FOB, glaseo, final).
-Máximo 150 caracteres. Tono directo. Texto plano, sin JSON."""
+        except requests.exceptions.RequestException as e:
+            logger.error(f"❌ Error de red consultando batch: {str(e)}")
+            return None
 
-            messages = [
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": f"Datos de precio: {price_data}"}
-            ]
+    def get_batch_results(self, batch_id: str) -> dict[str, str] | None:
+        """
+        Descarga los resultados de un batch completado.
 
-            result = self._make_request(messages, max_tokens=100, temperature=0.5)
+        Returns:
+            Dict {custom_id: contenido de la respuesta}; None si el batch aún
+            no terminó o falla la descarga. Las peticiones con error se omiten.
+        """
+        batch = self.get_batch(batch_id)
+        if not batch or batch.get("status") != "completed" or not batch.get("output_file_id"):
+            return None
 
-            if result:
-                return result
-            else:
+        try:
+            response = self._session.get(
+                f"{self.base_url}/files/{batch['output_file_id']}/content",
+                headers=self._auth_headers,
+                timeout=60
+            )
+            if response.status_code != 200:
+                logger.error(f"❌ Error descargando resultados del batch {batch_id}: {response.status_code}")
                 return None
 
-        except Exception as e:
-            logger.error(f"❌ Error mejorando explicación de precio: {str(e)}")
+        except requests.exceptions.RequestException as e:
+            logger.error(f"❌ Error de red descargando batch: {str(e)}")
+            return None
+
+        results = {}
+        for line in response.content.splitlines():
+            if not line.strip():
+                continue
+            try:
+                item = orjson.loads(line)
+                result = item.get("response") or {}
+                if result.get("status_code") != 200:
+                    logger.warning(f"⚠️ Petición {item.get('custom_id')} del batch falló")
+                    continue
+                results[item["custom_id"]] = result["body"]["choices"][0]["message"]["content"].strip()
+            except (orjson.JSONDecodeError, KeyError, IndexError, TypeError) as e:
+                logger.warning(f"⚠️ Línea de resultados de batch inválida: {str(e)}")
+
+        return results
+
+    def queue_intent_batch(self, messages: list[str]) -> str | None:
+        """
+        Encola el análisis de intención de varios mensajes en la Batch API.
+        Los custom_id son "intent-<índice>" según el orden de messages.
+        """
+        batch_requests = [
+            {
+                "custom_id": f"intent-{index}",
+                "body": {
+                    "model": self.intent_model,
+                    "messages": self._build_intent_messages(message),
+                    "max_tokens": self.INTENT_MAX_TOKENS,
+                    "temperature": self.INTENT_TEMPERATURE,
+                    "response_format": self.JSON_RESPONSE_FORMAT
+                }
+            }
+            for index, message in enumerate(messages)
+        ]
+        return self.queue_batch(batch_requests)
+
+    def get_intent_batch_results(self, batch_id: str) -> dict[str, dict] | None:
+        """
+        Resultados de queue_intent_batch parseados como análisis de intención.
+        """
+        results = self.get_batch_results(batch_id)
+        if results is None:
             return None
 
+        intents = {}
+        for custom_id, content in results.items():
+            try:
+                intents[custom_id] = orjson.loads(content)
+            except orjson.JSONDecodeError:
+                logger.warning(f"⚠️ Resultado {custom_id} no es JSON")
+        return intents
+
     # ==================== MÉTODOS ESPECIALIZADOS POR RESPONSABILIDAD ====================
 
     def _get_base_context(self) -> str:
@@ -754,12 +2552,7 @@ Máximo 150 caracteres. Tono directo. Texto plano, sin JSON."""
         Contexto base común para todos los prompts.
         Fuente de verdad para productos, tallas y tono.
         """
-        return """Eres ShrimpBot, el asistente comercial de BGR Export.
-
-PRODUCTOS: HOSO, HLSO, P&D IQF, P&D BLOQUE, EZ PEEL, PuD-EUROPA, PuD-EEUU, COOKED, PRE-COCIDO, COCIDO SIN TRATAR
-TALLAS: U15, 16/20, 20/30, 21/25, 26/30, 30/40, 31/35, 36/40, 40/50, 41/50, 50/60, 51/60, 60/70, 61/70, 70/80, 71/90
-
-TONO: Profesional y directo. Respuestas concisas sin emojis excesivos. Máximo un emoji por mensaje si es necesario. Trato de tú."""
+        return _BASE_CONTEXT
 
     def generate_greeting_response(self, user_name: str = None) -> str | None:
         """
@@ -787,7 +2580,7 @@ LÍMITE: Máximo 100 caracteres. {user_context}"""
             result = self._make_request(messages, max_tokens=50, temperature=0.5)
 
             if result:
-                logger.info(f"💬 Saludo generado: {result[:50]}...")
+                logger.info("💬 Saludo generado: %s...", result[:50])
                 return self._clean_problematic_emojis(result)
 
             return None
@@ -827,7 +2620,7 @@ LÍMITE: Máximo 200 caracteres. Datos: {context}"""
             result = self._make_request(messages, max_tokens=80, temperature=0.3)
 
             if result:
-                logger.info(f"✅ Confirmación generada para {product} {size}")
+                logger.info("✅ Confirmación generada para %s %s", product, size)
                 return self._clean_problematic_emojis(result)
 
             return None
@@ -898,7 +2691,7 @@ LÍMITE: Máximo {q_config['limit']} caracteres.{context_str}"""
             result = self._make_request(messages, max_tokens=60, temperature=0.5)
 
             if result:
-                logger.info(f"❓ Pregunta generada: tipo={question_type}")
+                logger.info("❓ Pregunta generada: tipo=%s", question_type)
                 return self._clean_problematic_emojis(result)
 
             return None
@@ -1036,54 +2829,23 @@ APLICA EL MISMO ESTILO Y TONO QUE EN LOS EJEMPLOS."""
             return None
 
         try:
-            # Verificar que el archivo existe
-            if not os.path.exists(audio_file_path):
-                logger.error(f"❌ Archivo de audio no encontrado: {audio_file_path}")
-                return None
-
-            # Verificar tamaño del archivo (máximo 25MB para Whisper)
-            file_size = os.path.getsize(audio_file_path)
-            if file_size > 25 * 1024 * 1024:  # 25MB
-                logger.error(f"❌ Archivo de audio muy grande: {file_size / (1024*1024):.2f}MB")
+            fields = self._transcription_fields(audio_file_path, language)
+            if fields is None:
                 return None
 
-            logger.info(f"🎤 Transcribiendo audio: {audio_file_path} ({file_size / 1024:.2f}KB)")
-
-            headers = {
-                "Authorization": f"Bearer {self.api_key}"
-            }
-
-            with open(audio_file_path, 'rb') as audio_file:
-                files = {
-                    'file': audio_file,
-                    'model': (None, self.whisper_model)
-                }
-
-                # Agregar idioma solo si se especifica
-                if language:
-                    files['language'] = (None, language)
+            # El audio se envía por bloques desde disco, sin cargarlo completo en memoria
+            with _MultipartFileStream(fields, 'file', audio_file_path) as body:
+                headers = {**self._auth_headers, "Content-Type": body.content_type}
 
                 # Intentar transcripción con timeout extendido
-                response = requests.post(
-                    f"{self.base_url}/audio/transcriptions",
+                response = self._session.post(
+                    self._audio_url,
                     headers=headers,
-                    files=files,
+                    data=body,
                     timeout=60  # Timeout más largo para archivos grandes
                 )
 
-            if response.status_code == 200:
-                result = response.json()
-                transcription = result.get('text', '').strip()
-
-                if transcription:
-                    logger.info(f"✅ Audio transcrito exitosamente: '{transcription[:100]}...'")
-                    return transcription
-                else:
-                    logger.warning("⚠️ Transcripción vacía")
-                    return None
-            else:
-                logger.error(f"❌ Error API Whisper: {response.status_code} - {response.text}")
-                return None
+            return self._read_transcription(response.status_code, response.text)
 
         except requests.exceptions.Timeout:
             logger.error("❌ Timeout en transcripción de audio")
@@ -1095,6 +2857,53 @@ APLICA EL MISMO ESTILO Y TONO QUE EN LOS EJEMPLOS."""
             logger.error(f"❌ Error inesperado en transcripción de audio: {str(e)}")
             return None
 
+    def _transcription_fields(self, audio_file_path: str, language: str = None) -> dict | None:
+        """
+        Valida el archivo de audio y arma los campos del formulario de Whisper.
+
+        Returns:
+            Campos del multipart o None si el archivo no existe o excede el límite
+        """
+        # Verificar que el archivo existe
+        if not os.path.exists(audio_file_path):
+            logger.error(f"❌ Archivo de audio no encontrado: {audio_file_path}")
+            return None
+
+        # Verificar tamaño del archivo (máximo 25MB para Whisper)
+        file_size = os.path.getsize(audio_file_path)
+        if file_size > 25 * 1024 * 1024:  # 25MB
+            logger.error(f"❌ Archivo de audio muy grande: {file_size / (1024*1024):.2f}MB")
+            return None
+
+        logger.info("🎤 Transcribiendo audio: %s (%.2fKB)", audio_file_path, file_size / 1024)
+
+        # Texto plano (sin envoltorio JSON) y temperatura 0 para transcripción determinista
+        fields = {
+            'model': self.whisper_model,
+            'response_format': 'text',
+            'temperature': '0'
+        }
+
+        # Agregar idioma solo si se especifica
+        if language:
+            fields['language'] = language
+        return fields
+
+    def _read_transcription(self, status_code: int, text: str) -> str | None:
+        """Extrae el texto transcrito de la respuesta de Whisper (sync y async)."""
+        if status_code == 200:
+            transcription = text.strip()
+
+            if transcription:
+                logger.info("✅ Audio transcrito exitosamente: '%s...'", transcription[:100])
+                return transcription
+            else:
+                logger.warning("⚠️ Transcripción vacía")
+                return None
+        else:
+            logger.error(f"❌ Error API Whisper: {status_code} - {text}")
+            return None
+
     def detect_multiple_products(self, message: str) -> list[dict]:
         """
         Detecta múltiples productos en un mensaje
@@ -1104,44 +2913,31 @@ APLICA EL MISMO ESTILO Y TONO QUE EN LOS EJEMPLOS."""
         if not message:
             return []
 
-        message_upper = message.upper()
         products_found = []
 
         # PRIMERO: Detectar si menciona "Inteiro" y "Colas" (patrón especial)
-        has_inteiro = any(term in message_upper for term in ['INTEIRO', 'ENTERO'])
-        has_colas = any(term in message_upper for term in ['COLAS', 'COLA', 'TAILS', 'TAIL'])
+        has_inteiro = self.MULTI_INTEIRO_RX.search(message) is not None
+        has_colas = self.MULTI_COLAS_RX.search(message) is not None
         
         if has_inteiro or has_colas:
             # Buscar todas las tallas en el mensaje
-            all_sizes = re.findall(r'(\d+)/(\d+)', message)
+            all_sizes = self.MULTI_SIZE_SLASH_RX.findall(message)
             
             if len(all_sizes) > 1:
                 # Múltiples tallas detectadas con Inteiro/Colas
                 # Retornar lista vacía para forzar el flujo de aclaración
-                logger.info(f"🔍 Detectado patrón Inteiro/Colas con {len(all_sizes)} tallas → Requiere aclaración")
+                logger.info("🔍 Detectado patrón Inteiro/Colas con %s tallas → Requiere aclaración", len(all_sizes))
                 # Retornar lista con marcador especial
                 return [{'special': 'inteiro_colas', 'count': len(all_sizes)}]
 
-        # Patrones para productos específicos
-        product_patterns = {
-            'HOSO': r'\bHOSO\b',
-            'HLSO': r'\bHLSO\b',
-            'P&D IQF': r'\b(?:P&D|PYD|P\s*&\s*D)\s*(?:IQF|TAIL\s*OFF)?\b',
-            'P&D BLOQUE': r'\b(?:P&D|PYD)\s*(?:BLOQUE|BLOCK)\b',
-            'EZ PEEL': r'\b(?:EZ\s*PEEL|EZPEEL)\b',
-            'COOKED': r'\b(?:COOKED|COCIDO|COCEDERO)\b',
-        }
-
-        # Buscar todas las líneas del mensaje
-        lines = message_upper.split('\n')
-
-        for line in lines:
-            line = line.strip()
+        # Recorrer las líneas del mensaje sin crear una lista intermedia
+        for line_match in self.MULTI_LINE_RX.finditer(message):
+            line = line_match.group().strip()
             if not line or len(line) < 5:
                 continue
 
             # Buscar talla en la línea (formato XX/XX o XX-XX)
-            size_match = re.search(r'(\d+)[/-](\d+)', line)
+            size_match = self.MULTI_SIZE_RX.search(line)
             if not size_match:
                 continue
 
@@ -1149,25 +2945,25 @@ APLICA EL MISMO ESTILO Y TONO QUE EN LOS EJEMPLOS."""
 
             # Buscar producto en la línea
             product_found = None
-            for product_name, pattern in product_patterns.items():
-                if re.search(pattern, line):
+            for product_name, pattern in self.MULTI_PRODUCT_PATTERNS.items():
+                if pattern.search(line):
                     product_found = product_name
                     break
 
             # Si no se encontró producto específico, intentar inferir
             if not product_found:
                 # Si tiene "BLOCK" o "BLOQUE", es P&D BLOQUE
-                if 'BLOCK' in line or 'BLOQUE' in line:
+                if self.MULTI_BLOQUE_RX.search(line):
                     product_found = 'P&D BLOQUE'
                 # Si tiene "IQF", es P&D IQF
-                elif 'IQF' in line:
+                elif self.MULTI_IQF_RX.search(line):
                     product_found = 'P&D IQF'
 
             if product_found and size:
                 products_found.append({
                     'product': product_found,
                     'size': size,
-                    'line': line
+                    'line': line.upper()  # Solo las líneas con producto se normalizan
                 })
 
         return products_found
@@ -1197,7 +2993,7 @@ APLICA EL MISMO ESTILO Y TONO QUE EN LOS EJEMPLOS."""
             return {'sizes_by_product': None, 'multiple_products': False}
         
         # Extraer todas las tallas del mensaje
-        all_sizes = re.findall(r'(\d+)[/-](\d+)', message)
+        all_sizes = self.MULTI_SIZE_RX.findall(message)
         all_sizes_normalized = [f"{s[0]}/{s[1]}" for s in all_sizes]
         
         if not all_sizes_normalized:
@@ -1230,7 +3026,7 @@ APLICA EL MISMO ESTILO Y TONO QUE EN LOS EJEMPLOS."""
             
             # Extraer tallas entre este producto y el siguiente
             product_section = message[product_index:next_product_index]
-            product_sizes = re.findall(r'(\d+)[/-](\d+)', product_section)
+            product_sizes = self.MULTI_SIZE_RX.findall(product_section)
             product_sizes_normalized = [f"{s[0]}/{s[1]}" for s in product_sizes]
             
             if product_sizes_normalized:
@@ -1249,24 +3045,53 @@ APLICA EL MISMO ESTILO Y TONO QUE EN LOS EJEMPLOS."""
             'multiple_products': len(products_found) > 1
         }
     
+    def _scan_keywords(self, message_folded: str) -> frozenset:
+        """
+        Devuelve las palabras clave de INTENT_KEYWORDS presentes en el mensaje.
+
+        Recorre el mensaje una sola vez (autómata Aho-Corasick si está
+        disponible); las comprobaciones posteriores son intersecciones de
+        conjuntos en lugar de nuevas búsquedas en el texto. Recibe el mensaje
+        ya plegado con _fold_text, de modo que ignora tildes y espacios
+        repetidos.
+        """
+        return self._INTENT_KEYWORD_SCAN(message_folded)
+
     def _basic_intent_analysis(self, message: str) -> dict:
         """
         Análisis básico de intenciones sin IA como fallback
+
+        Los resultados se guardan en una caché LRU por mensaje; se devuelve una
+        copia para que el llamador pueda modificarla sin alterar la caché. El único
+        valor anidado mutable es sizes_by_product ({producto: [tallas]}), así que
+        basta con copiar el dict y esas listas en lugar de un deepcopy completo.
+        """
+        result = dict(self._intent_cache(message))
+        sizes_by_product = result.get('sizes_by_product')
+        if sizes_by_product:
+            result['sizes_by_product'] = {product: list(sizes) for product, sizes in sizes_by_product.items()}
+        return result
+
+    def _analyze_intent_patterns(self, message: str) -> dict:
+        """
+        Extrae la intención del mensaje con palabras clave y patrones regex.
         IMPORTANTE: Detectar cotizaciones ANTES que saludos para evitar falsos positivos
         """
         message_lower = message.lower().strip()
+        # Forma plegada (sin tildes) para la detección; la extracción de datos
+        # sigue usando message_lower para conservar las tildes
+        message_folded = _fold_text(message_lower)
+
+        # Una sola pasada sobre todas las palabras clave; el resto del análisis
+        # consulta este conjunto en lugar de volver a recorrer el mensaje
+        keyword_hits = self._scan_keywords(message_folded)
 
         # PRIMERO: Detectar si hay tallas (fuerte indicador de cotización)
         # Soporta formatos: 16/20, 16-20, 21/25, 21-25, etc.
-        has_size = bool(re.search(r'\b\d+[/-]\d+\b', message_lower))
+        has_size = _SIZE_ANY_RE.search(message_lower) is not None
         
         # SEGUNDO: Detectar términos de cotización/precio
-        proforma_keywords = [
-            'proforma', 'cotizacion', 'cotizar', 'quote', 'precio', 'precios',
-            'necesito', 'quiero', 'contenedor', 'cfr', 'cif', 'fob',
-            'cocedero', 'cocido', 'lagostino', 'vannamei', 'inteiro', 'colas'
-        ]
-        has_quote_keywords = any(keyword in message_lower for keyword in proforma_keywords)
+        has_quote_keywords = not keyword_hits.isdisjoint(self.QUOTE_KEYWORDS)
         
         # Si tiene tallas O términos de cotización, NO es solo un saludo
         # Continuar con el análisis de cotización
@@ -1274,9 +3099,7 @@ APLICA EL MISMO ESTILO Y TONO QUE EN LOS EJEMPLOS."""
         
         # Patrones de saludo (con límites de palabra para evitar falsos positivos)
         # SOLO considerar saludo si NO tiene indicadores de cotización
-        greeting_patterns = [r'\bhola\b', r'\bhello\b', r'\bhi\b', r'\bbuenos\b', r'\bbuenas\b',
-                           r'\bcomo estas\b', r'\bque tal\b', r'\bq haces\b']
-        has_greeting = any(re.search(pattern, message_lower) for pattern in greeting_patterns)
+        has_greeting = any(rx.search(message_folded) for rx in _GREETING_RES)
         
         if has_greeting and not is_likely_quote:
             return {
@@ -1292,41 +3115,21 @@ APLICA EL MISMO ESTILO Y TONO QUE EN LOS EJEMPLOS."""
         # Detectar solicitudes de modificación de flete
         # IMPORTANTE: Solo detectar cuando hay verbos de modificación explícitos
         # NO detectar solicitudes nuevas que incluyen flete
-        modify_flete_patterns = [
-            r'\bmodifica.*flete', r'\bcambiar.*flete', r'\bactualizar.*flete',
-            r'\bnuevo.*flete', r'\botro.*flete', r'\bflete.*diferente',
-            r'\bmodify.*freight', r'\bchange.*freight', r'\bupdate.*freight',
-        ]
 
         # Verificar que NO sea una solicitud nueva de cotización/proforma
-        new_quote_keywords = ['cotizar', 'cotizacion', 'proforma', 'quote', 'quotation', 'contenedor']
-        is_new_quote = any(keyword in message_lower for keyword in new_quote_keywords)
+        is_new_quote = not keyword_hits.isdisjoint(self.NEW_QUOTE_KEYWORDS)
 
         is_flete_modification = (
-            any(re.search(pattern, message_lower) for pattern in modify_flete_patterns) and
+            any(rx.search(message_lower) for rx in _MODIFY_FLETE_RES) and
             not is_new_quote  # NO es modificación si es una solicitud nueva
         )
 
         if is_flete_modification:
             # Extraer el nuevo valor de flete
             flete_custom = None
-            flete_patterns = [
-                r'flete\s+a\s+(?:\$\s*)?(\d+\.?\d*)',  # "flete a 0.30"
-                r'flete\s*(?:de\s*)?(?:\$\s*)?(\d+\.?\d*)',
-                r'(\d+\.?\d*)\s*(?:centavos?\s*)?(?:de\s*)?flete',
-                r'con\s*(\d+\.?\d*)\s*(?:de\s*)?flete',
-                r'freight\s*(?:of\s*)?(?:\$\s*)?(\d+\.?\d*)',
-                r'(\d+\.?\d*)\s*freight',
-            ]
-
-            for pattern in flete_patterns:
-                match = re.search(pattern, message_lower)
-                if match:
-                    try:
-                        flete_custom = float(match.group(1))
-                        break
-                    except ValueError:
-                        continue
+            match = _MODIFY_FLETE_VALUE_RES.first_match(message_lower)
+            if match:
+                flete_custom = float(match.group(1))
 
             return {
                 "intent": "modify_flete",
@@ -1335,26 +3138,11 @@ APLICA EL MISMO ESTILO Y TONO QUE EN LOS EJEMPLOS."""
                 "suggested_response": "Modificar flete y regenerar proforma"
             }
 
-        # Patrones de proforma/cotización (lenguaje natural amplio)
-        proforma_patterns = [
-            # Palabras clave directas
-            'proforma', 'cotizacion', 'cotizar', 'quote', 'precio', 'precios',
-            # Verbos de acción
-            'creame', 'crear', 'generar', 'hazme', 'dame', 'quiero', 'necesito',
-            # Consultas de precio
-            'precio de', 'precio del', 'precio por', 'cuanto cuesta', 'cuanto vale',
-            'cuanto es', 'cual es el precio', 'saber el precio', 'conocer el precio',
-            # Variaciones comunes
-            'cost', 'value', 'rate', 'tarifa', 'valor', 'costo',
-            # Frases específicas
-            'envio a', 'con envio', 'para enviar', 'destino', 'shipping'
-        ]
-
-        # Detectar si es una consulta de precio/proforma
-        is_price_query = any(pattern in message_lower for pattern in proforma_patterns)
+        # Detectar si es una consulta de precio/proforma (lenguaje natural amplio)
+        is_price_query = not keyword_hits.isdisjoint(self.PRICE_QUERY_KEYWORDS)
 
         # También detectar si menciona tallas específicas (fuerte indicador)
-        has_size = bool(re.search(r'\b\d+/\d+\b', message_lower))
+        has_size = _SIZE_SLASH_RE.search(message_lower) is not None
 
         # Si es consulta de precio O menciona tallas, procesar como proforma
         if is_price_query or has_size:
@@ -1367,11 +3155,11 @@ APLICA EL MISMO ESTILO Y TONO QUE EN LOS EJEMPLOS."""
 
             # IMPORTANTE: Detectar si menciona "Cocedero" o "Cocido" como CALIDAD
             # Esto NO define el producto, sino el tipo de procesamiento
-            menciona_cocedero = any(term in message_lower for term in ['cocedero', 'cocido', 'cooked', 'cozido'])
+            menciona_cocedero = not keyword_hits.isdisjoint(self.COCEDERO_TERMS)
             
             # Detectar PRESENTACIÓN del producto (Inteiro vs Colas)
-            menciona_inteiro = any(term in message_lower for term in ['inteiro', 'entero', 'whole'])
-            menciona_colas = any(term in message_lower for term in ['colas', 'tails', 'tail', 'cola'])
+            menciona_inteiro = not keyword_hits.isdisjoint(self.INTEIRO_TERMS)
+            menciona_colas = not keyword_hits.isdisjoint(self.COLAS_TERMS)
             
             # Lógica inteligente de detección:
             # Si menciona "Cocedero" + "Inteiro" → NO es COOKED, es solicitud compleja
@@ -1400,71 +3188,16 @@ APLICA EL MISMO ESTILO Y TONO QUE EN LOS EJEMPLOS."""
                     product = None
                     needs_clarification = True
             else:
-                # No menciona cocedero, usar lógica normal
-                # IMPORTANTE: "cola" sin "cocedero" = HLSO (camarón sin cabeza, con cáscara)
-                # Solo "cola cocedero" = COOKED (colas cocidas)
-                product_patterns = {
-                    'HLSO': [
-                        'sin cabeza', 'hlso', 'head less', 'headless', 'descabezado',
-                        'sin cabezas', 'tipo sin cabeza',
-                        # AGREGADO: "cola" sin "cocedero" = HLSO (camarón sin cabeza)
-                        'cola', 'colas', 'tail', 'tails'
-                    ],
-                    'HOSO': [
-                        'con cabeza', 'hoso', 'head on', 'entero', 'completo',
-                        'con cabezas', 'tipo con cabeza', 'inteiro', 'whole' , 'entero'
-                    ],
-                    'P&D IQF': [
-                        'p&d iqf', 'pd iqf', 'p&d', 'pelado', 'peeled', 'deveined',
-                        'limpio', 'procesado', 'pd', 'p d', 'pelado y desvenado',
-                        
-                    ],
-                    'P&D BLOQUE': [
-                        'p&d bloque', 'pd bloque', 'bloque', 'block', 'p&d block',
-                        'pd block', 'pelado bloque'
-                    ],
-                    'PuD-EUROPA': [
-                        'pud europa', 'pud-europa', 'europa', 'european', 'europeo'
-                    ],
-                    'EZ PEEL': [
-                        'ez peel', 'ez', 'easy peel', 'facil pelado', 'fácil pelado'
-                    ],
-                    'PuD-EEUU': [
-                        'pud eeuu', 'pud-eeuu', 'eeuu', 'usa', 'estados unidos'
-                    ],
-                    'COOKED': [
-                        # REMOVIDO: 'colas', 'tails', 'tail' (ahora solo se detecta con "cocedero")
-                        'cooked', 'cocinado', 'preparado'
-                    ],
-                    'PRE-COCIDO': [
-                        'pre-cocido', 'pre cocido', 'precocido', 'pre-cooked', 'pre cooked'
-                    ],
-                    'COCIDO SIN TRATAR': [
-                        'cocido sin tratar', 'sin tratar', 'untreated', 'natural cocido'
-                    ]
-                }
-
-                # Buscar coincidencias de productos (orden específico para evitar conflictos)
-                # IMPORTANTE: P&D IQF debe ir ANTES que COOKED para detectar "cola" correctamente
-                specific_order = ['COCIDO SIN TRATAR', 'PRE-COCIDO', 'P&D IQF', 'P&D BLOQUE', 'PuD-EUROPA', 'PuD-EEUU', 'EZ PEEL', 'HLSO', 'HOSO', 'COOKED']
-
-                for prod_name in specific_order:
-                    if prod_name in product_patterns:
-                        patterns = product_patterns[prod_name]
-                        if any(pattern in message_lower for pattern in patterns):
-                            product = prod_name
-                            break
+                # No menciona cocedero: primer producto (por prioridad) con algún alias presente
+                for prod_name, aliases in self.PRODUCT_ALIASES.items():
+                    if not keyword_hits.isdisjoint(aliases):
+                        product = prod_name
+                        break
 
             # Detectar tallas PRIMERO (antes de la lógica de HOSO)
-            size_patterns = [
-                r'(\d+/\d+)',  # 21/25
-                r'(\d+)\s*sobre\s*(\d+)',  # 21 sobre 25
-                r'(\d+)\s*-\s*(\d+)',  # 21-25
-                r'(\d+)\s+(\d+)'  # 21 25
-            ]
 
-            for pattern in size_patterns:
-                match = re.search(pattern, message_lower)
+            for rx in _SIZE_RES:
+                match = rx.search(message_lower)
                 if match:
                     if len(match.groups()) == 1:
                         size = match.group(1)
@@ -1475,136 +3208,51 @@ APLICA EL MISMO ESTILO Y TONO QUE EN LOS EJEMPLOS."""
             # Si no se detectó producto pero hay talla específica, inferir por talla
             if not product and size:
                 # Tallas que solo existen en HOSO según la tabla de precios
-                hoso_exclusive_sizes = ['20/30', '30/40', '40/50', '50/60', '60/70', '70/80']
-                if size in hoso_exclusive_sizes:
+                if size in self.HOSO_EXCLUSIVE_SIZES:
                     product = 'HOSO'
 
             # NO asumir producto por defecto para otras tallas - el usuario debe especificarlo
 
             # Detectar glaseo con patrones más amplios (español e inglés)
             # IMPORTANTE: Detectar también "0%" que significa SIN glaseo
-            glaseo_patterns = [
-                # Patrones en español
-                r'(\d+)\s*(?:de\s*)?glaseo',
-                r'glaseo\s*(?:de\s*)?(\d+)',
-                r'(\d+)\s*%\s*glaseo',
-                r'glaseo\s*(\d+)\s*%',
-                r'con\s*(\d+)\s*glaseo',
-                r'(\d+)\s*porciento\s*glaseo',
-                # Patrones adicionales para "al X%" y "al X"
-                r'al\s*(\d+)\s*%',  # "al 20%"
-                r'al\s*(\d+)(?:\s|$)',  # "al 20" (sin %)
-                r'(\d+)\s*%\s*de\s*glaseo',
-                r'(\d+)\s*%\s*glaseo',
-                # Patrón para "Inteiro 0%" o "0%" solo
-                r'(?:inteiro|entero|colas?|tails?)\s+(\d+)\s*%',  # "Inteiro 0%"
-                r'^\s*(\d+)\s*%',  # "0%" al inicio
-                # Patrones en inglés
-                r'(\d+)g?\s*(?:of\s*)?glaze',
-                r'glaze\s*(?:of\s*)?(\d+)g?',
-                r'(\d+)\s*%\s*glaze',
-                r'glaze\s*(\d+)\s*%',
-                r'with\s*(\d+)g?\s*glaze',
-                r'(\d+)\s*percent\s*glaze',
-                r'at\s*(\d+)\s*%',  # "at 20%"
-                r'at\s*(\d+)(?:\s|$)'  # "at 20" (sin %)
-            ]
 
             glaseo_percentage_original = None
-            for pattern in glaseo_patterns:
-                match = re.search(pattern, message_lower)
-                if match:
-                    glaseo_percentage_original = int(match.group(1))
-                    
-                    # CASO ESPECIAL: 0% glaseo = Sin glaseo
-                    if glaseo_percentage_original == 0:
-                        glaseo_factor = None  # No aplicar glaseo
-                        logger.info("🔍 Detectado 0% glaseo → Sin glaseo (CFR simple)")
-                    else:
-                        # Convertir porcentaje a factor usando fórmula general
-                        # Factor = 1 - (percentage / 100)
-                        # Ejemplo: 15% glaseo → factor = 1 - 0.15 = 0.85
-                        glaseo_factor = 1 - (glaseo_percentage_original / 100)
-                    break
+            match = _GLASEO_RES.first_match(message_lower)
+            if match:
+                glaseo_percentage_original = int(match.group(1))
+                
+                # CASO ESPECIAL: 0% glaseo = Sin glaseo
+                if glaseo_percentage_original == 0:
+                    glaseo_factor = None  # No aplicar glaseo
+                    logger.info("🔍 Detectado 0% glaseo → Sin glaseo (CFR simple)")
+                else:
+                    # Fórmula general: 15% glaseo → factor 0.85
+                    glaseo_factor = glaseo_percentage_to_factor(glaseo_percentage_original)
 
             # Detectar si menciona DDP (precio que YA incluye flete)
             # DDP = Delivered Duty Paid (precio incluye todo: flete, impuestos, etc.)
             # IMPORTANTE: Si dice DDP, necesitamos el valor del flete para desglosar el precio
-            ddp_patterns = [
-                r'\bddp\b',  # DDP con límites de palabra
-                r'ddp\s',    # DDP seguido de espacio
-                r'\sddp',    # DDP precedido de espacio
-                r'precio\s+ddp',
-                r'ddp\s+price',
-                r'delivered\s+duty\s+paid'
-            ]
-            menciona_ddp = any(re.search(pattern, message_lower) for pattern in ddp_patterns)
+            menciona_ddp = (
+                not keyword_hits.isdisjoint(_DDP_ANCHORS) and
+                any(rx.search(message_lower) for rx in _DDP_RES)
+            )
 
             # Detectar valores numéricos de flete
             flete_custom = None
-            flete_patterns = [
-                r'flete\s*(?:de\s*)?(?:\$\s*)?(\d+\.?\d*)',  # "flete de 0.20", "flete $0.20"
-                r'(\d+\.?\d*)\s*(?:centavos?\s*)?(?:de\s*)?flete',  # "0.20 centavos de flete"
-                r'con\s*(\d+\.?\d*)\s*(?:de\s*)?flete',  # "con 0.20 de flete"
-                r'freight\s*(?:of\s*)?(?:\$\s*)?(\d+\.?\d*)',  # "freight 0.20", "freight $0.20"
-                r'(\d+\.?\d*)\s*freight',  # "0.20 freight"
-            ]
 
             # Extraer valor de flete si se menciona
-            for pattern in flete_patterns:
-                match = re.search(pattern, message_lower)
+            if not keyword_hits.isdisjoint(_FLETE_ANCHORS):
+                match = _FLETE_RES.first_match(message_lower)
                 if match:
-                    try:
-                        flete_custom = float(match.group(1))
-                        break
-                    except ValueError:
-                        continue
+                    flete_custom = float(match.group(1))
 
             # Detectar destinos si se menciona flete, DDP, CFR o CIF
-            flete_keywords = ['flete', 'freight', 'envio', 'envío', 'shipping', 'transporte', 'ddp', 'cfr', 'cif', 'c&f']
-            menciona_flete = any(keyword in message_lower for keyword in flete_keywords)
+            menciona_flete = not keyword_hits.isdisjoint(self.FLETE_MENTION_KEYWORDS)
 
             if menciona_flete:
-                destination_patterns = {
-                    # Ciudades USA
-                    'Houston': ['houston', 'houton', 'huston'],
-                    'Miami': ['miami', 'maiami', 'florida'],
-                    'New York': ['new york', 'nueva york', 'ny', 'newyork'],
-                    'Los Angeles': ['los angeles', 'california'],  # Removido 'la' genérico
-                    'Chicago': ['chicago', 'chicaco'],
-                    'Dallas': ['dallas', 'dalas'],
-
-                    # Ciudades Europa
-                    'Lisboa': ['lisboa', 'lisbon', 'portugal'],
-                    'Madrid': ['madrid', 'españa', 'spain'],
-                    'Barcelona': ['barcelona'],
-                    'Paris': ['paris', 'france', 'francia'],
-                    'Londres': ['londres', 'london', 'uk', 'reino unido'],
-                    'Roma': ['roma', 'rome', 'italy', 'italia'],
-                    'Berlin': ['berlin', 'germany', 'alemania'],
-                    'Amsterdam': ['amsterdam', 'netherlands', 'holanda'],
-
-                    # Países y regiones
-                    'China': ['china', 'beijing', 'shanghai'],
-                    'Japón': ['japon', 'japón', 'japan', 'tokyo', 'nippon'],
-                    'Europa': ['europa', 'europe'],
-                    'Brasil': ['brasil', 'brazil', 'sao paulo', 'rio'],
-                    'México': ['mexico', 'méxico', 'guadalajara', 'monterrey'],
-                    'Canadá': ['canada', 'toronto', 'vancouver'],
-                    'Australia': ['australia', 'sydney', 'melbourne'],
-                    'Corea': ['corea', 'korea', 'seoul'],
-                    'India': ['india', 'mumbai', 'delhi'],
-                    'Tailandia': ['tailandia', 'thailand', 'bangkok'],
-                    'Vietnam': ['vietnam', 'ho chi minh'],
-                    'Singapur': ['singapur', 'singapore'],
-                    'Filipinas': ['filipinas', 'philippines', 'manila'],
-                    'Indonesia': ['indonesia', 'jakarta'],
-                    'Malasia': ['malasia', 'malaysia', 'kuala lumpur']
-                }
-
-                # Buscar destinos USA solo si menciona flete
-                for dest_name, patterns in destination_patterns.items():
-                    if any(pattern in message_lower for pattern in patterns):
+                # Buscar destinos solo si menciona flete (primer alias en orden de prioridad)
+                for alias, (dest_name, _) in _ALIAS_TO_DEST.items():
+                    if alias in message_lower:
                         if dest_name == 'Houston':
                             usar_libras = False  # Houston es excepción: USA pero usa kilos
                         else:
@@ -1615,30 +3263,22 @@ APLICA EL MISMO ESTILO Y TONO QUE EN LOS EJEMPLOS."""
             # También detectar patrones de envío específicos (solo si ya menciona flete)
             if menciona_flete and not destination:
                 # Patrones más específicos para detectar destinos (incluyendo CFR/CIF)
-                envio_specific_patterns = [
-                    r'cfr\s+([a-záéíóúñ\w\s]+?)(?:\s+para|\s+con|\s+de|$)',        # "CFR Lisboa"
-                    r'cif\s+([a-záéíóúñ\w\s]+?)(?:\s+para|\s+con|\s+de|$)',        # "CIF Lisboa"
-                    r'c&f\s+([a-záéíóúñ\w\s]+?)(?:\s+para|\s+con|\s+de|$)',        # "C&F Lisboa"
-                    r'flete\s+a\s+([a-záéíóúñ\w\s]+?)(?:\s+para|\s+con|\s+de|$)',  # "flete a japón"
-                    r'envio\s+a\s+([a-záéíóúñ\w\s]+?)(?:\s+para|\s+con|\s+de|$)',  # "envío a china"
-                    r'hacia\s+([a-záéíóúñ\w\s]+?)(?:\s+para|\s+con|\s+de|$)',      # "hacia europa"
-                    r'shipping\s+to\s+([a-zA-Z\s]+?)(?:\s+for|\s+with|$)',         # "shipping to japan"
-                ]
+                envio_specific_res = (
+                    _ENVIO_SPECIFIC_RES
+                    if not keyword_hits.isdisjoint(_ENVIO_SPECIFIC_ANCHORS)
+                    else ()
+                )
 
-                for pattern in envio_specific_patterns:
-                    match = re.search(pattern, message_lower)
+                for rx in envio_specific_res:
+                    match = rx.search(message_lower)
                     if match:
                         dest_detected = match.group(1).strip()
 
                         # Verificar si coincide con algún destino conocido
-                        for dest_name, patterns in destination_patterns.items():
-                            if any(p in dest_detected for p in patterns):
-                                destination = dest_name
-                                # Configurar usar_libras según el destino
-                                if dest_name in ['Houston', 'Miami', 'New York', 'Los Angeles', 'Chicago', 'Dallas']:
-                                    usar_libras = True if dest_name != 'Houston' else False
-                                else:
-                                    usar_libras = False  # Países internacionales usan kilos
+                        for alias, (dest_name, libras) in _ALIAS_TO_DEST.items():
+                            if alias in dest_detected:
+                                # Ciudades USA en libras (salvo Houston); países internacionales en kilos
+                                destination, usar_libras = dest_name, libras
                                 break
 
                         # Si no coincide con destinos conocidos, usar el texto detectado
@@ -1646,131 +3286,76 @@ APLICA EL MISMO ESTILO Y TONO QUE EN LOS EJEMPLOS."""
                             destination = dest_detected.title()
                             usar_libras = False  # Por defecto kilos para destinos desconocidos
                         break
-                envio_patterns = [
-                    r'flete a ([a-zA-Z\s]+)', r'envio a ([a-zA-Z\s]+)', r'enviar a ([a-zA-Z\s]+)',
-                    r'shipping to ([a-zA-Z\s]+)', r'con flete a ([a-zA-Z\s]+)'
-                ]
-
-                destination_patterns = {
-                    'Houston': ['houston', 'houton', 'huston'],
-                    'Miami': ['miami', 'maiami', 'florida'],
-                    'New York': ['new york', 'nueva york', 'ny', 'newyork'],
-                    'Los Angeles': ['los angeles', 'la', 'california'],
-                    'Chicago': ['chicago', 'chicaco'],
-                    'Dallas': ['dallas', 'dalas']
-                }
 
-                for pattern in envio_patterns:
-                    match = re.search(pattern, message_lower)
+            # Último recurso: texto libre tras "flete a", "enviar a", "shipping to"...
+            # Los alias conocidos ya se buscaron en todo el mensaje, así que aquí
+            # solo queda tomar el texto detectado como destino
+            if menciona_flete and not destination and not keyword_hits.isdisjoint(_ENVIO_ANCHORS):
+                for rx in _ENVIO_RES:
+                    match = rx.search(message_lower)
                     if match:
-                        dest_word = match.group(1).lower().strip()
-                        # Verificar si es una ciudad USA conocida
-                        for dest_name, patterns in destination_patterns.items():
-                            if any(p in dest_word for p in patterns):
-                                if dest_name == 'Houston':
-                                    usar_libras = False  # Houston usa kilos
-                                else:
-                                    usar_libras = True  # Otras ciudades USA usan libras
-                                destination = dest_name
-                                break
-                        if not destination:
-                            destination = dest_word.title()
+                        destination = match.group(1).strip().title()
                         break
 
             # Detectar nombre del cliente con patrones más amplios (español e inglés)
             cliente_nombre = None
-            cliente_patterns = [
-                # Patrones en español
-                r'cliente\s+([a-záéíóúñ\w\s]+?)(?:\s+con|\s+de|\s+para|\s+precio|$)',
-                r'para\s+(?:el\s+cliente\s+)?([a-záéíóúñ\w\s]+?)(?:\s+con|\s+de|\s+precio|$)',
-                r'proforma\s+para\s+(?:el\s+cliente\s+)?([a-záéíóúñ\w\s]+?)(?:\s+con|\s+de|\s+precio|$)',
-                r'cotizacion\s+para\s+([a-záéíóúñ\w\s]+?)(?:\s+con|\s+de|\s+precio|$)',
-                r'señor\s+([a-záéíóúñ\w\s]+?)(?:\s+con|\s+de|\s+precio|$)',
-                r'sr\s+([a-záéíóúñ\w\s]+?)(?:\s+con|\s+de|\s+precio|$)',
-                # Patrones en inglés
-                r'client\s+([a-záéíóúñ\w\s]+?)(?:\s+with|\s+for|\s+price|$)',
-                r'for\s+(?:the\s+client\s+)?([a-záéíóúñ\w\s]+?)(?:\s+with|\s+for|\s+price|$)',
-                r'proforma\s+for\s+(?:the\s+client\s+)?([a-záéíóúñ\w\s]+?)(?:\s+with|\s+for|\s+price|$)',
-                r'quote\s+for\s+([a-záéíóúñ\w\s]+?)(?:\s+with|\s+for|\s+price|$)',
-                r'mr\s+([a-záéíóúñ\w\s]+?)(?:\s+with|\s+for|\s+price|$)',
-                r'mrs\s+([a-záéíóúñ\w\s]+?)(?:\s+with|\s+for|\s+price|$)'
-            ]
-
-            for pattern in cliente_patterns:
-                match = re.search(pattern, message_lower)
-                if match:
-                    cliente_nombre = match.group(1).strip()
-                    # Limpiar palabras comunes que no son nombres (español e inglés)
-                    stop_words = [
-                        'el', 'la', 'con', 'de', 'para', 'precio', 'tipo', 'glaseo',
-                        'flete', 'producto', 'talla', 'envio', 'destino', 'kilo', 'kilos',
-                        'the', 'with', 'for', 'price', 'type', 'glaze', 'freight',
-                        'product', 'size', 'shipping', 'destination'
-                    ]
-                    cliente_words = [word for word in cliente_nombre.split() if word not in stop_words]
-                    if cliente_words and len(' '.join(cliente_words)) > 2:
-                        cliente_nombre = ' '.join(cliente_words)
-                        break
-
-            # Detectar idioma
-            english_keywords = ['quote', 'price', 'cost', 'freight', 'shipping', 'quotation', 'shrimp', 'product']
-            spanish_keywords = ['proforma', 'cotizacion', 'precio', 'flete', 'envio', 'camaron', 'producto', 'glaseo']
+            cliente_matches = (
+                _CLIENTE_RES.iter_matches(message_lower)
+                if not keyword_hits.isdisjoint(_CLIENTE_ANCHORS)
+                else ()
+            )
+            for match in cliente_matches:
+                cliente_nombre = match.group(1).strip()
+                # Limpiar palabras comunes que no son nombres (español e inglés)
+                cliente_words = [word for word in cliente_nombre.split() if word not in _CLIENTE_STOP_WORDS]
+                if cliente_words and len(' '.join(cliente_words)) > 2:
+                    cliente_nombre = ' '.join(cliente_words)
+                    break
 
-            english_count = sum(1 for keyword in english_keywords if keyword in message_lower)
-            spanish_count = sum(1 for keyword in spanish_keywords if keyword in message_lower)
+            # Detectar idioma (intersección con las palabras clave ya encontradas)
+            english_count = len(keyword_hits & self.ENGLISH_KEYWORDS)
+            spanish_count = len(keyword_hits & self.SPANISH_KEYWORDS)
 
             language = "en" if english_count > spanish_count else "es"
 
             # Detectar tipo de procesamiento (BRINE, etc.)
             processing_type = None
-            processing_patterns = {
-                'BRINE': ['brine', 'salmuera', 'salmoura'],
-                'IQF': ['iqf', 'individual', 'individually'],
-                'BLOCK': ['bloque', 'block', 'bloques']
-            }
-            
-            for proc_type, patterns in processing_patterns.items():
-                if any(pattern in message_lower for pattern in patterns):
+            for proc_type, terms in self.PROCESSING_TYPE_TERMS.items():
+                if not keyword_hits.isdisjoint(terms):
                     processing_type = proc_type
                     break
             
             # Detectar porcentaje de peso neto (NET)
             net_weight_percentage = None
-            net_patterns = [
-                r'(\d+)\s*%\s*net',  # "100% NET"
-                r'net\s*(\d+)\s*%',  # "NET 100%"
-                r'(\d+)\s*%\s*neto',  # "100% neto"
-                r'neto\s*(\d+)\s*%',  # "neto 100%"
-            ]
+            net_res = _NET_RES if not keyword_hits.isdisjoint(_NET_ANCHORS) else ()
             
-            for pattern in net_patterns:
-                match = re.search(pattern, message_lower)
+            for rx in net_res:
+                match = rx.search(message_lower)
                 if match:
                     net_weight_percentage = int(match.group(1))
                     break
             
             # Detectar cantidad con formatos variados
             quantity = None
-            quantity_patterns = [
-                r'(\d+(?:,\d{3})*)\s*(?:libras?|lb|lbs)',
-                r'(\d+(?:,\d{3})*)\s*(?:kilos?|kg|kgs)',
-                r'(\d+(?:,\d{3})*)\s*(?:toneladas?|tons?)',
-                r'(\d+(?:\.\d+)?)\s*(?:mil|thousand)',
-                r'(\d+(?:,\d{3})*)\s*(?:pounds?)',
-                r'(\d+)k/caja',  # "20k/caja"
-                r'(\d+)kg/caja',  # "20kg/caja"
-            ]
+            quantity_value = None
+            if not keyword_hits.isdisjoint(_QUANTITY_ANCHORS):
+                # Una sola pasada; se queda con la cantidad de la unidad más prioritaria
+                best_rank = None
+                for match in _QUANTITY_RE.finditer(message_lower):
+                    # Cada alternativa captura (número, unidad): la unidad es el último grupo
+                    rank = _QUANTITY_UNIT_RANK[match.group(match.lastindex)]
+                    if best_rank is None or rank < best_rank:
+                        quantity_value, best_rank = match.group(match.lastindex - 1), rank
+                        if rank == 0:
+                            break
 
-            for pattern in quantity_patterns:
-                match = re.search(pattern, message_lower)
-                if match:
-                    quantity_value = match.group(1)
+                if quantity_value:
                     # Si es formato "20k/caja", convertir a kg
                     if 'k/caja' in message_lower or 'kg/caja' in message_lower:
-                        quantity = f"{int(quantity_value) * 1000} kg/caja"
+                        # Sin separadores de miles ("1,000") y admitiendo decimales ("1.5 mil")
+                        quantity = f"{round(float(quantity_value.replace(',', '')) * 1000)} kg/caja"
                     else:
                         quantity = quantity_value
-                    break
 
             # Detectar múltiples productos y agrupar tallas
             products_detection = self._detect_products_and_sizes(message)
@@ -1778,12 +3363,10 @@ APLICA EL MISMO ESTILO Y TONO QUE EN LOS EJEMPLOS."""
             multiple_products = products_detection.get('multiple_products', False)
             
             # Determinar confianza basada en información extraída
-            confidence = 0.6  # Base
-            if size: confidence += 0.2
-            if product: confidence += 0.1
-            if destination: confidence += 0.1
-            if glaseo_factor: confidence += 0.1
-            if sizes_by_product: confidence += 0.1
+            confidence = _PROFORMA_CONFIDENCE[
+                bool(size) | bool(product) << 1 | bool(destination) << 2 |
+                bool(glaseo_factor) << 3 | bool(sizes_by_product) << 4
+            ]
 
             return {
                 "intent": "proforma",
@@ -1803,13 +3386,12 @@ APLICA EL MISMO ESTILO Y TONO QUE EN LOS EJEMPLOS."""
                 "net_weight_percentage": net_weight_percentage,  # Porcentaje de peso neto
                 "wants_proforma": True,
                 "language": language,  # Idioma detectado
-                "confidence": min(confidence, 0.95),  # Máximo 0.95
+                "confidence": confidence,  # Máximo 0.95
                 "suggested_response": "Procesar proforma con datos extraídos"
             }
 
         # Patrones de productos
-        product_patterns = ['producto', 'productos', 'camaron', 'camarones', 'hlso', 'hoso', 'p&d']
-        if any(pattern in message_lower for pattern in product_patterns):
+        if not keyword_hits.isdisjoint(self.PRODUCT_INFO_KEYWORDS):
             return {
                 "intent": "product_info",
                 "product": None,
@@ -1821,8 +3403,7 @@ APLICA EL MISMO ESTILO Y TONO QUE EN LOS EJEMPLOS."""
             }
 
         # Patrones de ayuda
-        help_patterns = ['ayuda', 'help', 'como', 'que puedes', 'opciones', '?']
-        if any(pattern in message_lower for pattern in help_patterns):
+        if not keyword_hits.isdisjoint(self.HELP_KEYWORDS):
             return {
                 "intent": "help",
                 "product": None,
@@ -1847,65 +3428,13 @@ APLICA EL MISMO ESTILO Y TONO QUE EN LOS EJEMPLOS."""
         """
         Genera respuestas inteligentes sin IA basadas en patrones
         """
-        intent = intent_data.get('intent', 'unknown')
-        message_lower = user_message.lower().strip()
-
-        if intent == 'greeting':
-            # Respuesta rápida y directa para saludos
-            return "¡Hola! 🦐 ¿Qué producto de camarón necesitas? Te genero la cotización al instante 💰"
-
-        elif intent == 'pricing':
-            return "💰 ¡Perfecto! ¿Qué producto necesitas? HLSO es muy popular. Escribe 'precios' para ver tallas y crear tu proforma 📋"
-
-        elif intent == 'product_info':
-            return "🦐 Tenemos HLSO, P&D IQF, HOSO y más. ¿Cuál te interesa? Te genero la cotización con precios FOB actualizados 💰"
-
-        elif intent == 'help':
-            return "🤖 Te ayudo a crear proformas de camarón:\n• Precios FOB actualizados\n• Todas las tallas disponibles\n• PDF profesional\n\n¿Qué producto necesitas? 🦐"
-
-        else:
-            return "🦐 ¡Hola! Soy ShrimpBot de BGR Export. ¿Qué camarón necesitas? Te genero la proforma al instante 📋💰"
+        return self.FALLBACK_RESPONSES.get(intent_data.get('intent'), self.DEFAULT_FALLBACK_RESPONSE)
 
     def _clean_problematic_emojis(self, text: str) -> str:
         """
         Limpia emojis que pueden causar problemas de codificación en WhatsApp
         """
-        # Lista de emojis problemáticos y sus reemplazos
-        problematic_emojis = {
-            '🤑': '💰',  # Reemplazar cara con dinero por bolsa de dinero
-            '🤖': '🦐',  # Reemplazar robot por camarón
-            '💸': '💰',  # Reemplazar dinero volando por bolsa de dinero
-            '🤔': '🤝',  # Reemplazar cara pensando por apretón de manos
-        }
-
-        cleaned_text = text
-        for problematic, replacement in problematic_emojis.items():
-            cleaned_text = cleaned_text.replace(problematic, replacement)
-
-        return cleaned_text
-
-    def _make_request_with_retry(self, messages: list[dict], max_tokens: int = 300, temperature: float = 0.3, max_retries: int = 3) -> str | None:
-        """
-        Hace petición a OpenAI con reintentos automáticos
-        """
-        for attempt in range(max_retries):
-            try:
-                result = self._make_request(messages, max_tokens, temperature)
-                if result:
-                    return result
-
-                # Si falla, esperar un poco antes de reintentar
-                if attempt < max_retries - 1:
-                    import time
-                    time.sleep(1 * (attempt + 1))  # Backoff exponencial
-
-            except Exception as e:
-                logger.warning(f"⚠️ Intento {attempt + 1}/{max_retries} falló: {str(e)}")
-                if attempt < max_retries - 1:
-                    import time
-                    time.sleep(1 * (attempt + 1))
-
-        return None
+        return text.translate(self.PROBLEMATIC_EMOJIS)
 
     def _intelligent_fallback(self, user_message: str, session_data: dict = None) -> dict:
         """
@@ -1915,9 +3444,7 @@ APLICA EL MISMO ESTILO Y TONO QUE EN LOS EJEMPLOS."""
         message_lower = user_message.lower().strip()
 
         # Detectar saludos
-        greeting_patterns = [r'\bhola\b', r'\bhello\b', r'\bhi\b', r'\bbuenos\b', r'\bbuenas\b',
-                           r'\bhey\b', r'\bqué tal\b', r'\bcómo estás\b']
-        if any(re.search(pattern, message_lower) for pattern in greeting_patterns):
+        if _FALLBACK_GREETING_RE.search(message_lower):
             return {
                 "response": "¡Hola! 👋 Soy ShrimpBot de BGR Export 🦐\n\n¿Qué producto necesitas? Te ayudo a crear tu cotización al instante 💰",
                 "action": "greeting",
@@ -1925,8 +3452,7 @@ APLICA EL MISMO ESTILO Y TONO QUE EN LOS EJEMPLOS."""
             }
 
         # Detectar solicitudes de audio/voz
-        audio_patterns = ['audio', 'voz', 'voice', 'nota de voz', 'mensaje de voz', 'grabación']
-        if any(pattern in message_lower for pattern in audio_patterns):
+        if any(keyword in message_lower for keyword in self.FALLBACK_AUDIO_KEYWORDS):
             return {
                 "response": "🎤 ¡Claro! Puedes enviarme notas de voz y las procesaré automáticamente.\n\nSolo envía tu audio y te responderé con la información que necesites 🦐",
                 "action": "audio_info",
@@ -1934,8 +3460,7 @@ APLICA EL MISMO ESTILO Y TONO QUE EN LOS EJEMPLOS."""
             }
 
         # Detectar preguntas sobre productos
-        product_patterns = ['producto', 'productos', 'qué tienen', 'qué venden', 'catálogo', 'opciones']
-        if any(pattern in message_lower for pattern in product_patterns):
+        if any(keyword in message_lower for keyword in self.FALLBACK_PRODUCT_KEYWORDS):
             return {
                 "response": "🦐 Productos disponibles:\n\n• HLSO (sin cabeza)\n• HOSO (con cabeza)\n• P&D IQF (pelado)\n• P&D BLOQUE\n• EZ PEEL\n• PuD-EUROPA\n• COOKED\n\n¿Cuál te interesa? 💰",
                 "action": "product_list",
@@ -1943,8 +3468,7 @@ APLICA EL MISMO ESTILO Y TONO QUE EN LOS EJEMPLOS."""
             }
 
         # Detectar preguntas sobre precios
-        price_patterns = ['precio', 'precios', 'cuánto', 'cuanto', 'costo', 'cost', 'value']
-        if any(pattern in message_lower for pattern in price_patterns):
+        if any(keyword in message_lower for keyword in self.FALLBACK_PRICE_KEYWORDS):
             return {
                 "response": "💰 Te genero cotizaciones con precios FOB actualizados.\n\n¿Qué producto y talla necesitas?\nEjemplo: HLSO 16/20 🦐",
                 "action": "price_inquiry",
@@ -1952,8 +3476,7 @@ APLICA EL MISMO ESTILO Y TONO QUE EN LOS EJEMPLOS."""
             }
 
         # Detectar solicitudes de ayuda
-        help_patterns = ['ayuda', 'help', 'cómo', 'como funciona', 'qué puedes', 'opciones']
-        if any(pattern in message_lower for pattern in help_patterns):
+        if any(keyword in message_lower for keyword in self.FALLBACK_HELP_KEYWORDS):
             return {
                 "response": "🤖 Te ayudo a crear proformas de camarón:\n\n✅ Precios FOB actualizados\n✅ Todas las tallas\n✅ PDF profesional\n✅ Cálculo de glaseo\n✅ Flete incluido\n\n¿Qué producto necesitas? 🦐",
                 "action": "help",
@@ -1961,8 +3484,7 @@ APLICA EL MISMO ESTILO Y TONO QUE EN LOS EJEMPLOS."""
             }
 
         # Detectar agradecimientos
-        thanks_patterns = ['gracias', 'thanks', 'thank you', 'muchas gracias', 'te agradezco']
-        if any(pattern in message_lower for pattern in thanks_patterns):
+        if any(keyword in message_lower for keyword in self.FALLBACK_THANKS_KEYWORDS):
             return {
                 "response": "¡De nada! 😊 Estoy aquí para ayudarte.\n\n¿Necesitas algo más? 🦐",
                 "action": "thanks",
@@ -1970,8 +3492,7 @@ APLICA EL MISMO ESTILO Y TONO QUE EN LOS EJEMPLOS."""
             }
 
         # Detectar despedidas
-        goodbye_patterns = ['adiós', 'adios', 'bye', 'chao', 'hasta luego', 'nos vemos']
-        if any(pattern in message_lower for pattern in goodbye_patterns):
+        if any(keyword in message_lower for keyword in self.FALLBACK_GOODBYE_KEYWORDS):
             return {
                 "response": "¡Hasta pronto! 👋 Cuando necesites cotizaciones, aquí estaré 🦐💰",
                 "action": "goodbye",
@@ -1979,7 +3500,7 @@ APLICA EL MISMO ESTILO Y TONO QUE EN LOS EJEMPLOS."""
             }
 
         # Detectar tallas específicas (intento de cotización)
-        if re.search(r'\d+/\d+', message_lower):
+        if _SIZE_TOKEN_RE.search(message_lower):
             return {
                 "response": "📊 Detecté una talla en tu mensaje.\n\n¿Qué producto necesitas?\n• HLSO (sin cabeza)\n• HOSO (con cabeza)\n• P&D IQF (pelado)\n\nEscribe el producto para generar tu cotización 🦐",
                 "action": "size_detected",
@@ -2027,7 +3548,7 @@ APLICA EL MISMO ESTILO Y TONO QUE EN LOS EJEMPLOS."""
                     "transcription": None
                 }
 
-            logger.info(f"✅ Audio transcrito: '{transcription}'")
+            logger.info("✅ Audio transcrito: '%s'", transcription)
 
             # Procesar el mensaje transcrito
             result = self.handle_any_request(transcription, session_data, conversation_history)
@@ -1,7 +1,15 @@
+import asyncio
+import copy
+import io
 import logging
 import os
+import secrets
+import threading
+import time
 from datetime import datetime
 
+from PIL import Image as PILImage
+from reportlab import rl_config
 from reportlab.lib import colors
 from reportlab.lib.enums import TA_CENTER
 from reportlab.lib.pagesizes import A4, letter
@@ -11,25 +19,258 @@ from reportlab.platypus import Image, Paragraph, SimpleDocTemplate, Spacer, Tabl
 
 logger = logging.getLogger(__name__)
 
+# Streams del PDF solo con Flate (la compresión de página ya viene activa): el envoltorio
+# ASCII85 solo sirve para transportes de 7 bits, agranda cada stream un 25% y su
+# codificador en Python puro era el mayor costo de cada PDF (sobre todo el logo).
+# Es un ajuste global de ReportLab; este módulo es su único usuario en la app.
+rl_config.useA85 = 0
+
+# Textos fijos de la cotización individual; el título y el encabezado de precio
+# dependen del tipo (FOB/CFR) y se completan con _QUOTE_TITLE_TEMPLATES
+_QUOTE_TRANSLATIONS = {
+    "es": {
+        "fecha_cotizacion": "Fecha de Cotización",
+        "producto": "Producto",
+        "talla": "Talla",
+        "cliente": "Cliente",
+        "destino": "Destino",
+        "glaseo_solicitado": "Glaseo Solicitado",
+        "concepto": "Concepto",
+        "detalle": "Detalle",
+        "glaseo_aplicado": "Glaseo Aplicado",
+        "especificacion": "Especificación",
+        "contacto": "Contacto: BGR Export | amerino@bgrexport.com | +593 98-805-7425",
+        "notas": "NOTAS IMPORTANTES:",
+        "nota1": "• Precios sujetos a disponibilidad y confirmación.",
+        "nota2": "• Validez de la cotización: 7 días.",
+        "nota3": "• Condiciones de pago: Según acuerdo comercial.",
+        "ref": "Ref"
+    },
+    "en": {
+        "fecha_cotizacion": "Quotation Date",
+        "producto": "Product",
+        "talla": "Size",
+        "cliente": "Client",
+        "destino": "Destination",
+        "glaseo_solicitado": "Requested Glazing",
+        "concepto": "Concept",
+        "detalle": "Detail",
+        "glaseo_aplicado": "Applied Glazing",
+        "especificacion": "Specification",
+        "contacto": "Contact: BGR Export | amerino@bgrexport.com | +593 98-805-7425",
+        "notas": "IMPORTANT NOTES:",
+        "nota1": "• Prices subject to availability and confirmation.",
+        "nota2": "• Quote validity: 7 days.",
+        "nota3": "• Payment terms: According to commercial agreement.",
+        "ref": "Ref"
+    }
+}
+_QUOTE_TITLE_TEMPLATES = {
+    "es": ("COTIZACIÓN {}", "PRECIO {} USD/KG"),
+    "en": ("{} QUOTATION", "{} PRICE USD/KG"),
+}
+# Textos de la cotización consolidada
+_CONSOLIDATED_TRANSLATIONS = {
+    "es": {
+        "titulo": "COTIZACIÓN CONSOLIDADA",
+        "fecha": "Fecha de Cotización",
+        "destino": "Destino",
+        "glaseo": "Glaseo Aplicado",
+        "producto": "PRODUCTO",
+        "talla": "TALLA",
+        "precio_fob": "PRECIO FOB USD/KG",
+        "precio_cfr": "PRECIO CFR USD/KG",
+        "contacto": "Contacto: BGR Export | amerino@bgrexport.com | +593 98-805-7425",
+        "notas": "NOTAS IMPORTANTES:",
+        "nota1": "• Precios sujetos a disponibilidad y confirmación.",
+        "nota2": "• Validez de la cotización: 7 días.",
+        "nota3": "• Condiciones de pago: Según acuerdo comercial.",
+        "cliente": "Cliente",
+        "ref": "Ref"
+    },
+    "en": {
+        "titulo": "CONSOLIDATED QUOTATION",
+        "fecha": "Quotation Date",
+        "destino": "Destination",
+        "glaseo": "Glaze Applied",
+        "producto": "PRODUCT",
+        "talla": "SIZE",
+        "precio_fob": "FOB PRICE USD/KG",
+        "precio_cfr": "CFR PRICE USD/KG",
+        "contacto": "Contact: BGR Export | amerino@bgrexport.com | +593 98-805-7425",
+        "notas": "IMPORTANT NOTES:",
+        "nota1": "• Prices subject to availability and confirmation.",
+        "nota2": "• Quote validity: 7 days.",
+        "nota3": "• Payment terms: According to commercial agreement.",
+        "cliente": "Client",
+        "ref": "Ref"
+    }
+}
+# Fila de encabezado de la tabla de productos por idioma
+_PRODUCTS_TABLE_HEADERS = {
+    lang: (t["producto"], t["talla"], t["precio_fob"], t["precio_cfr"])
+    for lang, t in _CONSOLIDATED_TRANSLATIONS.items()
+}
+
 # Contador de cotizaciones persistente en archivo
 QUOTE_COUNTER_FILE = "data/quote_counter.txt"
-
-
-def _next_quote_number() -> str:
+# Caracteres que se quitan del teléfono para el sufijo del nombre de archivo
+_PHONE_STRIP = str.maketrans('', '', '+:')
+# Los PDFs se generan en hilos (variantes async): el contador se lee y escribe bajo lock
+_quote_counter_lock = threading.Lock()
+
+# Logo corporativo (714x146 pixels, proporción ~4.9:1)
+LOGO_PATH = os.path.join("data", "logoBGR.png")
+# Tamaño del logo en el PDF (proporción ~4.9:1) y resolución con la que se incrusta:
+# 150 DPI basta para pantalla e impresión y reduce a la mitad el tiempo y el peso del PDF
+LOGO_WIDTH = 4.9*inch
+LOGO_HEIGHT = 1*inch
+LOGO_DPI = 150
+
+# === ESTILOS (se construyen una vez al importar; los PDFs solo aportan el texto) ===
+# Solo los estilos se comparten: los flowables (Spacer, Paragraph, Table, Image) se
+# crean (o, el logo, se copian) por documento porque ReportLab les asigna el canvas
+# durante wrapOn/drawOn y las variantes async construyen varios PDFs a la vez en hilos.
+_STYLES = getSampleStyleSheet()
+
+# Colores corporativos BGR Export
+_AZUL_MARINO = colors.HexColor('#1e3a8a')
+_GRIS_CLARO = colors.HexColor('#e5e7eb')
+_GRIS_FILA = colors.HexColor('#f3f4f6')
+
+_COTIZACION_TITLE_STYLE = ParagraphStyle(
+    'CotizacionTitle',
+    parent=_STYLES['Heading2'],
+    fontSize=18,
+    spaceAfter=15,
+    alignment=TA_CENTER,
+    textColor=_AZUL_MARINO,
+    fontName='Helvetica-Bold'
+)
+_CONSOLIDATED_TITLE_STYLE = ParagraphStyle(
+    'CustomTitle',
+    parent=_STYLES['Heading1'],
+    fontSize=18,
+    textColor=_AZUL_MARINO,
+    spaceAfter=20,
+    alignment=TA_CENTER,
+    fontName='Helvetica-Bold'
+)
+_REF_STYLE = ParagraphStyle(
+    'RefStyle',
+    parent=_STYLES['Normal'],
+    fontSize=8,
+    textColor=colors.grey,
+    alignment=TA_CENTER
+)
+_NOTES_STYLE = ParagraphStyle(
+    'Notes',
+    parent=_STYLES['Normal'],
+    fontSize=9,
+    textColor=colors.black,
+    spaceAfter=5
+)
+_CONTACT_STYLE = ParagraphStyle(
+    'Contact',
+    parent=_STYLES['Normal'],
+    fontSize=8,
+    textColor=colors.grey,
+    alignment=TA_CENTER
+)
+
+# Estilos de tabla: ReportLab acepta la misma instancia en varias tablas
+_INFO_TABLE_STYLE = TableStyle([
+    # Encabezados con fondo azul marino
+    ('BACKGROUND', (0, 0), (0, -1), _AZUL_MARINO),
+    ('TEXTCOLOR', (0, 0), (0, -1), colors.white),
+    ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
+    ('FONTSIZE', (0, 0), (-1, -1), 11),
+    ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+    ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+    ('GRID', (0, 0), (-1, -1), 1, colors.black),
+    ('ROWBACKGROUNDS', (1, 0), (1, -1), [colors.white]),
+    ('LEFTPADDING', (0, 0), (-1, -1), 12),
+    ('RIGHTPADDING', (0, 0), (-1, -1), 12),
+    ('TOPPADDING', (0, 0), (-1, -1), 8),
+    ('BOTTOMPADDING', (0, 0), (-1, -1), 8),
+])
+_PRECIO_TABLE_STYLE = TableStyle([
+    # Encabezado
+    ('BACKGROUND', (0, 0), (0, 0), _AZUL_MARINO),
+    ('TEXTCOLOR', (0, 0), (0, 0), colors.white),
+    ('FONTNAME', (0, 0), (0, 0), 'Helvetica-Bold'),
+    ('FONTSIZE', (0, 0), (0, 0), 14),
+    ('ALIGN', (0, 0), (0, 0), 'CENTER'),
+    ('VALIGN', (0, 0), (0, 0), 'MIDDLE'),
+    # Precio
+    ('BACKGROUND', (0, 1), (0, 1), colors.white),
+    ('TEXTCOLOR', (0, 1), (0, 1), _AZUL_MARINO),
+    ('FONTNAME', (0, 1), (0, 1), 'Helvetica-Bold'),
+    ('FONTSIZE', (0, 1), (0, 1), 24),
+    ('ALIGN', (0, 1), (0, 1), 'CENTER'),
+    ('VALIGN', (0, 1), (0, 1), 'MIDDLE'),  # Centrado vertical
+    # Bordes y padding
+    ('GRID', (0, 0), (-1, -1), 2, colors.black),
+    ('TOPPADDING', (0, 0), (0, 0), 12),      # Encabezado
+    ('BOTTOMPADDING', (0, 0), (0, 0), 12),   # Encabezado
+    ('TOPPADDING', (0, 1), (0, 1), 15),      # Precio - más padding arriba
+    ('BOTTOMPADDING', (0, 1), (0, 1), 15),   # Precio - más padding abajo
+])
+_CENTERED_TABLE_STYLE = TableStyle([
+    ('ALIGN', (0, 0), (0, 0), 'CENTER'),
+    ('VALIGN', (0, 0), (0, 0), 'MIDDLE'),
+])
+_CONSOLIDATED_INFO_TABLE_STYLE = TableStyle([
+    ('BACKGROUND', (0, 0), (0, -1), _GRIS_CLARO),
+    ('TEXTCOLOR', (0, 0), (-1, -1), colors.black),
+    ('ALIGN', (0, 0), (0, -1), 'RIGHT'),
+    ('ALIGN', (1, 0), (1, -1), 'LEFT'),
+    ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
+    ('FONTNAME', (1, 0), (1, -1), 'Helvetica'),
+    ('FONTSIZE', (0, 0), (-1, -1), 10),
+    ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
+    ('TOPPADDING', (0, 0), (-1, -1), 8),
+    ('BOTTOMPADDING', (0, 0), (-1, -1), 8),
+])
+_PRODUCTS_TABLE_STYLE = TableStyle([
+    # Encabezado
+    ('BACKGROUND', (0, 0), (-1, 0), _AZUL_MARINO),
+    ('TEXTCOLOR', (0, 0), (-1, 0), colors.white),
+    ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+    ('FONTSIZE', (0, 0), (-1, 0), 11),
+    ('ALIGN', (0, 0), (-1, 0), 'CENTER'),
+    # Datos (filas alternas blanco / gris)
+    ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, _GRIS_FILA]),
+    ('TEXTCOLOR', (0, 1), (-1, -1), colors.black),
+    ('FONTNAME', (0, 1), (-1, -1), 'Helvetica'),
+    ('FONTSIZE', (0, 1), (-1, -1), 10),
+    ('ALIGN', (0, 1), (0, -1), 'LEFT'),  # Producto
+    ('ALIGN', (1, 1), (1, -1), 'CENTER'),  # Talla
+    ('ALIGN', (2, 1), (-1, -1), 'RIGHT'),  # Precios
+    # Bordes y padding
+    ('GRID', (0, 0), (-1, -1), 1, colors.grey),
+    ('TOPPADDING', (0, 0), (-1, -1), 10),
+    ('BOTTOMPADDING', (0, 0), (-1, -1), 10),
+    ('LEFTPADDING', (0, 0), (-1, -1), 8),
+    ('RIGHTPADDING', (0, 0), (-1, -1), 8),
+])
+
+
+def _next_quote_number(year: int) -> str:
     """Genera el siguiente número de cotización secuencial: BGR-YYYY-NNNN"""
-    counter = 1
-    if os.path.exists(QUOTE_COUNTER_FILE):
-        try:
-            with open(QUOTE_COUNTER_FILE, "r") as f:
-                counter = int(f.read().strip()) + 1
-        except (ValueError, OSError):
-            counter = 1
+    with _quote_counter_lock:
+        counter = 1
+        if os.path.exists(QUOTE_COUNTER_FILE):
+            try:
+                with open(QUOTE_COUNTER_FILE, "r") as f:
+                    counter = int(f.read().strip()) + 1
+            except (ValueError, OSError):
+                counter = 1
+
+        os.makedirs(os.path.dirname(QUOTE_COUNTER_FILE), exist_ok=True)
+        with open(QUOTE_COUNTER_FILE, "w") as f:
+            f.write(str(counter))
 
-    os.makedirs(os.path.dirname(QUOTE_COUNTER_FILE), exist_ok=True)
-    with open(QUOTE_COUNTER_FILE, "w") as f:
-        f.write(str(counter))
-
-    year = datetime.now().year
     return f"BGR-{year}-{counter:04d}"
 
 
@@ -37,13 +278,64 @@ class PDFGenerator:
     def __init__(self):
         self.output_dir = "generated_pdfs"
         self.ensure_output_dir()
+        # El logo se lee y decodifica una sola vez; cada PDF usa una copia del flowable
+        self._logo_image = self._load_logo()
+
+    def _load_logo(self) -> Image | None:
+        """
+        Flowable del logo corporativo ya decodificado (None si no existe o no se puede leer)
+        """
+        if not os.path.exists(LOGO_PATH):
+            return None
+        try:
+            # ReportLab incrusta todos los píxeles en cada PDF: se reduce una vez al
+            # tamaño final a LOGO_DPI (en memoria, el archivo original no se toca)
+            target = (round(LOGO_WIDTH / inch * LOGO_DPI), round(LOGO_HEIGHT / inch * LOGO_DPI))
+            with PILImage.open(LOGO_PATH) as source:
+                logo = source.resize(target, PILImage.LANCZOS) if source.width > target[0] else source.copy()
+            buffer = io.BytesIO()
+            logo.save(buffer, "PNG")
+            buffer.seek(0)
+            image = Image(buffer, width=LOGO_WIDTH, height=LOGO_HEIGHT, hAlign='CENTER')
+            # El ImageReader decodifica los píxeles en el primer uso y los guarda;
+            # se fuerza aquí para que los hilos que construyen PDFs solo lo lean
+            image._img.getRGBData()
+            return image
+        except Exception as e:
+            logger.warning(f"No se pudo cargar el logo: {e}")
+            return None
+
+    def _logo_flowable(self) -> Image | None:
+        """
+        Logo centrado para el encabezado (None si no hay logo)
+
+        Copia superficial: comparte el ImageReader ya decodificado, pero el estado
+        de layout (canvas, tamaño) es propio de cada documento.
+        """
+        if self._logo_image is None:
+            return None
+        return copy.copy(self._logo_image)
+
+    def _build_filepath(self, prefix: str, user_phone: str = None, now: datetime = None) -> str:
+        """
+        Ruta única del PDF: {prefix}_{timestamp}_{últimos 4 dígitos del teléfono}_{aleatorio}.pdf
+
+        El sufijo aleatorio evita que dos PDFs del mismo teléfono generados en el
+        mismo segundo se sobrescriban, y hace que la URL de descarga no sea adivinable.
+        """
+        timestamp = (now or datetime.now()).strftime("%Y%m%d_%H%M%S")
+        if user_phone:
+            cleaned_phone = user_phone.translate(_PHONE_STRIP)
+            phone_suffix = cleaned_phone[-4:] if len(cleaned_phone) >= 4 else cleaned_phone.zfill(4)
+        else:
+            phone_suffix = "0000"
+        return os.path.join(self.output_dir, f"{prefix}_{timestamp}_{phone_suffix}_{secrets.token_hex(3)}.pdf")
 
     def ensure_output_dir(self):
         """
         Asegura que el directorio de salida existe
         """
-        if not os.path.exists(self.output_dir):
-            os.makedirs(self.output_dir)
+        os.makedirs(self.output_dir, exist_ok=True)
 
     def generate_quote_pdf(self, price_info: dict, user_phone: str = None, language: str = "es") -> str:
         """
@@ -57,19 +349,16 @@ class PDFGenerator:
         try:
             logger.debug(f"🔍 Iniciando generación PDF con datos: {price_info}")
 
+            # Una sola marca de tiempo para nombre de archivo, número y fecha del PDF
+            now = datetime.now()
+
             # Generar nombre único para el archivo
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            if user_phone:
-                cleaned_phone = user_phone.replace("+", "").replace(":", "")
-                phone_suffix = cleaned_phone[-4:] if len(cleaned_phone) >= 4 else cleaned_phone.zfill(4)
-            else:
-                phone_suffix = "0000"
-            filename = f"cotizacion_BGR_{timestamp}_{phone_suffix}.pdf"
-            filepath = os.path.join(self.output_dir, filename)
+            filepath = self._build_filepath("cotizacion_BGR", user_phone, now)
 
-            # Crear documento PDF
+            # Crear documento PDF (se construye en memoria)
+            buffer = io.BytesIO()
             doc = SimpleDocTemplate(
-                filepath,
+                buffer,
                 pagesize=A4,
                 rightMargin=40,
                 leftMargin=40,
@@ -78,19 +367,25 @@ class PDFGenerator:
             )
 
             story = []
-            styles = getSampleStyleSheet()
 
             # Número de cotización
-            quote_number = _next_quote_number()
-
-            # Colores corporativos BGR Export
-            azul_marino = colors.HexColor('#1e3a8a')
-            naranja = colors.HexColor('#ea580c')
+            quote_number = _next_quote_number(now.year)
+
+            # === DATOS DE LA COTIZACIÓN (una sola lectura de price_info) ===
+            get = price_info.get
+            flete_incluido = get('incluye_flete', False)
+            destino_completo = get('destination', '')
+            producto = get('producto', 'N/A')
+            talla = get('talla', 'N/A')
+            cliente = get('cliente_nombre', '')
+            glaseo_factor = get('factor_glaseo')
+            if glaseo_factor is None:
+                glaseo_factor = get('glaseo_factor')
+            glaseo_percentage = get('glaseo_percentage')  # Porcentaje original
+            precio_final = get('precio_final_kg', 0)
 
             # === REGLAS DE NEGOCIO ===
             # Determinar si es FOB o CFR basado en si se solicitó flete
-            flete_incluido = price_info.get('incluye_flete', False)
-            destino_completo = price_info.get('destination', '')
 
             # Extraer solo el país del destino (antes de "Para")
             if destino_completo and " para " in destino_completo.lower():
@@ -109,82 +404,30 @@ class PDFGenerator:
                 tipo_cotizacion = "FOB"
 
             # === TRADUCCIONES ===
-            translations = {
-                "es": {
-                    "cotizacion": f"COTIZACIÓN {tipo_cotizacion}",
-                    "fecha_cotizacion": "Fecha de Cotización",
-                    "producto": "Producto",
-                    "talla": "Talla",
-                    "cliente": "Cliente",
-                    "destino": "Destino",
-                    "glaseo_solicitado": "Glaseo Solicitado",
-                    "precio_header": f"PRECIO {'CFR' if flete_incluido else 'FOB'} USD/KG",
-                    "concepto": "Concepto",
-                    "detalle": "Detalle",
-                    "glaseo_aplicado": "Glaseo Aplicado",
-                    "especificacion": "Especificación",
-                    "contacto": "Contacto: BGR Export | amerino@bgrexport.com | +593 98-805-7425",
-                    "notas": "NOTAS IMPORTANTES:",
-                    "nota1": "• Precios sujetos a disponibilidad y confirmación.",
-                    "nota2": "• Validez de la cotización: 7 días.",
-                    "nota3": "• Condiciones de pago: Según acuerdo comercial.",
-                    "ref": "Ref"
-                },
-                "en": {
-                    "cotizacion": f"{tipo_cotizacion} QUOTATION",
-                    "fecha_cotizacion": "Quotation Date",
-                    "producto": "Product",
-                    "talla": "Size",
-                    "cliente": "Client",
-                    "destino": "Destination",
-                    "glaseo_solicitado": "Requested Glazing",
-                    "precio_header": f"{'CFR' if flete_incluido else 'FOB'} PRICE USD/KG",
-                    "concepto": "Concept",
-                    "detalle": "Detail",
-                    "glaseo_aplicado": "Applied Glazing",
-                    "especificacion": "Specification",
-                    "contacto": "Contact: BGR Export | amerino@bgrexport.com | +593 98-805-7425",
-                    "notas": "IMPORTANT NOTES:",
-                    "nota1": "• Prices subject to availability and confirmation.",
-                    "nota2": "• Quote validity: 7 days.",
-                    "nota3": "• Payment terms: According to commercial agreement.",
-                    "ref": "Ref"
-                }
+            lang = language if language in _QUOTE_TRANSLATIONS else "es"
+            titulo_template, precio_template = _QUOTE_TITLE_TEMPLATES[lang]
+            t = {
+                **_QUOTE_TRANSLATIONS[lang],
+                "cotizacion": titulo_template.format(tipo_cotizacion),
+                "precio_header": precio_template.format('CFR' if flete_incluido else 'FOB'),
             }
 
-            # Seleccionar idioma
-            t = translations.get(language, translations["es"])
-
             # === LOGO Y ENCABEZADO ===
-            logo_path = os.path.join("data", "logoBGR.png")
-            if os.path.exists(logo_path):
-                try:
-                    # Dimensiones basadas en 714x146 pixels (proporción ~4.9:1)
-                    # Convertir a pulgadas manteniendo la proporción
-                    logo_width = 4.9*inch  # Más ancho
-                    logo_height = 1*inch   # Más bajo
-                    logo_img = Image(logo_path, width=logo_width, height=logo_height)
-                    story.append(logo_img)
-                except Exception as e:
-                    logger.warning(f"No se pudo cargar el logo: {e}")
+            logo = self._logo_flowable()
+            if logo:
+                story.append(logo)
 
             story.append(Spacer(1, 15))  # Reducir espacio después del logo
 
             # === SIN TÍTULO PRINCIPAL (eliminado según solicitud) ===
 
             # === INFORMACIÓN GENERAL ===
-            # Extraer datos del price_info
-            producto = price_info.get('producto', 'N/A')
-            talla = price_info.get('talla', 'N/A')
-            cliente = price_info.get('cliente_nombre', '')
             # Fallback: si no hay nombre, usar teléfono
             if not cliente and user_phone:
                 cliente = user_phone
             # Usar solo el país para el destino en el PDF (ya calculado arriba)
             destino = destino_pais if destino_pais else 'N/A'
-            glaseo_factor = price_info.get('factor_glaseo') if price_info.get('factor_glaseo') is not None else price_info.get('glaseo_factor')
-            glaseo_percentage = price_info.get('glaseo_percentage')  # Porcentaje original
-            fecha_actual = datetime.now().strftime("%d/%m/%Y %H:%M")
+            fecha_actual = now.strftime("%d/%m/%Y %H:%M")
 
             # Calcular porcentaje de glaseo para mostrar en el PDF
             # IMPORTANTE: glaseo_percentage puede ser 0 (sin glaseo) o None (no especificado)
@@ -192,7 +435,8 @@ class PDFGenerator:
                 glaseo_display = f"{glaseo_percentage}%"
             elif glaseo_factor is not None:
                 # Calcular porcentaje desde el factor: factor 0.80 = 20% glaseo
-                glaseo_percent_calc = int((1 - glaseo_factor) * 100)
+                # round y no int: (1 - 0.80) * 100 = 19.999... y se mostraría 19%
+                glaseo_percent_calc = round((1 - glaseo_factor) * 100)
                 glaseo_display = f"{glaseo_percent_calc}%"
             else:
                 glaseo_display = "N/A"
@@ -215,153 +459,81 @@ class PDFGenerator:
             # Nota: Información de flete eliminada por solicitud del usuario
 
             info_table = Table(info_data, colWidths=[2.5*inch, 3*inch])
-            info_table.setStyle(TableStyle([
-                # Encabezados con fondo azul marino
-                ('BACKGROUND', (0, 0), (0, -1), azul_marino),
-                ('TEXTCOLOR', (0, 0), (0, -1), colors.white),
-                ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
-                ('FONTSIZE', (0, 0), (-1, -1), 11),
-                ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-                ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-                ('GRID', (0, 0), (-1, -1), 1, colors.black),
-                ('ROWBACKGROUNDS', (1, 0), (1, -1), [colors.white]),
-                ('LEFTPADDING', (0, 0), (-1, -1), 12),
-                ('RIGHTPADDING', (0, 0), (-1, -1), 12),
-                ('TOPPADDING', (0, 0), (-1, -1), 8),
-                ('BOTTOMPADDING', (0, 0), (-1, -1), 8),
-            ]))
+            info_table.setStyle(_INFO_TABLE_STYLE)
 
             story.append(info_table)
             story.append(Spacer(1, 20))  # Reducir espacio antes del título FOB
 
             # === TÍTULO COTIZACIÓN (FOB/CFR dinámico) ===
-            cotizacion_title_style = ParagraphStyle(
-                'CotizacionTitle',
-                parent=styles['Heading2'],
-                fontSize=18,
-                spaceAfter=15,
-                alignment=TA_CENTER,
-                textColor=azul_marino,
-                fontName='Helvetica-Bold'
-            )
-            story.append(Paragraph(t["cotizacion"], cotizacion_title_style))
+            story.append(Paragraph(t["cotizacion"], _COTIZACION_TITLE_STYLE))
 
             # === PRECIO PRINCIPAL (FOB/CFR dinámico) ===
-            precio_final = price_info.get('precio_final_kg', 0)
-
-            # Debug: Verificar qué precio se está usando
-            logger.info(f"🔍 PDF Generator - Precio CFR: ${precio_final:.2f}")
-            logger.info(f"🔍 PDF Generator - price_info keys: {list(price_info.keys())}")
-            logger.info("🔍 PDF Generator - Todos los precios:")
-            logger.info(f"   - precio_kg: ${price_info.get('precio_kg', 0):.2f}")
-            logger.info(f"   - precio_fob_kg: ${price_info.get('precio_fob_kg', 0):.2f}")
-            
+            # Detalle de precios para depuración (formato diferido: solo se aplica con DEBUG)
+            logger.debug("🔍 PDF Generator - Precio CFR: $%.2f", precio_final)
+            logger.debug("🔍 PDF Generator - price_info keys: %s", list(price_info))
+            logger.debug("🔍 PDF Generator - Todos los precios:")
+            # Estos campos pueden venir en None: %s para que el log no falle
+            logger.debug("   - precio_kg: $%s", get('precio_kg', 0))
+            logger.debug("   - precio_fob_kg: $%s", get('precio_fob_kg', 0))
+
             # Manejar precio_glaseo_kg que puede ser None
-            precio_glaseo = price_info.get('precio_glaseo_kg')
+            precio_glaseo = get('precio_glaseo_kg')
             if precio_glaseo is not None:
-                logger.info(f"   - precio_glaseo_kg: ${precio_glaseo:.2f}")
+                logger.debug("   - precio_glaseo_kg: $%.2f", precio_glaseo)
             else:
-                logger.info(f"   - precio_glaseo_kg: N/A (sin glaseo)")
-            
+                logger.debug("   - precio_glaseo_kg: N/A (sin glaseo)")
+
             # Manejar precio_fob_con_glaseo_kg que puede ser None
-            precio_fob_glaseo = price_info.get('precio_fob_con_glaseo_kg')
+            precio_fob_glaseo = get('precio_fob_con_glaseo_kg')
             if precio_fob_glaseo is not None:
-                logger.info(f"   - precio_fob_con_glaseo_kg: ${precio_fob_glaseo:.2f}")
+                logger.debug("   - precio_fob_con_glaseo_kg: $%.2f", precio_fob_glaseo)
             else:
-                logger.info(f"   - precio_fob_con_glaseo_kg: N/A (sin glaseo)")
-            
-            logger.info(f"   - precio_final_kg: ${price_info.get('precio_final_kg', 0):.2f}")
-            logger.info(f"   - flete: ${price_info.get('flete', 0):.2f}")
-            logger.info(f"   - factor_glaseo: {price_info.get('factor_glaseo', 'N/A')}")
+                logger.debug("   - precio_fob_con_glaseo_kg: N/A (sin glaseo)")
+
+            logger.debug("   - precio_final_kg: $%.2f", precio_final)
+            logger.debug("   - flete: $%s", get('flete', 0))
+            logger.debug("   - factor_glaseo: %s", get('factor_glaseo', 'N/A'))
 
             # Tabla del precio con diseño destacado
             precio_data = [[t["precio_header"]], [f'${precio_final:.2f}']]
             precio_table = Table(precio_data, colWidths=[3*inch])
-            precio_table.setStyle(TableStyle([
-                # Encabezado
-                ('BACKGROUND', (0, 0), (0, 0), azul_marino),
-                ('TEXTCOLOR', (0, 0), (0, 0), colors.white),
-                ('FONTNAME', (0, 0), (0, 0), 'Helvetica-Bold'),
-                ('FONTSIZE', (0, 0), (0, 0), 14),
-                ('ALIGN', (0, 0), (0, 0), 'CENTER'),
-                ('VALIGN', (0, 0), (0, 0), 'MIDDLE'),
-                # Precio
-                ('BACKGROUND', (0, 1), (0, 1), colors.white),
-                ('TEXTCOLOR', (0, 1), (0, 1), azul_marino),
-                ('FONTNAME', (0, 1), (0, 1), 'Helvetica-Bold'),
-                ('FONTSIZE', (0, 1), (0, 1), 24),
-                ('ALIGN', (0, 1), (0, 1), 'CENTER'),
-                ('VALIGN', (0, 1), (0, 1), 'MIDDLE'),  # Centrado vertical
-                # Bordes y padding
-                ('GRID', (0, 0), (-1, -1), 2, colors.black),
-                ('TOPPADDING', (0, 0), (0, 0), 12),      # Encabezado
-                ('BOTTOMPADDING', (0, 0), (0, 0), 12),   # Encabezado
-                ('TOPPADDING', (0, 1), (0, 1), 15),      # Precio - más padding arriba
-                ('BOTTOMPADDING', (0, 1), (0, 1), 15),   # Precio - más padding abajo
-            ]))
+            precio_table.setStyle(_PRECIO_TABLE_STYLE)
 
             # Centrar la tabla del precio
             precio_centered = Table([[precio_table]], colWidths=[doc.width])
-            precio_centered.setStyle(TableStyle([
-                ('ALIGN', (0, 0), (0, 0), 'CENTER'),
-                ('VALIGN', (0, 0), (0, 0), 'MIDDLE'),
-            ]))
+            precio_centered.setStyle(_CENTERED_TABLE_STYLE)
 
             story.append(precio_centered)
             story.append(Spacer(1, 20))
 
             # === NÚMERO DE REFERENCIA / FOLIO ===
-            ref_style = ParagraphStyle(
-                'RefStyle',
-                parent=styles['Normal'],
-                fontSize=8,
-                textColor=colors.grey,
-                alignment=TA_CENTER
-            )
             story.append(Paragraph(
                 f"{t['ref']}: {quote_number}",
-                ref_style
+                _REF_STYLE
             ))
             story.append(Spacer(1, 15))
 
             # === NOTAS IMPORTANTES ===
-            notes_style = ParagraphStyle(
-                'Notes',
-                parent=styles['Normal'],
-                fontSize=9,
-                textColor=colors.black,
-                spaceAfter=5
-            )
             story.append(Paragraph(
-                f"<b>{t['notas']}</b>", notes_style
+                f"<b>{t['notas']}</b>", _NOTES_STYLE
             ))
-            story.append(Paragraph(t['nota1'], notes_style))
-            story.append(Paragraph(t['nota2'], notes_style))
-            story.append(Paragraph(t['nota3'], notes_style))
+            story.append(Paragraph(t['nota1'], _NOTES_STYLE))
+            story.append(Paragraph(t['nota2'], _NOTES_STYLE))
+            story.append(Paragraph(t['nota3'], _NOTES_STYLE))
             story.append(Spacer(1, 15))
 
             # === CONTACTO ===
-            contact_style = ParagraphStyle(
-                'Contact',
-                parent=styles['Normal'],
-                fontSize=8,
-                textColor=colors.grey,
-                alignment=TA_CENTER
-            )
-            story.append(Paragraph(t['contacto'], contact_style))
+            story.append(Paragraph(t['contacto'], _CONTACT_STYLE))
 
-            # Generar PDF
+            # Generar PDF y escribirlo a disco de una sola vez
             doc.build(story)
+            with open(filepath, "wb") as f:
+                file_size = f.write(buffer.getbuffer())
 
-            # Verificar que el archivo se creó correctamente
-            if os.path.exists(filepath):
-                file_size = os.path.getsize(filepath)
-                logger.debug(f"✅ PDF generado exitosamente: {filepath}")
-                logger.debug(f"📊 Tamaño del archivo: {file_size} bytes")
-                return filepath
-            else:
-                logger.error(f"❌ PDF no se creó en la ruta esperada: {filepath}")
-                return None
+            # Si build o write fallan se lanza excepción: aquí el archivo ya existe
+            logger.debug("✅ PDF generado exitosamente: %s", filepath)
+            logger.debug("📊 Tamaño del archivo: %s bytes", file_size)
+            return filepath
 
         except Exception as e:
             logger.error(f"❌ Error generando PDF: {str(e)}")
@@ -381,19 +553,16 @@ class PDFGenerator:
         try:
             logger.info(f"📄 Generando PDF consolidado con {len(products_info)} productos")
 
+            # Una sola marca de tiempo para nombre de archivo, número y fecha del PDF
+            now = datetime.now()
+
             # Generar nombre único para el archivo
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            if user_phone:
-                cleaned_phone = user_phone.replace("+", "").replace(":", "")
-                phone_suffix = cleaned_phone[-4:] if len(cleaned_phone) >= 4 else cleaned_phone.zfill(4)
-            else:
-                phone_suffix = "0000"
-            filename = f"cotizacion_BGR_consolidada_{timestamp}_{phone_suffix}.pdf"
-            filepath = os.path.join(self.output_dir, filename)
+            filepath = self._build_filepath("cotizacion_BGR_consolidada", user_phone, now)
 
-            # Crear documento PDF
+            # Crear documento PDF (se construye en memoria)
+            buffer = io.BytesIO()
             doc = SimpleDocTemplate(
-                filepath,
+                buffer,
                 pagesize=letter,
                 rightMargin=0.5*inch,
                 leftMargin=0.5*inch,
@@ -404,82 +573,24 @@ class PDFGenerator:
             # Contenedor para elementos del PDF
             story = []
 
-            # Colores corporativos
-            azul_marino = colors.HexColor('#1e3a8a')
-            naranja = colors.HexColor('#f97316')
-
             # Número de cotización
-            quote_number = _next_quote_number()
+            quote_number = _next_quote_number(now.year)
 
             # === LOGO ===
-            logo_path = os.path.join("data", "logoBGR.png")
-            if os.path.exists(logo_path):
-                logo = Image(
-                    logo_path,
-                    width=4.9*inch,
-                    height=1*inch
-                )
-                logo.hAlign = 'CENTER'
+            logo = self._logo_flowable()
+            if logo:
                 story.append(logo)
                 story.append(Spacer(1, 0.3*inch))
 
             # === INFORMACIÓN GENERAL ===
-            styles = getSampleStyleSheet()
-
-            # Traducciones
-            translations = {
-                "es": {
-                    "titulo": "COTIZACIÓN CONSOLIDADA",
-                    "fecha": "Fecha de Cotización",
-                    "destino": "Destino",
-                    "glaseo": "Glaseo Aplicado",
-                    "producto": "PRODUCTO",
-                    "talla": "TALLA",
-                    "precio_fob": "PRECIO FOB USD/KG",
-                    "precio_cfr": "PRECIO CFR USD/KG",
-                    "contacto": "Contacto: BGR Export | amerino@bgrexport.com | +593 98-805-7425",
-                    "notas": "NOTAS IMPORTANTES:",
-                    "nota1": "• Precios sujetos a disponibilidad y confirmación.",
-                    "nota2": "• Validez de la cotización: 7 días.",
-                    "nota3": "• Condiciones de pago: Según acuerdo comercial.",
-                    "cliente": "Cliente",
-                    "ref": "Ref"
-                },
-                "en": {
-                    "titulo": "CONSOLIDATED QUOTATION",
-                    "fecha": "Quotation Date",
-                    "destino": "Destination",
-                    "glaseo": "Glaze Applied",
-                    "producto": "PRODUCT",
-                    "talla": "SIZE",
-                    "precio_fob": "FOB PRICE USD/KG",
-                    "precio_cfr": "CFR PRICE USD/KG",
-                    "contacto": "Contact: BGR Export | amerino@bgrexport.com | +593 98-805-7425",
-                    "notas": "IMPORTANT NOTES:",
-                    "nota1": "• Prices subject to availability and confirmation.",
-                    "nota2": "• Quote validity: 7 days.",
-                    "nota3": "• Payment terms: According to commercial agreement.",
-                    "cliente": "Client",
-                    "ref": "Ref"
-                }
-            }
-
-            t = translations.get(language, translations["es"])
+            lang = language if language in _CONSOLIDATED_TRANSLATIONS else "es"
+            t = _CONSOLIDATED_TRANSLATIONS[lang]
 
             # Título
-            title_style = ParagraphStyle(
-                'CustomTitle',
-                parent=styles['Heading1'],
-                fontSize=18,
-                textColor=azul_marino,
-                spaceAfter=20,
-                alignment=TA_CENTER,
-                fontName='Helvetica-Bold'
-            )
-            story.append(Paragraph(t["titulo"], title_style))
+            story.append(Paragraph(t["titulo"], _CONSOLIDATED_TITLE_STYLE))
 
             # Información general
-            fecha_actual = datetime.now().strftime("%d/%m/%Y %H:%M")
+            fecha_actual = now.strftime("%d/%m/%Y %H:%M")
             nro_label = "N° Cotización" if language == "es" \
                 else "Quote #"
             info_data = [
@@ -500,29 +611,13 @@ class PDFGenerator:
             info_data.append([t["glaseo"], f"{glaseo_percentage}%"])
 
             info_table = Table(info_data, colWidths=[2.5*inch, 4*inch])
-            info_table.setStyle(TableStyle([
-                ('BACKGROUND', (0, 0), (0, -1), colors.HexColor('#e5e7eb')),
-                ('TEXTCOLOR', (0, 0), (-1, -1), colors.black),
-                ('ALIGN', (0, 0), (0, -1), 'RIGHT'),
-                ('ALIGN', (1, 0), (1, -1), 'LEFT'),
-                ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
-                ('FONTNAME', (1, 0), (1, -1), 'Helvetica'),
-                ('FONTSIZE', (0, 0), (-1, -1), 10),
-                ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
-                ('TOPPADDING', (0, 0), (-1, -1), 8),
-                ('BOTTOMPADDING', (0, 0), (-1, -1), 8),
-            ]))
+            info_table.setStyle(_CONSOLIDATED_INFO_TABLE_STYLE)
             story.append(info_table)
             story.append(Spacer(1, 0.3*inch))
 
             # === TABLA DE PRODUCTOS ===
-            # Encabezados
-            table_data = [[
-                t["producto"],
-                t["talla"],
-                t["precio_fob"],
-                t["precio_cfr"]
-            ]]
+            # Encabezados (copia: la tabla guarda referencia a sus filas)
+            table_data = [list(_PRODUCTS_TABLE_HEADERS[lang])]
 
             # Agregar cada producto (filtrar inválidos)
             for product_info in products_info:
@@ -546,83 +641,35 @@ class PDFGenerator:
 
             # Crear tabla
             products_table = Table(table_data, colWidths=[2*inch, 1.2*inch, 1.7*inch, 1.7*inch])
-            products_table.setStyle(TableStyle([
-                # Encabezado
-                ('BACKGROUND', (0, 0), (-1, 0), azul_marino),
-                ('TEXTCOLOR', (0, 0), (-1, 0), colors.white),
-                ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-                ('FONTSIZE', (0, 0), (-1, 0), 11),
-                ('ALIGN', (0, 0), (-1, 0), 'CENTER'),
-                # Datos
-                ('BACKGROUND', (0, 1), (-1, -1), colors.white),
-                ('TEXTCOLOR', (0, 1), (-1, -1), colors.black),
-                ('FONTNAME', (0, 1), (-1, -1), 'Helvetica'),
-                ('FONTSIZE', (0, 1), (-1, -1), 10),
-                ('ALIGN', (0, 1), (0, -1), 'LEFT'),  # Producto
-                ('ALIGN', (1, 1), (1, -1), 'CENTER'),  # Talla
-                ('ALIGN', (2, 1), (-1, -1), 'RIGHT'),  # Precios
-                # Bordes y padding
-                ('GRID', (0, 0), (-1, -1), 1, colors.grey),
-                ('TOPPADDING', (0, 0), (-1, -1), 10),
-                ('BOTTOMPADDING', (0, 0), (-1, -1), 10),
-                ('LEFTPADDING', (0, 0), (-1, -1), 8),
-                ('RIGHTPADDING', (0, 0), (-1, -1), 8),
-                # Alternar colores de filas
-                *[('BACKGROUND', (0, i), (-1, i), colors.HexColor('#f3f4f6'))
-                  for i in range(2, len(table_data), 2)]
-            ]))
+            products_table.setStyle(_PRODUCTS_TABLE_STYLE)
 
             story.append(products_table)
             story.append(Spacer(1, 0.3*inch))
 
             # === NOTAS ===
-            notes_style = ParagraphStyle(
-                'Notes',
-                parent=styles['Normal'],
-                fontSize=9,
-                textColor=colors.black,
-                spaceAfter=5
-            )
-
-            story.append(Paragraph(f"<b>{t['notas']}</b>", notes_style))
-            story.append(Paragraph(t['nota1'], notes_style))
-            story.append(Paragraph(t['nota2'], notes_style))
-            story.append(Paragraph(t['nota3'], notes_style))
+            story.append(Paragraph(f"<b>{t['notas']}</b>", _NOTES_STYLE))
+            story.append(Paragraph(t['nota1'], _NOTES_STYLE))
+            story.append(Paragraph(t['nota2'], _NOTES_STYLE))
+            story.append(Paragraph(t['nota3'], _NOTES_STYLE))
             story.append(Spacer(1, 0.15*inch))
 
             # === REFERENCIA / FOLIO ===
-            ref_style = ParagraphStyle(
-                'RefStyle',
-                parent=styles['Normal'],
-                fontSize=8,
-                textColor=colors.grey,
-                alignment=TA_CENTER
-            )
             story.append(Paragraph(
                 f"{t['ref']}: {quote_number}",
-                ref_style
+                _REF_STYLE
             ))
             story.append(Spacer(1, 0.1*inch))
 
             # === CONTACTO ===
-            contact_style = ParagraphStyle(
-                'Contact',
-                parent=styles['Normal'],
-                fontSize=8,
-                textColor=colors.grey,
-                alignment=TA_CENTER
-            )
-            story.append(Paragraph(t['contacto'], contact_style))
+            story.append(Paragraph(t['contacto'], _CONTACT_STYLE))
 
-            # Generar PDF
+            # Generar PDF y escribirlo a disco de una sola vez
             doc.build(story)
+            with open(filepath, "wb") as f:
+                f.write(buffer.getbuffer())
 
-            if os.path.exists(filepath):
-                logger.info(f"✅ PDF consolidado generado: {filepath}")
-                return filepath
-            else:
-                logger.error(f"❌ Error: PDF no se creó en {filepath}")
-                return None
+            logger.info(f"✅ PDF consolidado generado: {filepath}")
+            return filepath
 
         except Exception as e:
             logger.error(f"❌ Error generando PDF consolidado: {str(e)}")
@@ -630,6 +677,24 @@ class PDFGenerator:
             traceback.print_exc()
             return None
 
+    async def generate_quote_pdf_async(self, price_info: dict, user_phone: str = None, language: str = "es") -> str:
+        """
+        Versión asíncrona de generate_quote_pdf para el webhook.
+
+        ReportLab es CPU puro y síncrono: el PDF se construye en un hilo para
+        no bloquear el event loop mientras se atienden otros mensajes.
+        """
+        return await asyncio.to_thread(self.generate_quote_pdf, price_info, user_phone, language)
+
+    async def generate_consolidated_quote_pdf_async(self, products_info: list, user_phone: str = None, language: str = "es", glaseo_percentage: int = 20, destination: str = None, cliente_nombre: str = None) -> str:
+        """
+        Versión asíncrona de generate_consolidated_quote_pdf para el webhook.
+        """
+        return await asyncio.to_thread(
+            self.generate_consolidated_quote_pdf,
+            products_info, user_phone, language, glaseo_percentage, destination, cliente_nombre
+        )
+
     def get_language_options(self) -> str:
         """
         Retorna las opciones de idioma para el PDF
@@ -664,18 +729,14 @@ class PDFGenerator:
         Limpia PDFs antiguos para ahorrar espacio
         """
         try:
-            import time
-            current_time = time.time()
-            cutoff_time = current_time - (days_old * 24 * 60 * 60)
-
-            for filename in os.listdir(self.output_dir):
-                if filename.endswith('.pdf'):
-                    filepath = os.path.join(self.output_dir, filename)
-                    file_time = os.path.getmtime(filepath)
-
-                    if file_time < cutoff_time:
-                        os.remove(filepath)
-                        logger.info(f"🗑️ PDF antiguo eliminado: {filename}")
+            cutoff_time = time.time() - (days_old * 24 * 60 * 60)
+
+            # scandir entrega nombre y ruta en una sola pasada; solo se hace stat de los .pdf
+            with os.scandir(self.output_dir) as entries:
+                for entry in entries:
+                    if entry.name.endswith('.pdf') and entry.is_file() and entry.stat().st_mtime < cutoff_time:
+                        os.remove(entry.path)
+                        logger.info(f"🗑️ PDF antiguo eliminado: {entry.name}")
 
         except Exception as e:
             logger.error(f"❌ Error limpiando PDFs antiguos: {str(e)}")
@@ -25,6 +25,7 @@ from typing import Dict, List, Optional, Tuple, Any
 from dataclasses import dataclass, field
 from datetime import datetime
 
+import orjson
 import requests
 import numpy as np
 
@@ -155,12 +156,13 @@ class RAGService:
             response = requests.post(
                 f"{self.base_url}/embeddings",
                 headers=headers,
-                json=payload,
+                data=orjson.dumps(payload),
                 timeout=30
             )
 
             if response.status_code == 200:
-                data = response.json()
+                # orjson: las respuestas de embeddings son miles de floats
+                data = orjson.loads(response.content)
                 embedding = data['data'][0]['embedding']
 
                 # Guardar en caché
@@ -206,12 +208,12 @@ class RAGService:
             response = requests.post(
                 f"{self.base_url}/embeddings",
                 headers=headers,
-                json=payload,
+                data=orjson.dumps(payload),
                 timeout=60
             )
 
             if response.status_code == 200:
-                data = response.json()
+                data = orjson.loads(response.content)
                 embeddings = [item['embedding'] for item in data['data']]
                 self._stats['embeddings_generated'] += len(embeddings)
                 return embeddings
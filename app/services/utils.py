@@ -143,18 +143,24 @@ def parse_ai_analysis_to_query(ai_analysis: dict) -> dict | None:
     flete_value = None
     flete_solicitado = False
 
+    # Convertir el flete una sola vez; queda en None si no es numérico
+    flete_num = None
+    if flete_custom:
+        try:
+            flete_num = float(flete_custom)
+        except (ValueError, TypeError):
+            flete_num = None
+
     # Si es DDP, SIEMPRE necesitamos el flete para desglosar el precio
     if is_ddp:
         if flete_custom:
             # Usuario especificó el flete en el mensaje DDP
-            try:
-                flete_value = float(flete_custom)
-                flete_solicitado = True
-                logger.info(f"📦 Precio DDP con flete ${flete_value:.2f} especificado")
-            except:
+            flete_solicitado = True
+            flete_value = flete_num
+            if flete_num is not None:
+                logger.info("📦 Precio DDP con flete $%.2f especificado", flete_num)
+            else:
                 # Flete inválido, solicitar al usuario
-                flete_solicitado = True
-                flete_value = None
                 logger.info("📦 Precio DDP detectado - se solicitará valor de flete")
         else:
             # DDP sin flete especificado - DEBE pedirlo
@@ -165,11 +171,9 @@ def parse_ai_analysis_to_query(ai_analysis: dict) -> dict | None:
     # 1. Hay valor personalizado de flete, O
     # 2. Hay destino (porque el análisis básico solo detecta destino si menciona flete)
     elif flete_custom:
-        try:
-            flete_value = float(flete_custom)
+        if flete_num is not None:
+            flete_value = flete_num
             flete_solicitado = True
-        except:
-            pass
     elif destination:
         # Si hay destino, significa que el análisis básico detectó palabras de flete
         flete_solicitado = True
@@ -189,7 +193,7 @@ def parse_ai_analysis_to_query(ai_analysis: dict) -> dict | None:
                 glaseo_value = glaseo_num / 100  # 10 → 0.10
             else:
                 glaseo_value = glaseo_num  # 0.10 → 0.10
-        except:
+        except (ValueError, TypeError):
             glaseo_value = None  # NUNCA usar valor por defecto
     else:
         glaseo_value = None  # NUNCA usar valor por defecto - pedir al usuario
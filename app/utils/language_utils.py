@@ -2,6 +2,10 @@
 Utilidades para detección de idioma y conversión de glaseo.
 """
 
+# Palabras comunes para cada idioma (se cuentan todas sus apariciones)
+ENGLISH_WORDS = ('please', 'hello', 'hi', 'thanks', 'thank', 'price', 'quote', 'proforma', 'ddp', 'cif', 'fob')
+SPANISH_WORDS = ('por favor', 'hola', 'gracias', 'precio', 'precios', 'proforma', 'cotización', 'cotizacion', 'ddp', 'flete')
+
 
 def glaseo_percentage_to_factor(percentage: int) -> float:
     """
@@ -29,11 +33,7 @@ def detect_language(message: str, ai_analysis: dict = None) -> str:
             return lang
 
     text = (message or "").lower()
-    # Palabras comunes para cada idioma
-    english_words = ['please', 'hello', 'hi', 'thanks', 'thank', 'price', 'quote', 'proforma', 'ddp', 'cif', 'fob']
-    spanish_words = ['por favor', 'hola', 'gracias', 'precio', 'precios', 'proforma', 'cotización', 'cotizacion', 'ddp', 'flete']
-
-    en_score = sum(text.count(w) for w in english_words)
-    es_score = sum(text.count(w) for w in spanish_words)
+    en_score = sum(map(text.count, ENGLISH_WORDS))
+    es_score = sum(map(text.count, SPANISH_WORDS))
 
     return 'en' if en_score > es_score else 'es'
@@ -35,3 +35,17 @@ def get_services():
         logger.debug("✅ Servicios inicializados")
 
     return pricing_service, interactive_service, pdf_generator, whatsapp_sender, openai_service
+
+
+async def close_services():
+    """
+    Libera las conexiones persistentes de los servicios al apagar la aplicación
+    """
+    if openai_service is None:
+        return
+
+    try:
+        await openai_service.aclose()
+        logger.debug("✅ Conexiones de OpenAI cerradas")
+    except Exception as e:
+        logger.warning(f"⚠️ Error cerrando conexiones de OpenAI: {e}")
@@ -5,7 +5,7 @@ import os
 import sys
 from pathlib import Path
 from typing import Generator, Dict, Any
-from unittest.mock import MagicMock, Mock
+from unittest.mock import AsyncMock, MagicMock, Mock
 
 import pytest
 from fastapi.testclient import TestClient
@@ -103,6 +103,8 @@ def mock_pdf_generator():
     """Mock del generador de PDFs"""
     mock = MagicMock()
     mock.generate_quote_pdf.return_value = "/tmp/test_quote.pdf"
+    mock.generate_quote_pdf_async = AsyncMock(return_value="/tmp/test_quote.pdf")
+    mock.generate_consolidated_quote_pdf_async = AsyncMock(return_value="/tmp/test_quote.pdf")
     return mock
 
 
@@ -185,4 +187,5 @@ def mock_openai_service():
         'requires_flete': False
     }
     mock.transcribe_audio.return_value = "Precio HLSO 16/20"
+    mock.transcribe_audio_async = AsyncMock(return_value="Precio HLSO 16/20")
     return mock
@@ -49,6 +49,10 @@ class DummyPDF:
         return '/tmp/dummy_consolidado.pdf'
     def generate_quote_pdf(self, price_info, From, lang):
         return '/tmp/dummy_individual.pdf'
+    async def generate_consolidated_quote_pdf_async(self, *args, **kwargs):
+        return self.generate_consolidated_quote_pdf(*args, **kwargs)
+    async def generate_quote_pdf_async(self, price_info, From, lang):
+        return self.generate_quote_pdf(price_info, From, lang)
     def get_language_options(self):
         return '1️⃣ Español 🇪🇸\n2️⃣ English 🇺🇸'
     def parse_language_selection(self, text):
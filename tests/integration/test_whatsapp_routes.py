@@ -2,7 +2,7 @@
 Tests de integración para rutas de WhatsApp
 """
 import pytest
-from unittest.mock import patch, MagicMock
+from unittest.mock import patch, MagicMock, AsyncMock
 from fastapi.testclient import TestClient
 
 
@@ -120,7 +120,7 @@ class TestWhatsAppAudioMessages:
 
         # Mock de OpenAI service
         mock_openai = MagicMock()
-        mock_openai.transcribe_audio.return_value = "precio de camarón"
+        mock_openai.transcribe_audio_async = AsyncMock(return_value="precio de camarón")
 
         mock_get_services.return_value = (
             MagicMock(), MagicMock(), MagicMock(), MagicMock(), mock_openai
@@ -129,6 +129,9 @@ class TestWhatsAppAudioMessages:
         response = client.post("/webhook/whatsapp", data=audio_payload)
         assert response.status_code == 200
         assert "Audio recibido" in response.text or "application/xml" in response.headers["content-type"]
+        # El audio se descarga en el archivo temporal seguro y se transcribe desde ahí
+        mock_handler.download_audio_from_twilio.assert_called_once_with(audio_payload["MediaUrl0"], "/tmp/audio.ogg")
+        mock_openai.transcribe_audio_async.assert_awaited_once_with("/tmp/audio.ogg")
 
 
 class TestWhatsAppSessionStates:
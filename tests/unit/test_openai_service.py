@@ -0,0 +1,1337 @@
+"""
+Tests unitarios para app/services/openai_service.py
+
+Cubre:
+- Streaming de respuestas (SSE) en _make_request_stream, chat_stream y smart_response_stream
+- Recorte del historial de conversación (_trim_history)
+- analyze_user_intent: omisión de GPT en casos obvios, modo JSON y caché de respuestas
+- analyze_and_respond: intención y respuesta en una sola llamada
+- Caché semántica opcional de intenciones (_SemanticIntentCache)
+- chat_with_context y _parse_gpt_response con modo JSON
+- Sesión HTTP persistente con pool de conexiones
+- Transcripción de audio con subida multipart por bloques
+- Prompts del sistema compactos con catálogo compartido y prefijo estable
+- Búsqueda de palabras clave en una sola pasada (_scan_keywords, Aho-Corasick opcional)
+- Listas ordenadas de regex fusionadas en una alternancia (_OrderedPatterns)
+- Caché LRU de _basic_intent_analysis
+- Motor RE2 opcional para patrones con captura perezosa
+- detect_multiple_products sin distinguir mayúsculas
+- Single-flight de peticiones idénticas en curso
+- Variantes asíncronas sobre httpx.AsyncClient (_make_request_async, analyze_many)
+- Batch API para análisis de intención en segundo plano
+"""
+import asyncio
+import io
+import json
+import threading
+from contextlib import contextmanager
+from unittest.mock import MagicMock, patch
+
+import httpx
+import numpy as np
+import pytest
+import urllib3
+from urllib3.connectionpool import HTTPSConnectionPool
+
+from app.services.openai_service import (
+    OpenAIService, _MultipartFileStream, _OrderedPatterns, _SemanticIntentCache, _SYSTEM_PROMPT_ANALYZE_AND_RESPOND,
+    _compile_linear, _fold_text, _keyword_scanner, _to_re2_syntax
+)
+
+
+@pytest.fixture
+def service(monkeypatch):
+    """Servicio OpenAI con API key de prueba"""
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+    monkeypatch.delenv("OPENAI_FINETUNED_MODEL", raising=False)
+    return OpenAIService()
+
+
+def _sse_lines(*deltas):
+    """Genera líneas SSE como las envía la API de OpenAI"""
+    lines = []
+    for delta in deltas:
+        event = {"choices": [{"delta": {"content": delta}}]}
+        lines.append(f"data: {json.dumps(event)}")
+        lines.append("")
+    lines.append("data: [DONE]")
+    return lines
+
+
+def _mock_async_client(service, lines, status_code=200):
+    """Sustituye el cliente httpx del servicio por uno con transporte simulado"""
+    requests_seen = []
+
+    def handler(request):
+        requests_seen.append(request)
+        return httpx.Response(status_code, text="\n".join(lines) if status_code == 200 else "error")
+
+    service._async_client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    return requests_seen
+
+
+def _streaming_response(lines, status_code=200):
+    response = MagicMock()
+    response.status_code = status_code
+    response.text = "error"
+    response.iter_lines.return_value = iter(lines)
+    response.__enter__.return_value = response
+    response.__exit__.return_value = False
+    return response
+
+
+@contextmanager
+def _urllib3_responses(responder):
+    """
+    Simula las respuestas por debajo de los adaptadores de la sesión: los
+    reintentos de urllib3 se ejecutan de verdad (sin esperas)
+    """
+    calls = []
+
+    def make_request(pool, conn, method, url, **kwargs):
+        calls.append((method, url))
+        status_code, payload = responder(method, url)
+        return urllib3.HTTPResponse(
+            body=io.BytesIO(json.dumps(payload).encode()), status=status_code,
+            preload_content=False, request_method=method
+        )
+
+    with patch.object(HTTPSConnectionPool, "_make_request", make_request), \
+            patch("urllib3.util.retry.time.sleep"):
+        yield calls
+
+
+class TestStreaming:
+    """Tests para las respuestas en streaming"""
+
+    def test_make_request_stream_yields_deltas(self, service):
+        """Test que parsea los eventos SSE y emite cada delta"""
+        response = _streaming_response(_sse_lines("Hola", ", ", "¿qué talla?"))
+
+        with patch.object(service._session, "post", return_value=response) as mock_post:
+            chunks = list(service._make_request_stream([{"role": "user", "content": "hola"}]))
+
+        assert chunks == ["Hola", ", ", "¿qué talla?"]
+        assert mock_post.call_args.kwargs["stream"] is True
+        assert json.loads(mock_post.call_args.kwargs["data"])["stream"] is True
+
+    def test_make_request_stream_stops_on_error_status(self, service):
+        """Test que no emite nada si la API responde con error"""
+        response = _streaming_response([], status_code=500)
+
+        with patch.object(service._session, "post", return_value=response):
+            chunks = list(service._make_request_stream([{"role": "user", "content": "hola"}]))
+
+        assert chunks == []
+
+    def test_make_request_stream_skips_malformed_events(self, service):
+        """Test que ignora eventos que no son JSON válido"""
+        lines = ["data: {no-json", ": keep-alive"] + _sse_lines("ok")
+        response = _streaming_response(lines)
+
+        with patch.object(service._session, "post", return_value=response):
+            chunks = list(service._make_request_stream([{"role": "user", "content": "hola"}]))
+
+        assert chunks == ["ok"]
+
+    def test_chat_stream_yields_chunks(self, service):
+        """Test que chat_stream emite los fragmentos de forma asíncrona"""
+        requests_seen = _mock_async_client(service, _sse_lines("{\"response\":", " \"Hola\"}"))
+
+        async def collect():
+            return [chunk async for chunk in service.chat_stream("Hola", use_rag=False)]
+
+        chunks = asyncio.run(collect())
+
+        assert "".join(chunks) == "{\"response\": \"Hola\"}"
+        body = json.loads(requests_seen[0].content)
+        assert body["stream"] is True
+        assert body["response_format"] == {"type": "json_object"}
+
+    def test_smart_response_stream_cleans_emojis(self, service):
+        """Test que smart_response_stream limpia emojis problemáticos"""
+        _mock_async_client(service, _sse_lines("🤖 Hola"))
+
+        async def collect():
+            return [chunk async for chunk in service.smart_response_stream("hola", {"state": "idle"})]
+
+        chunks = asyncio.run(collect())
+
+        assert chunks == ["🦐 Hola"]
+
+    def test_astream_stops_on_error_status(self, service):
+        """Test que el stream asíncrono no emite nada si la API responde con error"""
+        _mock_async_client(service, [], status_code=429)
+
+        async def collect():
+            return [chunk async for chunk in service._astream([{"role": "user", "content": "hola"}])]
+
+        assert asyncio.run(collect()) == []
+
+    def test_async_client_is_shared(self, service):
+        """Test que el cliente asíncrono se reutiliza entre llamadas"""
+        async def get_clients():
+            first = service._get_async_client()
+            second = service._get_async_client()
+            await service.aclose()
+            return first, second
+
+        first, second = asyncio.run(get_clients())
+
+        assert first is second
+        assert service._async_client is None
+
+    def test_async_client_pool_configured_on_transport(self, service):
+        """Test que HTTP/2 y los límites del pool llegan al transporte"""
+        async def get_pool():
+            pool = service._get_async_client()._transport._pool
+            await service.aclose()
+            return pool
+
+        pool = asyncio.run(get_pool())
+
+        assert pool._max_connections == service.HTTP_ASYNC_MAX_CONNECTIONS
+        assert pool._max_keepalive_connections == service.HTTP_ASYNC_MAX_KEEPALIVE
+        assert pool._keepalive_expiry == service.HTTP_ASYNC_KEEPALIVE_EXPIRY
+
+    def test_chat_stream_without_api_key(self, monkeypatch):
+        """Test que chat_stream no emite nada sin API key"""
+        monkeypatch.delenv("OPENAI_API_KEY", raising=False)
+        service = OpenAIService()
+
+        async def collect():
+            return [chunk async for chunk in service.chat_stream("Hola")]
+
+        assert asyncio.run(collect()) == []
+
+
+class TestTrimHistory:
+    """Tests para _trim_history()"""
+
+    def test_keeps_only_last_messages(self, service):
+        """Test que conserva solo los últimos HISTORY_MAX_MESSAGES mensajes"""
+        history = [{"role": "user", "content": f"msg {i}"} for i in range(15)]
+
+        trimmed = service._trim_history(history)
+
+        assert len(trimmed) == service.HISTORY_MAX_MESSAGES
+        assert trimmed[0]["content"] == "msg 5"
+        assert trimmed[-1]["content"] == "msg 14"
+
+    def test_truncates_long_messages(self, service):
+        """Test que trunca mensajes largos"""
+        history = [{"role": "user", "content": "x" * 500}]
+
+        trimmed = service._trim_history(history)
+
+        assert len(trimmed[0]["content"]) == service.HISTORY_MAX_CHARS
+
+    def test_drops_data_from_assistant_json(self, service):
+        """Test que de respuestas JSON del asistente conserva solo 'response'"""
+        reply = json.dumps({
+            "response": "HLSO 16/20. ¿Qué glaseo necesitas?",
+            "action": "ask_glaseo",
+            "data": {"products": [{"product": "HLSO", "size": "16/20"}]}
+        })
+        history = [
+            {"role": "user", "content": "HLSO 16/20"},
+            {"role": "assistant", "content": reply},
+        ]
+
+        trimmed = service._trim_history(history)
+
+        assert trimmed[1] == {"role": "assistant", "content": "HLSO 16/20. ¿Qué glaseo necesitas?"}
+
+    def test_keeps_plain_assistant_text(self, service):
+        """Test que deja intacto el texto plano del asistente"""
+        history = [{"role": "assistant", "content": "{no es json"}]
+
+        trimmed = service._trim_history(history)
+
+        assert trimmed[0]["content"] == "{no es json"
+
+
+class TestAnalyzeUserIntent:
+    """Tests para analyze_user_intent()"""
+
+    def test_greeting_skips_openai(self, service):
+        """Test que un saludo simple no llama a GPT"""
+        with patch.object(service, "_make_request") as mock_request:
+            result = service.analyze_user_intent("Hola")
+
+        assert result["intent"] == "greeting"
+        mock_request.assert_not_called()
+
+    def test_single_product_size_skips_openai(self, service):
+        """Test que una proforma simple con confianza alta no llama a GPT"""
+        with patch.object(service, "_make_request") as mock_request:
+            result = service.analyze_user_intent("proforma HLSO 16/20 glaseo 20%")
+
+        assert result["intent"] == "proforma"
+        assert result["product"] == "HLSO"
+        assert result["size"] == "16/20"
+        mock_request.assert_not_called()
+
+    def test_llm_skip_rate_in_stats(self, service):
+        """Test que las estadísticas reportan cuántos análisis omitieron GPT"""
+        with patch.object(service, "_make_request", return_value='{"intent": "proforma"}'):
+            service.analyze_user_intent("proforma HLSO 16/20 glaseo 20%")
+            service.analyze_user_intent("Cocedero CFR Lisboa: Inteiro 20/30, 30/40")
+
+        stats = service.get_cache_stats()
+        assert stats["intent_llm_skips"] == 1
+        assert stats["intent_llm_skip_rate"] == "50.0%"
+
+    def test_multiple_sizes_use_openai_json_mode(self, service):
+        """Test que mensajes con varias tallas usan GPT con modo JSON"""
+        llm_result = {"intent": "proforma", "sizes": ["20/30", "30/40"], "confidence": 0.95}
+
+        with patch.object(service, "_make_request", return_value=json.dumps(llm_result)) as mock_request:
+            result = service.analyze_user_intent("Cocedero CFR Lisboa: Inteiro 20/30, 30/40")
+
+        assert result == llm_result
+        kwargs = mock_request.call_args.kwargs
+        assert kwargs["model"] == service.intent_model
+        assert kwargs["response_format"] == {"type": "json_object"}
+
+    def test_non_object_json_falls_back_to_basic_analysis(self, service):
+        """Test que un JSON que no es objeto usa el análisis básico y no se cachea"""
+        message = "Cocedero CFR Lisboa: Inteiro 20/30, 30/40"
+
+        for raw in ("null", '"proforma"', "[1, 2]"):
+            with patch.object(service, "_make_request", return_value=raw):
+                result = service.analyze_user_intent(message)
+
+            assert result == service._basic_intent_analysis(message)
+        assert service.get_cache_stats()["intent_response_size"] == 0
+
+    def test_cache_key_is_stable_and_parameter_sensitive(self, service, monkeypatch):
+        """Test que la clave de caché es determinista y distingue parámetros, con y sin xxhash"""
+        for backend in (pytest.importorskip("xxhash"), None):
+            monkeypatch.setattr("app.services.openai_service._xxhash", backend)
+            key = service._generate_cache_key("prompt", {"temperature": 0, "max_tokens": 400})
+
+            assert key == service._generate_cache_key("prompt", {"max_tokens": 400, "temperature": 0})
+            assert key != service._generate_cache_key("prompt", {"temperature": 0.5, "max_tokens": 400})
+
+    def test_repeated_message_served_from_intent_cache(self, service):
+        """Test que un mensaje repetido no vuelve a llamar a GPT y devuelve una copia"""
+        llm_result = {"intent": "proforma", "sizes": ["20/30", "30/40"], "confidence": 0.95}
+        message = "Cocedero CFR Lisboa: Inteiro 20/30, 30/40"
+
+        with patch.object(service, "_make_request", return_value=json.dumps(llm_result)) as mock_request:
+            first = service.analyze_user_intent(message)
+            first["sizes"].append("40/50")
+            second = service.analyze_user_intent(message)
+
+        assert second == llm_result
+        assert mock_request.call_count == 1
+        assert mock_request.call_args.kwargs["temperature"] == 0
+        assert service.get_cache_stats()["intent_response_hits"] == 1
+
+    def test_intent_cache_skips_invalid_json_and_evicts_oldest(self, service):
+        """Test que solo se cachean respuestas JSON válidas y el LRU está acotado"""
+        service.INTENT_RESPONSE_CACHE_SIZE = 2
+        with patch.object(service, "_make_request", return_value="no es json"):
+            service.analyze_user_intent("necesito precios de camaron")
+        assert service.get_cache_stats()["intent_response_size"] == 0
+
+        for key in ("a", "b", "c"):
+            service._save_intent_response(key, "{}")
+        assert list(service._intent_responses) == ["b", "c"]
+
+    def test_invalid_json_falls_back_to_basic_analysis(self, service):
+        """Test que una respuesta no JSON usa el análisis básico"""
+        with patch.object(service, "_make_request", return_value="no es json"):
+            result = service.analyze_user_intent("necesito precios de camaron")
+
+        assert result["intent"] == "proforma"
+
+    @pytest.mark.parametrize("method", ["analyze_user_intent", "analyze_and_respond"])
+    def test_pattern_analysis_error_returns_unknown(self, service, method):
+        """Test que un error del análisis por patrones no llega al llamador"""
+        with patch.object(service, "_basic_intent_analysis", side_effect=ValueError("boom")):
+            result = getattr(service, method)("HLSO 16/20")
+
+        intent = result if method == "analyze_user_intent" else result["intent"]
+        assert intent == {"intent": "unknown", "confidence": 0}
+
+    @pytest.mark.parametrize("method", ["analyze_user_intent_async", "analyze_and_respond_async"])
+    def test_async_pattern_analysis_error_returns_unknown(self, service, method):
+        """Test que las versiones async también devuelven 'unknown' si falla el análisis por patrones"""
+        with patch.object(service, "_basic_intent_analysis", side_effect=ValueError("boom")):
+            result = asyncio.run(getattr(service, method)("HLSO 16/20"))
+
+        intent = result if method == "analyze_user_intent_async" else result["intent"]
+        assert intent == {"intent": "unknown", "confidence": 0}
+
+
+
+class TestSemanticIntentCache:
+    """Tests para la caché semántica opcional de analyze_user_intent"""
+
+    @pytest.fixture
+    def semantic_service(self, monkeypatch):
+        monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+        monkeypatch.setenv("OPENAI_SEMANTIC_CACHE", "true")
+        service = OpenAIService()
+        # Embedding falso: todos los mensajes de cotización son "parecidos"
+        vector = np.ones(8, dtype=np.float32) / np.sqrt(8)
+        monkeypatch.setattr(service, "_intent_embedding", lambda message: vector)
+        return service
+
+    def test_paraphrase_reuses_gpt_response(self, semantic_service):
+        """Test que una paráfrasis con la misma firma no vuelve a llamar a GPT"""
+        llm_result = {"intent": "proforma", "sizes": ["20/30", "30/40"]}
+
+        with patch.object(semantic_service, "_make_request", return_value=json.dumps(llm_result)) as mock_request:
+            first = semantic_service.analyze_user_intent("cotiza HLSO 20/30 y 30/40 Houston")
+            second = semantic_service.analyze_user_intent("proforma HLSO 20/30 y 30/40 Houston")
+
+        assert first == second == llm_result
+        assert mock_request.call_count == 1
+        assert semantic_service.get_cache_stats()["semantic_hits"] == 1
+
+    def test_analyze_and_respond_uses_semantic_cache(self, semantic_service):
+        """Test que analyze_and_respond guarda y reutiliza intenciones parafraseadas"""
+        llm_result = {"intent": {"intent": "proforma", "sizes": ["20/30", "30/40"]}, "reply": "Generando proforma..."}
+
+        with patch.object(semantic_service, "_make_request", return_value=json.dumps(llm_result)) as mock_request:
+            semantic_service.analyze_and_respond("cotiza HLSO 20/30 y 30/40 Houston")
+            second = semantic_service.analyze_and_respond("proforma HLSO 20/30 y 30/40 Houston")
+
+        assert second == {"intent": llm_result["intent"], "reply": None}
+        assert mock_request.call_count == 1
+        assert semantic_service.get_cache_stats()["semantic_hits"] == 1
+
+    def test_different_sizes_are_not_reused(self, semantic_service):
+        """Test que mensajes similares con otras tallas sí llaman a GPT"""
+        with patch.object(semantic_service, "_make_request", return_value='{"intent": "proforma"}') as mock_request:
+            semantic_service.analyze_user_intent("cotiza HLSO 20/30 y 30/40 Houston")
+            semantic_service.analyze_user_intent("cotiza HLSO 21/25 y 30/40 Houston")
+
+        assert mock_request.call_count == 2
+
+    def test_disabled_by_default(self, service):
+        """Test que sin OPENAI_SEMANTIC_CACHE no se generan embeddings"""
+        with patch.object(service, "_intent_embedding") as mock_embedding:
+            assert service._semantic_intent_lookup("cotiza HLSO 20/30", {}) == (None, None)
+
+        mock_embedding.assert_not_called()
+
+    def test_ring_buffer_overwrites_oldest(self):
+        """Test que el buffer circular reemplaza la entrada más antigua"""
+        cache = _SemanticIntentCache(size=2, threshold=0.9)
+        vectors = np.eye(3, dtype=np.float32)
+        for index in range(3):
+            cache.add(vectors[index], ("firma",), f"respuesta {index}")
+
+        assert len(cache) == 2
+        assert cache.lookup(vectors[0], ("firma",)) is None
+        assert cache.lookup(vectors[2], ("firma",)) == "respuesta 2"
+        assert cache.lookup(vectors[2], ("otra",)) is None
+
+
+
+class TestSmartFallbackResponse:
+    """Tests para get_smart_fallback_response()"""
+
+    def test_response_by_intent(self, service):
+        """Test que cada intención conocida tiene su respuesta y el resto usa la genérica"""
+        assert service.get_smart_fallback_response("hola", {"intent": "greeting"}).startswith("¡Hola! 🦐")
+        assert "HLSO, P&D IQF" in service.get_smart_fallback_response("x", {"intent": "product_info"})
+        assert service.get_smart_fallback_response("x", {}) == service.DEFAULT_FALLBACK_RESPONSE
+
+
+class TestJsonMode:
+    """Tests para el modo JSON en la conversación"""
+
+    def test_chat_with_context_requests_json_mode(self, service):
+        """Test que chat_with_context pide response_format json_object"""
+        reply = json.dumps({"response": "Hola", "action": "greeting", "data": {}})
+
+        with patch.object(service, "_make_request", return_value=reply) as mock_request:
+            result = service.chat_with_context("Hola", use_rag=False)
+
+        assert result == {"response": "Hola", "action": "greeting", "data": {}}
+        assert mock_request.call_args.kwargs["response_format"] == {"type": "json_object"}
+
+    def test_parse_gpt_response_invalid_action(self, service):
+        """Test que una action desconocida se reemplaza por 'none'"""
+        result = service._parse_gpt_response(json.dumps({"response": "ok", "action": "fly", "data": {}}))
+
+        assert result["action"] == "none"
+
+    def test_parse_gpt_response_missing_fields(self, service):
+        """Test que completa campos faltantes con valores por defecto"""
+        result = service._parse_gpt_response(json.dumps({"response": "ok"}))
+
+        assert result == {"response": "ok", "action": "none", "data": {}}
+
+    def test_parse_gpt_response_plain_text(self, service):
+        """Test que texto plano se devuelve como respuesta"""
+        result = service._parse_gpt_response("Hola, ¿qué producto necesitas?")
+
+        assert result == {"response": "Hola, ¿qué producto necesitas?", "action": "none", "data": {}}
+
+    def test_parse_gpt_response_non_object_json(self, service):
+        """Test que JSON que no es objeto se devuelve como texto"""
+        result = service._parse_gpt_response("[1, 2]")
+
+        assert result["response"] == "[1, 2]"
+        assert result["action"] == "none"
+
+
+class TestHttpSession:
+    """Tests para la sesión HTTP persistente"""
+
+    def test_session_is_reused(self, service):
+        """Test que las peticiones usan la misma sesión con pool"""
+        adapter = service._session.get_adapter("https://api.openai.com/v1/chat/completions")
+
+        assert adapter._pool_connections == service.HTTP_POOL_CONNECTIONS
+        assert adapter._pool_maxsize == service.HTTP_POOL_MAXSIZE
+
+    def test_session_retries_post_with_backoff(self, service):
+        """Test que la sesión reintenta POST con backoff y respeta Retry-After"""
+        adapter = service._session.get_adapter("https://api.openai.com/v1/chat/completions")
+        retry = adapter.max_retries
+
+        assert retry.total == service.HTTP_RETRY_TOTAL
+        assert "POST" in retry.allowed_methods
+        assert retry.respect_retry_after_header is True
+        assert 429 in retry.status_forcelist
+        assert retry.backoff_jitter > 0
+        assert retry.is_retry("POST", 503)
+
+    def test_status_retries_only_for_idempotent_posts(self, service):
+        """Test que solo chat y transcripción reenvían POST tras un error de estado"""
+        def retry_for(path):
+            return service._session.get_adapter(f"https://api.openai.com/v1{path}").max_retries
+
+        assert retry_for("/chat/completions").is_retry("POST", 502)
+        assert retry_for("/audio/transcriptions").is_retry("POST", 502)
+        assert not retry_for("/files").is_retry("POST", 502)
+        assert not retry_for("/batches").is_retry("POST", 504)
+        assert retry_for("/batches/batch-1").is_retry("GET", 503)
+
+    def test_retry_after_is_capped(self, service):
+        """Test que la espera de Retry-After tiene el mismo tope que la versión async"""
+        retry = service._session.get_adapter("https://api.openai.com/v1/chat/completions").max_retries
+        response = MagicMock()
+        response.headers = {"Retry-After": "3600"}
+
+        assert retry.get_retry_after(response) == service.RATE_LIMIT_DELAY
+        assert retry.new().get_retry_after(response) == service.RATE_LIMIT_DELAY
+        assert service._retry_delay(0, "3600") == service.RATE_LIMIT_DELAY
+
+    def test_default_models_use_base_model(self, service, monkeypatch):
+        """Test que sin variables de entorno se usa el modelo base para chat e intención"""
+        monkeypatch.delenv("OPENAI_INTENT_MODEL", raising=False)
+        fresh = OpenAIService()
+
+        assert fresh.model == fresh.intent_model == OpenAIService.BASE_MODEL
+        assert fresh._resolve_model(force_base_model=True) == OpenAIService.BASE_MODEL
+
+    def test_chat_payload_reuses_precomputed_headers(self, service):
+        """Test que las cabeceras JSON se calculan una vez y se comparten entre peticiones"""
+        headers_a, _ = service._build_chat_payload([], "m", 10, 0)
+        headers_b, _ = service._build_chat_payload([], "m", 10, 0)
+
+        assert headers_a is headers_b is service._json_headers
+        assert headers_a["Authorization"] == f"Bearer {service.api_key}"
+        assert service._chat_url == "https://api.openai.com/v1/chat/completions"
+
+    def test_session_does_not_retry_client_errors(self, service):
+        """Test que los 4xx definitivos no se reintentan"""
+        retry = service._session.get_adapter("https://api.openai.com/v1/chat/completions").max_retries
+
+        assert not retry.is_retry("POST", 400)
+        assert not retry.is_retry("POST", 401)
+
+    def test_chat_client_error_is_not_retried(self, service):
+        """Test que un 4xx definitivo hace una sola petición y pasa al fallback sin esperas"""
+        with _urllib3_responses(lambda method, url: (401, {"error": {"message": "bad key"}})) as calls, \
+                patch("time.sleep") as mock_sleep:
+            result = service.chat_with_context("Hola", use_rag=False)
+
+        assert calls == [("POST", "/v1/chat/completions")]
+        mock_sleep.assert_not_called()
+        assert result == service._intelligent_fallback("Hola")
+
+    def test_transient_errors_retried_in_one_layer(self, service):
+        """Test que los 5xx se reintentan solo en la sesión HTTP (sin bucle externo)"""
+        with _urllib3_responses(lambda method, url: (503, {})) as calls:
+            result = service.chat_with_context("Hola", use_rag=False)
+
+        # Una petición más HTTP_RETRY_TOTAL reintentos, no multiplicados por otro bucle
+        assert len(calls) == service.HTTP_RETRY_TOTAL + 1
+        assert result == service._intelligent_fallback("Hola")
+
+    def test_transient_error_then_success(self, service):
+        """Test que tras un 502 el reintento de la sesión devuelve la respuesta"""
+        reply = json.dumps({"response": "Hola", "action": "greeting", "data": {}})
+        responses = iter([(502, {}), (200, {"choices": [{"message": {"content": reply}}]})])
+
+        with _urllib3_responses(lambda method, url: next(responses)) as calls:
+            result = service.chat_with_context("Hola", use_rag=False)
+
+        assert len(calls) == 2
+        assert result == {"response": "Hola", "action": "greeting", "data": {}}
+
+    def test_make_request_uses_session(self, service):
+        """Test que _make_request envía la petición a través de la sesión"""
+        response = MagicMock()
+        response.status_code = 200
+        response.content = json.dumps({"choices": [{"message": {"content": " hola "}}]}).encode()
+
+        with patch.object(service._session, "post", return_value=response) as mock_post:
+            result = service._make_request([{"role": "user", "content": "hola"}], use_cache=False)
+
+        assert result == "hola"
+        mock_post.assert_called_once()
+
+    def _truncated_response(self):
+        response = MagicMock()
+        response.status_code = 200
+        response.content = json.dumps(
+            {"choices": [{"message": {"content": '{"response": "HLSO 16/20, 21/'}, "finish_reason": "length"}]}
+        ).encode()
+        return response
+
+    def test_truncated_response_is_discarded(self, service):
+        """Test que una respuesta cortada por max_tokens no se devuelve ni se cachea"""
+        with patch.object(service._session, "post", return_value=self._truncated_response()):
+            result = service._make_request([{"role": "user", "content": "hola"}])
+
+        assert result is None
+        assert service._cache == {}
+
+    def test_chat_with_context_truncated_uses_fallback(self, service):
+        """Test que un JSON truncado en la conversación pasa al fallback y no llega al cliente"""
+        with patch.object(service._session, "post", return_value=self._truncated_response()):
+            result = service.chat_with_context("Hola", use_rag=False)
+
+        assert result == service._intelligent_fallback("Hola")
+        assert "21/" not in result["response"]
+
+
+class TestTranscribeAudio:
+    """Tests para transcribe_audio() y _MultipartFileStream"""
+
+    def test_multipart_stream_body(self, tmp_path):
+        """Test que el cuerpo multipart contiene campos y archivo"""
+        audio = tmp_path / "nota.ogg"
+        audio.write_bytes(b"OggS" + b"\x00" * 100)
+
+        with _MultipartFileStream({"model": "whisper-1"}, "file", str(audio)) as body:
+            data = body.read()
+            assert len(data) == len(body)
+
+        assert b'name="model"\r\n\r\nwhisper-1\r\n' in data
+        assert b'filename="nota.ogg"' in data
+        assert b"OggS" + b"\x00" * 100 in data
+        assert data.endswith(f"--{body.boundary}--\r\n".encode())
+
+    def test_multipart_stream_reads_in_chunks_and_rewinds(self, tmp_path):
+        """Test que se puede leer por bloques y rebobinar"""
+        audio = tmp_path / "nota.ogg"
+        audio.write_bytes(bytes(range(256)) * 10)
+
+        with _MultipartFileStream({"model": "whisper-1"}, "file", str(audio)) as body:
+            full = body.read()
+            body.seek(0)
+            chunks = []
+            while True:
+                chunk = body.read(100)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+            body.seek(150)
+            partial = body.read()
+
+        assert b"".join(chunks) == full
+        assert partial == full[150:]
+
+    def test_transcribe_audio_plain_text(self, service, tmp_path):
+        """Test que la transcripción pide texto plano y temperatura 0"""
+        audio = tmp_path / "nota.ogg"
+        audio.write_bytes(b"audio")
+        response = MagicMock()
+        response.status_code = 200
+        response.text = " HLSO 16/20 con glaseo 20 \n"
+
+        sent = {}
+
+        def fake_post(url, headers, data, timeout):
+            sent["body"] = data.read()
+            sent["content_type"] = headers["Content-Type"]
+            return response
+
+        with patch.object(service._session, "post", side_effect=fake_post):
+            result = service.transcribe_audio(str(audio))
+
+        assert result == "HLSO 16/20 con glaseo 20"
+        assert sent["content_type"].startswith("multipart/form-data; boundary=")
+        assert b'name="response_format"\r\n\r\ntext' in sent["body"]
+        assert b'name="temperature"\r\n\r\n0' in sent["body"]
+        assert b'name="language"\r\n\r\nes' in sent["body"]
+
+    def test_transcribe_audio_missing_file(self, service):
+        """Test que retorna None si el archivo no existe"""
+        assert service.transcribe_audio("/no/existe.ogg") is None
+
+
+class TestSystemPrompts:
+    """Tests para los prompts del sistema"""
+
+    def test_catalog_included_once(self, service):
+        """Test que cada prompt incluye el catálogo una sola vez"""
+        prompts = [
+            service._get_conversation_system_prompt(),
+            service._build_smart_response_messages("hola", {})[0]["content"],
+        ]
+
+        for prompt in prompts:
+            assert prompt.count(service.PRODUCT_CATALOG) == 1
+
+    def test_conversation_prompt_is_compact(self, service):
+        """Test que el prompt de conversación se mantiene corto"""
+        prompt = service._get_conversation_system_prompt()
+
+        assert service._estimate_tokens(prompt) < 350
+        assert "generate_proforma" in prompt
+
+    def test_system_prompt_prefix_is_stable(self, service):
+        """Test que el mensaje del sistema es el mismo objeto en cada petición y los datos van en el rol user"""
+        first = service._build_intent_messages("HLSO 16/20")
+        second = service._build_intent_messages("HOSO 20/30")
+        assert first[0]["content"] is second[0]["content"]
+        assert "HOSO 20/30" in second[1]["content"]
+
+        smart_a = service._build_smart_response_messages("hola", {"state": "a"})
+        smart_b = service._build_smart_response_messages("adiós", {"state": "b"}, {"precio": 5})
+        assert smart_a[0]["content"] is smart_b[0]["content"]
+
+
+class TestScanKeywords:
+    """Tests para _scan_keywords()"""
+
+    def test_returns_overlapping_keywords(self, service):
+        """Test que detecta palabras clave que se solapan"""
+        hits = service._scan_keywords("precios de colas")
+
+        assert {"precio", "precios", "cola", "colas"} <= hits
+
+    def test_only_known_keywords(self, service):
+        """Test que solo devuelve palabras clave de la tabla"""
+        hits = service._scan_keywords("hola buenas tardes")
+
+        assert hits <= service.INTENT_KEYWORDS
+        assert "hola" not in hits
+
+    def test_ignores_accents_and_extra_spaces(self, service):
+        """Test que la comparación ignora tildes y espacios repetidos"""
+        hits = service._scan_keywords(_fold_text("Necesito una COTIZACIÓN,  señor"))
+
+        assert {"cotizacion", "señor"} <= hits
+
+    def test_folded_match_returns_every_spelling(self, service):
+        """Test que una coincidencia devuelve todas las grafías con la misma forma plegada"""
+        hits = service._scan_keywords(_fold_text("envío a miami"))
+
+        assert {"envio", "envío"} <= hits
+
+    def test_fold_text_keeps_ascii_intact(self):
+        """Test que el texto ASCII solo se pasa a minúsculas y se colapsan espacios"""
+        assert _fold_text("Precio  HLSO\n16/20") == "precio hlso 16/20"
+        assert _fold_text("Camarón ñ") == "camaron n"
+
+    def test_accented_greeting_detected(self, service):
+        """Test que un saludo con tildes se reconoce como saludo"""
+        result = service._basic_intent_analysis("¿Cómo estás?")
+
+        assert result["intent"] == "greeting"
+
+    def test_aho_corasick_matches_substring_scan(self, service, monkeypatch):
+        """Test que el autómata Aho-Corasick devuelve lo mismo que la búsqueda por subcadena"""
+        pytest.importorskip("ahocorasick")
+        automaton_scan = _keyword_scanner(service.INTENT_KEYWORDS)
+        monkeypatch.setattr("app.services.openai_service._ahocorasick", None)
+        substring_scan = _keyword_scanner(service.INTENT_KEYWORDS)
+
+        for text in ("", "precios de colas", "cocedero cfr lisboa: inteiro 20/30. colas 21/25 100% net", "envio senor"):
+            assert automaton_scan(text) == substring_scan(text)
+
+    def test_product_priority_preserved(self, service):
+        """Test que el orden de prioridad de productos se mantiene"""
+        result = service._basic_intent_analysis("precio pelado y desvenado con cola 21/25")
+
+        assert result["product"] == "P&D IQF"
+
+    def test_prefilter_skips_fields_without_anchor(self, service):
+        """Test que sin la palabra ancla no se extraen flete, cantidad ni NET"""
+        result = service._basic_intent_analysis("precio hlso 16/20")
+
+        assert result["flete_custom"] is None
+        assert result["quantity"] is None
+        assert result["net_weight_percentage"] is None
+
+    def test_prefilter_keeps_fields_with_anchor(self, service):
+        """Test que con la palabra ancla se siguen extrayendo los valores"""
+        result = service._basic_intent_analysis("precio hlso 16/20 flete 0.25 500 kg 80% neto")
+
+        assert result["flete_custom"] == 0.25
+        assert result["quantity"] == "500"
+        assert result["net_weight_percentage"] == 80
+
+    def test_cliente_regex_skipped_without_anchor(self, service):
+        """Test que sin palabra ancla de cliente no se ejecutan sus patrones"""
+        with patch('app.services.openai_service._CLIENTE_RES') as cliente_res:
+            result = service._basic_intent_analysis("precio hlso 16/20 flete 0.20")
+
+        cliente_res.iter_matches.assert_not_called()
+        assert result["cliente_nombre"] is None
+
+    def test_cliente_detected_with_stop_words_removed(self, service):
+        """Test que el nombre del cliente se extrae sin palabras comunes"""
+        result = service._basic_intent_analysis("proforma hlso 16/20 cliente juan perez con flete 0.20")
+
+        assert result["cliente_nombre"] == "juan perez"
+
+    def test_unknown_destination_not_mapped_to_los_angeles(self, service):
+        """Test que un destino que contiene "la" no se confunde con Los Angeles"""
+        result = service._basic_intent_analysis("precio hlso 16/20 flete a guatemala")
+
+        assert result["destination"] == "Guatemala"
+        assert result["usar_libras"] is False
+
+    def test_free_text_destination_fallback(self, service):
+        """Test que "enviar a" sigue detectando destinos no catalogados"""
+        result = service._basic_intent_analysis("precio hlso 16/20 flete 0.20 enviar a lima")
+
+        assert result["destination"] == "Lima"
+
+    def test_quantity_prefers_unit_priority(self, service):
+        """Test que la cantidad en libras gana aunque aparezca después de los kilos"""
+        result = service._basic_intent_analysis("precio hlso 16/20 500 kg o 1,200 lbs")
+
+        assert result["quantity"] == "1,200"
+
+    def test_quantity_per_box(self, service):
+        """Test que "20k/caja" se convierte a kilos por caja"""
+        result = service._basic_intent_analysis("precio hlso 16/20 20k/caja")
+
+        assert result["quantity"] == "20000 kg/caja"
+
+    @pytest.mark.parametrize("message,expected", [
+        ("necesito 1,000 lbs hlso 16/20 20k/caja", "1000000 kg/caja"),
+        ("precio hlso 16/20 1.5 mil 20k/caja", "1500 kg/caja"),
+    ])
+    def test_quantity_per_box_with_separators(self, service, message, expected):
+        """Test que la conversión a kilos por caja admite miles con coma y decimales"""
+        assert service._basic_intent_analysis(message)["quantity"] == expected
+
+    def test_language_counts_keyword_substrings(self, service):
+        """Test que el idioma se decide con las palabras clave del escaneo único"""
+        english = service._basic_intent_analysis("prices for hlso 16/20 shipping")
+        spanish = service._basic_intent_analysis("precios hlso 16/20 con flete")
+
+        assert english["language"] == "en"
+        assert spanish["language"] == "es"
+
+
+class TestIntentCache:
+    """Tests para la caché LRU de _basic_intent_analysis()"""
+
+    def test_repeated_message_is_cached(self, service):
+        """Test que un mensaje repetido no se vuelve a analizar"""
+        message = "quiero proforma 16/20 hlso flete miami"
+
+        with patch.object(service, '_detect_products_and_sizes', wraps=service._detect_products_and_sizes) as detect:
+            service._intent_cache.cache_clear()
+            first = service._basic_intent_analysis(message)
+            second = service._basic_intent_analysis(message)
+
+        assert first == second
+        assert detect.call_count == 1
+        assert service.get_cache_stats()["intent_hits"] == 1
+
+    def test_returns_independent_copies(self, service):
+        """Test que modificar el resultado no altera la caché"""
+        message = "precio hlso 16/20"
+
+        first = service._basic_intent_analysis(message)
+        first["product"] = "HOSO"
+        first["sizes_by_product"]["HLSO"].append("21/25")
+
+        second = service._basic_intent_analysis(message)
+        assert second["product"] == "HLSO"
+        assert second["sizes_by_product"] == {"HLSO": ["16/20"]}
+
+
+class TestOrderedPatterns:
+    """Tests para _OrderedPatterns"""
+
+    def test_first_match_respects_pattern_order(self):
+        """Test que gana el patrón de mayor prioridad aunque aparezca después en el texto"""
+        patterns = _OrderedPatterns((r'flete\s*(\d+)', r'(\d+)\s*kg'))
+
+        match = patterns.first_match("20 kg con flete 30")
+
+        assert match.group(1) == "30"
+
+    def test_iter_matches_in_priority_order(self):
+        """Test que emite un match por patrón presente, en orden de prioridad"""
+        patterns = _OrderedPatterns((r'a(\d)', r'b(\d)', r'c(\d)'))
+
+        groups = [match.group(1) for match in patterns.iter_matches("c3 b2")]
+
+        assert groups == ["2", "3"]
+
+    def test_no_match(self):
+        """Test que devuelve None si ningún patrón coincide"""
+        assert _OrderedPatterns((r'x(\d)',)).first_match("sin números") is None
+
+
+class TestLinearPatterns:
+    """Tests para el motor RE2 opcional (_compile_linear)"""
+
+    def test_re2_syntax_keeps_unicode_classes(self):
+        """Test que \\w y \\s se traducen a clases Unicode y $ admite salto final"""
+        translated = _to_re2_syntax(r'cliente\s+([a-z\w\s]+?)(?:\s+con|$)')
+
+        assert r'\w' not in translated and r'\s' not in translated
+        assert r'[a-z\pL\pN_' in translated
+        assert translated.endswith(r'|\n?$)')
+
+    def test_matches_like_re(self):
+        """Test que el patrón compilado devuelve la misma captura que re"""
+        pattern = r'cliente\s+([a-záéíóúñ\w\s]+?)(?:\s+con|\s+de|$)'
+        text = "proforma cliente joão müller\xa0jr con flete"
+
+        assert _compile_linear(pattern).search(text).group(1) == "joão müller\xa0jr"
+
+    def test_re2_linear_on_adversarial_input(self):
+        """Test que con RE2 un mensaje que repite el prefijo no es cuadrático"""
+        pytest.importorskip("re2")
+        patterns = _OrderedPatterns((r'para\s+([\w\s]+?)(?:\s+con|$)',), compiler=_compile_linear)
+
+        assert patterns.first_match("para " * 20000 + "!") is None
+
+
+class TestDetectMultipleProducts:
+    """Tests para detect_multiple_products()"""
+
+    def test_case_insensitive_lines(self, service):
+        """Test que detecta productos en minúsculas línea por línea"""
+        message = "hlso 16/20\n\np&d iqf 21-25\nez peel 26/30"
+
+        result = service.detect_multiple_products(message)
+
+        assert [(p["product"], p["size"]) for p in result] == [
+            ("HLSO", "16/20"), ("P&D IQF", "21/25"), ("EZ PEEL", "26/30")
+        ]
+        assert result[0]["line"] == "HLSO 16/20"
+
+    def test_inteiro_colas_lowercase_requires_clarification(self, service):
+        """Test que inteiro/colas en minúsculas con varias tallas pide aclaración"""
+        result = service.detect_multiple_products("inteiro 20/30, 30/40")
+
+        assert result == [{"special": "inteiro_colas", "count": 2}]
+
+
+class TestSingleFlight:
+    """Tests para el single-flight de _make_request()"""
+
+    def test_concurrent_identical_requests_share_one_call(self, service):
+        """Test que peticiones idénticas concurrentes hacen una sola llamada"""
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+
+        def slow_post(*args, **kwargs):
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return "HLSO 16/20"
+
+        messages = [{"role": "user", "content": "HLSO 16/20"}]
+        results = []
+
+        with patch.object(service, "_post_chat_completion", side_effect=slow_post):
+            leader = threading.Thread(target=lambda: results.append(service._make_request(messages)))
+            leader.start()
+            started.wait(5)
+            follower = threading.Thread(target=lambda: results.append(service._make_request(messages)))
+            follower.start()
+            release.set()
+            leader.join(5)
+            follower.join(5)
+
+        assert results == ["HLSO 16/20", "HLSO 16/20"]
+        assert len(calls) == 1
+        assert service._inflight == {}
+
+    def test_leader_failure_elects_one_new_leader(self, service):
+        """Test que si la original falla solo una de las que esperan vuelve a llamar a la API"""
+        release = threading.Event()
+        calls = []
+
+        def post(*args, **kwargs):
+            calls.append(1)
+            if len(calls) == 1:
+                release.wait(5)
+                return None
+            # La nueva original tarda: las demás deben esperarla y no llamar a la API
+            threading.Event().wait(0.2)
+            return "HLSO 16/20"
+
+        messages = [{"role": "user", "content": "HLSO 16/20"}]
+        results = []
+        joins = []
+        join_inflight = service._join_inflight
+
+        def counting_join(cache_key):
+            joins.append(cache_key)
+            return join_inflight(cache_key)
+
+        with patch.object(service, "_post_chat_completion", side_effect=post), \
+                patch.object(service, "_join_inflight", side_effect=counting_join):
+            threads = [threading.Thread(target=lambda: results.append(service._make_request(messages))) for _ in range(4)]
+            for thread in threads:
+                thread.start()
+            while len(joins) < 4:
+                threading.Event().wait(0.01)
+            release.set()
+            for thread in threads:
+                thread.join(5)
+
+        assert len(calls) == 2
+        assert sorted(results, key=str) == ["HLSO 16/20"] * 3 + [None]
+        assert service._inflight == {}
+
+    def test_wait_covers_leader_retries(self, service):
+        """Test que la espera de las duplicadas cubre todos los intentos de la original"""
+        worst_case = (
+            service.HTTP_TIMEOUT * (service.HTTP_RETRY_TOTAL + 1)
+            + service.RATE_LIMIT_DELAY * service.HTTP_RETRY_TOTAL
+        )
+
+        assert service.INFLIGHT_WAIT_TIMEOUT >= worst_case
+
+    def test_join_and_release_inflight(self, service):
+        """Test que solo la primera petición es líder y la liberación despierta al resto"""
+        cache_key = "clave"
+        event, is_leader = service._join_inflight(cache_key)
+        assert is_leader
+
+        _, second_is_leader = service._join_inflight(cache_key)
+        assert not second_is_leader
+
+        service._release_inflight(cache_key)
+
+        assert event.is_set()
+        assert cache_key not in service._inflight
+
+
+
+def _completion(content):
+    return {"choices": [{"message": {"content": content}}]}
+
+
+class TestAnalyzeAndRespond:
+    """Tests para analyze_and_respond()"""
+
+    MESSAGE = "Cocedero CFR Lisboa: Inteiro 20/30, 30/40"
+
+    def test_single_call_returns_intent_and_reply(self, service):
+        """Test que una sola llamada en modo JSON devuelve intención y respuesta"""
+        llm_result = {"intent": {"intent": "proforma", "confidence": 0.95}, "reply": "Generando proforma de HOSO 20/30..."}
+
+        with patch.object(service, "_make_request", return_value=json.dumps(llm_result)) as mock_request:
+            result = service.analyze_and_respond(self.MESSAGE, {"state": "idle", "data": {}})
+
+        assert result == llm_result
+        assert mock_request.call_count == 1
+        messages = mock_request.call_args.args[0]
+        assert messages[0]["content"] == _SYSTEM_PROMPT_ANALYZE_AND_RESPOND
+        assert "Estado actual: idle" in messages[1]["content"]
+        assert mock_request.call_args.kwargs["response_format"] == {"type": "json_object"}
+
+    def test_repeated_message_costs_no_model_call(self, service):
+        """Test que el mismo mensaje de otro usuario sale de la caché de intención"""
+        llm_result = {"intent": {"intent": "proforma", "sizes": ["20/30", "30/40"]}, "reply": "Generando proforma..."}
+
+        with patch.object(service, "_post_chat_completion", return_value=json.dumps(llm_result)) as mock_post:
+            first = service.analyze_and_respond(self.MESSAGE, {"state": "idle", "data": {}})
+            second = service.analyze_and_respond(self.MESSAGE, {"state": "waiting_for_glaseo", "data": {"x": 1}})
+
+        assert mock_post.call_count == 1
+        assert len(service._intent_responses) == 1
+        assert first == llm_result
+        assert second == {"intent": llm_result["intent"], "reply": None}
+        # analyze_user_intent comparte la misma caché
+        assert service.analyze_user_intent(self.MESSAGE) == llm_result["intent"]
+        assert mock_post.call_count == 1
+
+    def test_async_repeated_message_costs_no_model_call(self, service):
+        """Test que la versión async también lee y llena la caché de intención"""
+        requests_seen = []
+
+        def handler(request):
+            requests_seen.append(request)
+            return httpx.Response(200, json=_completion('{"intent": {"intent": "proforma"}, "reply": "Listo"}'))
+
+        service._async_client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+        async def run():
+            first = await service.analyze_and_respond_async(self.MESSAGE, {"state": "idle"})
+            second = await service.analyze_and_respond_async(self.MESSAGE, {"state": "waiting_for_glaseo"})
+            return first, second
+
+        first, second = asyncio.run(run())
+
+        assert len(requests_seen) == 1
+        assert first == {"intent": {"intent": "proforma"}, "reply": "Listo"}
+        assert second == {"intent": {"intent": "proforma"}, "reply": None}
+
+    def test_obvious_intent_skips_openai(self, service):
+        """Test que un saludo se resuelve sin llamada y sin respuesta preparada"""
+        with patch.object(service, "_make_request") as mock_request:
+            result = service.analyze_and_respond("hola")
+
+        mock_request.assert_not_called()
+        assert result["intent"]["intent"] == "greeting"
+        assert result["reply"] is None
+
+    def test_missing_intent_object_falls_back_to_basic_analysis(self, service):
+        """Test que sin objeto de intención se usa el análisis básico"""
+        with patch.object(service, "_make_request", return_value='{"reply": "Hola"}'):
+            result = service.analyze_and_respond(self.MESSAGE)
+
+        assert result == {"intent": service._basic_intent_analysis(self.MESSAGE), "reply": None}
+
+    def test_async_version_makes_one_request(self, service):
+        """Test que la versión async hace una sola petición al modelo de intención"""
+        requests_seen = []
+
+        def handler(request):
+            requests_seen.append(request)
+            return httpx.Response(200, json=_completion('{"intent": {"intent": "proforma"}, "reply": "  "}'))
+
+        service._async_client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        result = asyncio.run(service.analyze_and_respond_async(self.MESSAGE))
+
+        assert result == {"intent": {"intent": "proforma"}, "reply": None}
+        assert len(requests_seen) == 1
+        body = json.loads(requests_seen[0].content)
+        assert body["model"] == service.intent_model
+        assert body["max_tokens"] == service.ANALYZE_AND_RESPOND_MAX_TOKENS
+
+
+class TestAsyncRequests:
+    """Tests para _make_request_async() y los métodos async del webhook"""
+
+    def _mock_client(self, service, responses):
+        requests_seen = []
+
+        def handler(request):
+            requests_seen.append(request)
+            status_code, payload = responses[min(len(requests_seen), len(responses)) - 1]
+            return httpx.Response(status_code, json=payload)
+
+        service._async_client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        return requests_seen
+
+    def test_analyze_user_intent_async_uses_json_mode(self, service):
+        """Test que la versión async pide JSON al modelo de intención y lo parsea"""
+        requests_seen = self._mock_client(service, [(200, _completion('{"intent": "proforma", "confidence": 0.9}'))])
+
+        result = asyncio.run(service.analyze_user_intent_async("HLSO 16/20 y 21/25 con glaseo 20%"))
+
+        assert result == {"intent": "proforma", "confidence": 0.9}
+        body = json.loads(requests_seen[0].content)
+        assert body["model"] == service.intent_model
+        assert body["response_format"] == service.JSON_RESPONSE_FORMAT
+
+    def test_retries_transient_status_codes(self, service):
+        """Test que los códigos transitorios se reintentan sin bloquear el loop"""
+        requests_seen = self._mock_client(service, [(503, {}), (429, {}), (200, _completion("Hola"))])
+
+        with patch.object(service, "_retry_delay", return_value=0):
+            result = asyncio.run(service.generate_smart_response_async("hola", {"state": "idle"}))
+
+        assert result == "Hola"
+        assert len(requests_seen) == 3
+        assert service._rate_limit_hits == 1
+
+    def test_error_status_returns_none(self, service):
+        """Test que un error definitivo devuelve None"""
+        requests_seen = self._mock_client(service, [(400, {"error": {"message": "bad"}})])
+
+        assert asyncio.run(service.enhance_price_explanation_async({"precio": 5})) is None
+        assert len(requests_seen) == 1
+
+    def test_concurrent_identical_requests_share_one_call(self, service):
+        """Test que corrutinas con la misma petición hacen una sola llamada"""
+        requests_seen = self._mock_client(service, [(200, _completion("HLSO 16/20"))])
+        messages = [{"role": "user", "content": "HLSO 16/20"}]
+
+        async def run():
+            return await asyncio.gather(*(service._make_request_async(messages) for _ in range(3)))
+
+        assert asyncio.run(run()) == ["HLSO 16/20"] * 3
+        assert len(requests_seen) == 1
+        assert service._ainflight == {}
+
+    def test_leader_failure_elects_one_new_leader(self, service):
+        """Test que si la original falla solo una corrutina en espera vuelve a llamar a la API"""
+        calls = []
+
+        async def post(*args):
+            calls.append(1)
+            await asyncio.sleep(0)
+            return None if len(calls) == 1 else "HLSO 16/20"
+
+        messages = [{"role": "user", "content": "HLSO 16/20"}]
+
+        async def run():
+            return await asyncio.gather(*(service._make_request_async(messages) for _ in range(4)))
+
+        with patch.object(service, "_apost_chat_completion", side_effect=post):
+            results = asyncio.run(run())
+
+        assert len(calls) == 2
+        assert results == [None] + ["HLSO 16/20"] * 3
+        assert service._ainflight == {}
+
+    def test_analyze_many_limits_concurrency_and_keeps_order(self, service):
+        """Test que analyze_many respeta el límite de concurrencia y el orden"""
+        active = 0
+        peak = 0
+
+        async def fake_analyze(message):
+            nonlocal active, peak
+            active += 1
+            peak = max(peak, active)
+            await asyncio.sleep(0)
+            active -= 1
+            if message == "falla":
+                raise RuntimeError("boom")
+            return {"intent": "proforma", "message": message}
+
+        messages = [f"m{i}" for i in range(10)] + ["falla"]
+        with patch.object(service, "analyze_user_intent_async", side_effect=fake_analyze):
+            results = asyncio.run(service.analyze_many(messages, concurrency=3))
+
+        assert [r.get("message") for r in results[:10]] == messages[:10]
+        assert results[10] == {"intent": "unknown", "confidence": 0}
+        assert peak == 3
+
+    def test_retry_delay_honors_retry_after(self, service):
+        """Test que Retry-After tiene prioridad sobre el backoff exponencial"""
+        assert service._retry_delay(0, "2") == 2.0
+        delay = service._retry_delay(2)
+        assert 2.0 <= delay <= 2.0 + service.HTTP_RETRY_BACKOFF_JITTER
+
+    def test_transcribe_audio_async_streams_and_retries(self, service, tmp_path):
+        """Test que la transcripción async sube el multipart por bloques y lo rebobina al reintentar"""
+        audio = tmp_path / "nota.ogg"
+        audio.write_bytes(b"OggS" * 50000)
+        bodies = []
+
+        async def handler(request):
+            bodies.append((request.headers, await request.aread()))
+            if len(bodies) == 1:
+                return httpx.Response(503)
+            return httpx.Response(200, text=" precio HLSO \n")
+
+        service._async_client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        with patch.object(service, "_retry_delay", return_value=0):
+            result = asyncio.run(service.transcribe_audio_async(str(audio)))
+
+        assert result == "precio HLSO"
+        assert len(bodies) == 2 and bodies[0][1] == bodies[1][1]
+        headers, body = bodies[1]
+        assert int(headers["Content-Length"]) == len(body)
+        assert "Transfer-Encoding" not in headers
+        assert b"OggS" * 50000 in body and b'name="language"\r\n\r\nes' in body
+
+
+def _http_response(status_code, payload=None, content=None):
+    response = MagicMock()
+    response.status_code = status_code
+    response.content = content if content is not None else json.dumps(payload or {}).encode()
+    response.text = response.content.decode()
+    return response
+
+
+class TestBatchApi:
+    """Tests para queue_batch() y la descarga de resultados"""
+
+    def test_batch_creation_not_resent_after_gateway_error(self, service):
+        """Test que un 502 al crear el batch no reenvía el POST (evita un batch duplicado)"""
+        def responder(method, url):
+            return (200, {"id": "file-1"}) if url.endswith("/files") else (502, {})
+
+        with _urllib3_responses(responder) as calls:
+            assert service.queue_batch([{"custom_id": "a", "body": {}}]) is None
+
+        assert calls == [("POST", "/v1/files"), ("POST", "/v1/batches")]
+
+    def test_queue_intent_batch_uploads_jsonl_and_creates_batch(self, service):
+        """Test que sube el JSONL y crea el batch con ventana de 24h"""
+        uploaded = {}
+
+        def fake_post(url, headers, data, timeout):
+            if url.endswith("/files"):
+                uploaded["body"] = data.read()
+                return _http_response(200, {"id": "file-1"})
+            uploaded["batch"] = json.loads(data)
+            return _http_response(200, {"id": "batch-1"})
+
+        with patch.object(service._session, "post", side_effect=fake_post):
+            batch_id = service.queue_intent_batch(["HLSO 16/20", "HOSO 20/30"])
+
+        assert batch_id == "batch-1"
+        assert uploaded["batch"] == {
+            "input_file_id": "file-1",
+            "endpoint": "/v1/chat/completions",
+            "completion_window": "24h"
+        }
+        assert b'name="purpose"\r\n\r\nbatch' in uploaded["body"]
+        assert b'"custom_id":"intent-1"' in uploaded["body"]
+        assert b'"response_format":{"type":"json_object"}' in uploaded["body"]
+
+    def test_queue_batch_upload_error(self, service):
+        """Test que retorna None si falla la subida del archivo"""
+        with patch.object(service._session, "post", return_value=_http_response(500, {})):
+            assert service.queue_batch([{"custom_id": "a", "body": {}}]) is None
+
+    def test_get_intent_batch_results(self, service):
+        """Test que parsea los resultados y omite peticiones fallidas"""
+        def line(custom_id, status_code, content):
+            body = {"choices": [{"message": {"content": content}}]}
+            return json.dumps({"custom_id": custom_id, "response": {"status_code": status_code, "body": body}})
+
+        output = "\n".join([
+            line("intent-0", 200, '{"intent": "proforma", "size": "16/20"}'),
+            line("intent-1", 500, ""),
+        ]).encode()
+        responses = [
+            _http_response(200, {"id": "batch-1", "status": "completed", "output_file_id": "file-out"}),
+            _http_response(200, content=output),
+        ]
+
+        with patch.object(service._session, "get", side_effect=responses):
+            results = service.get_intent_batch_results("batch-1")
+
+        assert results == {"intent-0": {"intent": "proforma", "size": "16/20"}}
+
+    def test_get_batch_results_not_completed(self, service):
+        """Test que retorna None si el batch no ha terminado"""
+        response = _http_response(200, {"id": "batch-1", "status": "in_progress"})
+
+        with patch.object(service._session, "get", return_value=response):
+            assert service.get_batch_results("batch-1") is None
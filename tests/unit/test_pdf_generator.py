@@ -0,0 +1,297 @@
+"""
+Tests unitarios para app/services/pdf_generator.py
+
+Cubre:
+- Generación de cotizaciones individuales y consolidadas
+- Logo leído y decodificado una sola vez y reutilizado desde memoria
+- Nombre de archivo con sufijo del teléfono (_build_filepath)
+- Variantes async que construyen el PDF en un hilo
+- Limpieza de PDFs antiguos (cleanup_old_pdfs)
+"""
+import asyncio
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from unittest.mock import patch
+
+import pytest
+from reportlab.lib.units import inch
+
+import app.services.pdf_generator as pdf_module
+from app.services.pdf_generator import PDFGenerator
+
+
+@pytest.fixture
+def generator(tmp_path, monkeypatch):
+    """PDFGenerator que escribe en un directorio temporal"""
+    monkeypatch.setattr(pdf_module, "QUOTE_COUNTER_FILE", str(tmp_path / "data" / "quote_counter.txt"))
+    gen = PDFGenerator()
+    gen.output_dir = str(tmp_path)
+    return gen
+
+
+@pytest.fixture
+def price_info():
+    """Datos mínimos de una cotización CFR"""
+    return {
+        'producto': 'HLSO',
+        'talla': '16/20',
+        'precio_final_kg': 8.5,
+        'factor_glaseo': 0.8,
+        'glaseo_percentage': 20,
+        'incluye_flete': True,
+        'destination': 'China',
+    }
+
+
+class TestGenerateQuotePdf:
+    """Tests para generate_quote_pdf() y generate_consolidated_quote_pdf()"""
+
+    def test_generates_pdf_file(self, generator, price_info):
+        """Test que se genera un PDF válido en el directorio de salida"""
+        filepath = generator.generate_quote_pdf(price_info, "+593981234567", "es")
+
+        assert filepath is not None
+        with open(filepath, "rb") as f:
+            assert f.read(5) == b"%PDF-"
+
+    def test_streams_without_ascii85(self, generator, price_info):
+        """Test que los streams se comprimen con Flate sin el envoltorio ASCII85"""
+        filepath = generator.generate_quote_pdf(price_info)
+
+        with open(filepath, "rb") as f:
+            data = f.read()
+        assert b"/FlateDecode" in data
+        assert b"/ASCII85Decode" not in data
+
+    def test_generates_consolidated_pdf_file(self, generator, price_info):
+        """Test que se genera el PDF consolidado con varios productos"""
+        products = [price_info, {**price_info, 'producto': 'HOSO', 'talla': '20/30', 'precio_fob_kg': 5.0}]
+
+        filepath = generator.generate_consolidated_quote_pdf(products, language="en", destination="Lisboa")
+
+        assert filepath is not None
+        with open(filepath, "rb") as f:
+            assert f.read(5) == b"%PDF-"
+
+    def test_failed_build_leaves_no_file(self, generator, price_info, tmp_path):
+        """Test que si la construcción falla no queda un PDF a medio escribir"""
+        with patch.object(pdf_module.SimpleDocTemplate, "build", side_effect=RuntimeError("layout")):
+            assert generator.generate_quote_pdf(price_info) is None
+
+        assert not list(tmp_path.glob("*.pdf"))
+
+    def test_missing_secondary_prices(self, generator, price_info):
+        """Test que precios secundarios en None no impiden generar el PDF"""
+        price_info.update({'precio_kg': None, 'flete': None})
+
+        assert generator.generate_quote_pdf(price_info) is not None
+
+    def test_write_failure_returns_none(self, generator, price_info, tmp_path):
+        """Test que si no se puede escribir el archivo se devuelve None"""
+        generator.output_dir = str(tmp_path / "no_existe")
+
+        assert generator.generate_quote_pdf(price_info) is None
+
+
+    @pytest.mark.parametrize("factor,expected", [(0.8, "20%"), (0.9, "10%"), (0.7, "30%")])
+    def test_glaze_from_factor(self, generator, factor, expected):
+        """Test que el glaseo calculado desde el factor no pierde un punto por redondeo"""
+        info = {'producto': 'HLSO', 'talla': '16/20', 'precio_final_kg': 8.5, 'factor_glaseo': factor}
+
+        with patch.object(pdf_module, "Table", wraps=pdf_module.Table) as mock_table:
+            generator.generate_quote_pdf(info)
+
+        info_rows = mock_table.call_args_list[0].args[0]
+        assert info_rows[-1][1] == expected
+
+
+    def test_shared_styles_not_mutated(self, generator, price_info):
+        """Test que generar PDFs no modifica los estilos compartidos a nivel de módulo"""
+        table_styles = [pdf_module._INFO_TABLE_STYLE, pdf_module._PRECIO_TABLE_STYLE, pdf_module._PRODUCTS_TABLE_STYLE]
+        commands_before = [list(style.getCommands()) for style in table_styles]
+        title_font_before = pdf_module._COTIZACION_TITLE_STYLE.fontSize
+
+        generator.generate_quote_pdf(price_info)
+        generator.generate_consolidated_quote_pdf([price_info, price_info])
+
+        assert [list(style.getCommands()) for style in table_styles] == commands_before
+        assert pdf_module._COTIZACION_TITLE_STYLE.fontSize == title_font_before
+
+
+class TestLogo:
+    """Tests para la carga del logo"""
+
+    def test_logo_served_from_memory(self, generator, price_info, tmp_path, monkeypatch):
+        """Test que el logo leído al crear el generador se usa aunque el archivo ya no esté"""
+        assert generator._logo_image is not None
+        monkeypatch.setattr(pdf_module, "LOGO_PATH", str(tmp_path / "no_existe.png"))
+
+        filepath = generator.generate_quote_pdf(price_info)
+
+        with open(filepath, "rb") as f:
+            assert b"/Subtype /Image" in f.read()
+
+    def test_missing_logo(self, tmp_path, monkeypatch):
+        """Test que sin logo el PDF se genera igualmente"""
+        monkeypatch.setattr(pdf_module, "LOGO_PATH", str(tmp_path / "no_existe.png"))
+        monkeypatch.setattr(pdf_module, "QUOTE_COUNTER_FILE", str(tmp_path / "data" / "quote_counter.txt"))
+        gen = PDFGenerator()
+        gen.output_dir = str(tmp_path)
+
+        assert gen._logo_image is None
+        assert gen.generate_quote_pdf({'producto': 'HLSO', 'talla': '16/20', 'precio_final_kg': 8.5}) is not None
+
+    def test_logo_downscaled_to_target_dpi(self, generator):
+        """Test que el logo se incrusta reducido a LOGO_DPI y no a su resolución original"""
+        expected = (
+            round(pdf_module.LOGO_WIDTH / inch * pdf_module.LOGO_DPI),
+            round(pdf_module.LOGO_HEIGHT / inch * pdf_module.LOGO_DPI),
+        )
+
+        assert generator._logo_image._img.getSize() == expected
+
+    def test_logo_copies_share_reader(self, generator):
+        """Test que cada documento recibe su propio flowable con el mismo ImageReader"""
+        first = generator._logo_flowable()
+        second = generator._logo_flowable()
+
+        assert first is not second
+        assert first._img is second._img
+
+    def test_logo_decoded_on_load(self, generator):
+        """Test que los píxeles del logo se decodifican al crear el generador"""
+        assert generator._logo_image._img._data is not None
+
+    def test_concurrent_builds_share_logo(self, tmp_path, monkeypatch, price_info):
+        """Test que varios hilos generan PDFs a la vez con el logo compartido"""
+        monkeypatch.setattr(pdf_module, "QUOTE_COUNTER_FILE", str(tmp_path / "data" / "quote_counter.txt"))
+        gen = PDFGenerator()
+        gen.output_dir = str(tmp_path)
+
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            filepaths = list(pool.map(lambda _: gen.generate_quote_pdf(price_info), range(8)))
+
+        assert all(filepaths)
+        assert len(set(filepaths)) == 8
+        for filepath in filepaths:
+            with open(filepath, "rb") as f:
+                assert b"/Subtype /Image" in f.read()
+
+    def test_corrupt_logo(self, tmp_path, monkeypatch):
+        """Test que un logo ilegible se ignora"""
+        corrupt = tmp_path / "logo.png"
+        corrupt.write_bytes(b"no es un png")
+        monkeypatch.setattr(pdf_module, "LOGO_PATH", str(corrupt))
+
+        assert PDFGenerator()._logo_image is None
+
+
+class TestBuildFilepath:
+    """Tests para _build_filepath()"""
+
+    @pytest.mark.parametrize("user_phone,suffix", [
+        ("whatsapp:+593981234567", "4567"),
+        ("+12", "0012"),
+        (None, "0000"),
+    ])
+    def test_phone_suffix(self, generator, user_phone, suffix):
+        """Test que el nombre termina con los últimos 4 dígitos del teléfono"""
+        filepath = generator._build_filepath("cotizacion_BGR", user_phone)
+
+        assert filepath.startswith(generator.output_dir)
+        assert re.search(rf"_{suffix}_[0-9a-f]{{6}}\.pdf$", filepath)
+
+    def test_uses_given_timestamp(self, generator):
+        """Test que se usa la marca de tiempo recibida para el nombre"""
+        filepath = generator._build_filepath("cotizacion_BGR", None, datetime(2025, 3, 4, 10, 20, 30))
+
+        assert os.path.basename(filepath).startswith("cotizacion_BGR_20250304_102030_0000_")
+
+    def test_same_second_paths_differ(self, generator):
+        """Test que dos PDFs del mismo teléfono en el mismo segundo no comparten ruta"""
+        now = datetime(2025, 3, 4, 10, 20, 30)
+
+        first = generator._build_filepath("cotizacion_BGR", "+593981234567", now)
+        second = generator._build_filepath("cotizacion_BGR", "+593981234567", now)
+
+        assert first != second
+
+
+class TestAsyncWrappers:
+    """Tests para las variantes async que generan el PDF en un hilo"""
+
+    def test_quote_pdf_async(self, generator, price_info):
+        """Test que la variante async devuelve un PDF igual que la síncrona"""
+        filepath = asyncio.run(generator.generate_quote_pdf_async(price_info, "+593981234567", "en"))
+
+        assert "_4567_" in os.path.basename(filepath)
+        with open(filepath, "rb") as f:
+            assert f.read(5) == b"%PDF-"
+
+    def test_consolidated_pdf_async_forwards_arguments(self, generator, price_info):
+        """Test que se pasan todos los argumentos al método síncrono"""
+        with patch.object(generator, "generate_consolidated_quote_pdf", return_value="/tmp/x.pdf") as mock_generate:
+            result = asyncio.run(generator.generate_consolidated_quote_pdf_async(
+                [price_info], "+593981234567", "en", 10, "Lisboa", "Cliente"
+            ))
+
+        assert result == "/tmp/x.pdf"
+        mock_generate.assert_called_once_with([price_info], "+593981234567", "en", 10, "Lisboa", "Cliente")
+
+    def test_concurrent_generation_unique_numbers(self, generator, price_info):
+        """Test que generaciones concurrentes no repiten número de cotización"""
+        async def generate_many():
+            return await asyncio.gather(*[
+                generator.generate_quote_pdf_async(price_info) for _ in range(4)
+            ])
+
+        asyncio.run(generate_many())
+
+        with open(pdf_module.QUOTE_COUNTER_FILE) as f:
+            assert f.read() == "4"
+
+
+class TestEnsureOutputDir:
+    """Tests para ensure_output_dir()"""
+
+    def test_creates_directory_idempotently(self, generator, tmp_path):
+        """Test que crea el directorio y no falla si ya existe"""
+        generator.output_dir = str(tmp_path / "salida" / "pdfs")
+
+        generator.ensure_output_dir()
+        generator.ensure_output_dir()
+
+        assert os.path.isdir(generator.output_dir)
+
+
+class TestCleanupOldPdfs:
+    """Tests para cleanup_old_pdfs()"""
+
+    def test_removes_only_old_pdfs(self, generator, tmp_path):
+        """Test que solo se eliminan los PDFs más antiguos que el límite"""
+        old_time = time.time() - 10 * 24 * 60 * 60
+        old_pdf = tmp_path / "viejo.pdf"
+        new_pdf = tmp_path / "nuevo.pdf"
+        old_txt = tmp_path / "viejo.txt"
+        old_dir = tmp_path / "carpeta.pdf"
+        for path in (old_pdf, new_pdf, old_txt):
+            path.write_bytes(b"%PDF-")
+        old_dir.mkdir()
+        for path in (old_pdf, old_txt, old_dir):
+            os.utime(path, (old_time, old_time))
+
+        generator.cleanup_old_pdfs(days_old=7)
+
+        assert not old_pdf.exists()
+        assert new_pdf.exists()
+        assert old_txt.exists()
+        assert old_dir.exists()
+
+    def test_missing_directory(self, generator, tmp_path):
+        """Test que un directorio inexistente no lanza excepción"""
+        generator.output_dir = str(tmp_path / "no_existe")
+
+        generator.cleanup_old_pdfs()
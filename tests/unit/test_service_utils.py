@@ -7,12 +7,14 @@ Cubre:
 - Retorno correcto de todos los servicios
 - Orden correcto de inicialización
 - Compartir ExcelService entre servicios
+- close_services() al apagar la aplicación
 """
-from unittest.mock import Mock, patch, MagicMock, call
+import asyncio
+from unittest.mock import AsyncMock, Mock, patch, MagicMock, call
 
 import pytest
 
-from app.utils.service_utils import get_services
+from app.utils.service_utils import close_services, get_services
 
 
 class TestGetServices:
@@ -462,3 +464,22 @@ class TestServiceUtilsEdgeCases:
             # Y todos deben ser retornados
             assert len(result) == 5
             assert all(r is not None for r in result)
+
+
+class TestCloseServices:
+    """Tests para close_services()"""
+
+    def test_closes_openai_client(self):
+        """Test que cierra el cliente asíncrono de OpenAI"""
+        mock_openai = Mock()
+        mock_openai.aclose = AsyncMock()
+
+        with patch('app.utils.service_utils.openai_service', mock_openai):
+            asyncio.run(close_services())
+
+        mock_openai.aclose.assert_awaited_once()
+
+    def test_noop_when_not_initialized(self):
+        """Test que no falla si los servicios no se inicializaron"""
+        with patch('app.utils.service_utils.openai_service', None):
+            asyncio.run(close_services())
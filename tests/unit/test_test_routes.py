@@ -2,7 +2,7 @@
 Tests para rutas de prueba y debugging
 """
 import pytest
-from unittest.mock import patch, MagicMock
+from unittest.mock import patch, AsyncMock, MagicMock
 from fastapi.testclient import TestClient
 
 
@@ -76,7 +76,7 @@ class TestTestRoutes:
         """POST /test-pdf-send con número válido genera y envía PDF"""
         # Mock de servicios
         mock_pdf_generator = MagicMock()
-        mock_pdf_generator.generate_quote_pdf.return_value = "/tmp/test_quote.pdf"
+        mock_pdf_generator.generate_quote_pdf_async = AsyncMock(return_value="/tmp/test_quote.pdf")
 
         mock_whatsapp_sender = MagicMock()
         mock_whatsapp_sender.send_pdf_document.return_value = True
@@ -99,6 +99,7 @@ class TestTestRoutes:
         assert data["status"] == "success"
         assert data["pdf_generated"] is True
         assert data["pdf_sent_whatsapp"] is True
+        mock_pdf_generator.generate_quote_pdf_async.assert_awaited_once()
 
     def test_test_pdf_send_with_invalid_phone(self, client, admin_headers):
         """POST /test-pdf-send con número inválido debe fallar"""
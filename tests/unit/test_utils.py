@@ -0,0 +1,48 @@
+"""
+Tests unitarios para app/services/utils.py
+
+Cubre:
+- Conversión del flete y del glaseo en parse_ai_analysis_to_query()
+"""
+import pytest
+
+from app.services.utils import parse_ai_analysis_to_query
+
+
+def _analysis(**extra):
+    """Análisis mínimo de IA con intención de precio"""
+    return {'intent': 'pricing', 'product': 'HLSO', 'size': '16/20', **extra}
+
+
+class TestParseAiAnalysisToQuery:
+    """Tests para parse_ai_analysis_to_query()"""
+
+    @pytest.mark.parametrize("is_ddp", [False, True])
+    def test_numeric_flete(self, is_ddp):
+        """Test que un flete numérico se convierte a float"""
+        query = parse_ai_analysis_to_query(_analysis(flete_custom="0.25", is_ddp=is_ddp))
+
+        assert query['flete_custom'] == 0.25
+        assert query['flete_solicitado'] is True
+
+    @pytest.mark.parametrize("flete", ["abc", [1]])
+    def test_invalid_flete_ignored(self, flete):
+        """Test que un flete no numérico se descarta sin lanzar excepción"""
+        query = parse_ai_analysis_to_query(_analysis(flete_custom=flete))
+
+        assert query['flete_custom'] is None
+        assert query['flete_solicitado'] is False
+
+    def test_invalid_flete_ddp_requests_value(self):
+        """Test que en DDP un flete inválido obliga a pedir el valor al usuario"""
+        query = parse_ai_analysis_to_query(_analysis(flete_custom="abc", is_ddp=True))
+
+        assert query['flete_custom'] is None
+        assert query['flete_solicitado'] is True
+
+    @pytest.mark.parametrize("glaseo,expected", [("20", 0.2), (0.1, 0.1), ("abc", None)])
+    def test_glaseo_factor(self, glaseo, expected):
+        """Test que el glaseo se normaliza a factor y uno inválido queda en None"""
+        query = parse_ai_analysis_to_query(_analysis(glaseo_factor=glaseo))
+
+        assert query['glaseo_factor'] == expected